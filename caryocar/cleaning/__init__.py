@@ -1,10 +1,15 @@
-from .namesmap import NamesMap
+from .namesmap import NamesMap, NamesMapFile
 from .namesatomizer import NamesAtomizer
+from .diskcache import DiskCache
+from .namesindex import NamesIndex
 
 from .misc import namesFromString
+from .misc import namesFromColumn, NamesColumn
 from .misc import atomizeNames
 from .misc import getNamesList
 from .misc import normalize
+from .misc import normalize_many
 from .misc import read_NamesMap_fromJson
+from .misc import read_NamesMap_fromBinary
 from .misc import getNamesIndexes
                   
\ No newline at end of file
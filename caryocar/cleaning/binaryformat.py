@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Binary tables format module
+
+Names maps and replaces tables are stored in a compact binary format, made of a small json header
+followed by raw numpy arrays. Strings are interned in a sorted strings table, and names are stored
+as integer codes into that table. Arrays are 8-byte aligned, so that files can be memory-mapped and
+looked up without being parsed as a whole.
+"""
+
+import json
+import numpy
+from collections.abc import Mapping
+
+MAGIC = b'CARYOCAR'
+_ALIGN = 8
+
+
+def isBinaryFile(filepath):
+    """
+    Checks whether a file is in the caryocar binary tables format.
+    """
+    with open(filepath, 'rb') as f:
+        return f.read(len(MAGIC))==MAGIC
+
+
+def writeTables(filename, kind, arrays, meta=None):
+    """
+    Writes numpy arrays to a binary tables file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file to be created.
+
+    kind : str
+        The kind of data stored in the file (e.g. 'namesmap'), checked on reading.
+
+    arrays : dict
+        Numpy arrays keyed by name.
+
+    meta (optional) : dict
+        Json serializable metadata stored in the header.
+    """
+    arrays = dict( (name,numpy.ascontiguousarray(arr)) for name,arr in arrays.items() )
+    specs, offset = dict(), 0
+    for name,arr in arrays.items():
+        specs[name] = [ arr.dtype.str, offset, len(arr) ]
+        offset += -(-arr.nbytes//_ALIGN)*_ALIGN
+
+    header = json.dumps( {'kind':kind, 'meta':meta or {}, 'arrays':specs} ).encode('utf-8')
+    header += b' '*(-len(header)%_ALIGN)
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(numpy.array([len(header)], dtype='<u8').tobytes())
+        f.write(header)
+        for name,arr in arrays.items():
+            f.write(arr.tobytes())
+            f.write(b'\x00'*(-arr.nbytes%_ALIGN))
+
+
+def readTables(filepath, kind, mmap=True):
+    """
+    Reads numpy arrays from a binary tables file.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the file.
+
+    kind : str
+        The kind of data expected in the file. A ValueError is raised if it does not match.
+
+    mmap : bool, default True
+        If set to True the file is memory-mapped, and arrays are read-only views on it. Otherwise
+        arrays are read into memory.
+
+    Returns
+    -------
+    A 2-tuple (arrays, meta), where arrays is a dict of numpy arrays keyed by name.
+    """
+    with open(filepath, 'rb') as f:
+        if f.read(len(MAGIC))!=MAGIC:
+            raise ValueError("'{}' is not a caryocar binary file".format(filepath))
+        headerLen = int(numpy.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(headerLen).decode('utf-8'))
+        if header['kind']!=kind:
+            raise ValueError("'{}' stores a {}, not a {}".format(filepath, header['kind'], kind))
+        start = len(MAGIC)+8+headerLen
+
+        if mmap:
+            buf = numpy.memmap(filepath, dtype=numpy.uint8, mode='r')
+        else:
+            buf = numpy.frombuffer(f.read(), dtype=numpy.uint8)
+            start = 0
+
+    arrays = dict()
+    for name,(dtype,offset,count) in header['arrays'].items():
+        dtype = numpy.dtype(dtype)
+        arrays[name] = buf[start+offset:start+offset+count*dtype.itemsize].view(dtype)
+    return arrays, header['meta']
+
+
+def codesDtype(n):
+    """
+    The smallest signed integer type for codes into a table with n entries.
+    """
+    return numpy.int32 if n<2**31 else numpy.int64
+
+
+def encodeStrings(strings):
+    """
+    Interns strings into a sorted strings table.
+
+    Parameters
+    ----------
+    strings : iterable of str
+        Strings to be interned. They must not contain NUL characters.
+
+    Returns
+    -------
+    A 3-tuple (codes, data, offsets), where codes is a dict mapping each string to its position in
+    the table, data is a uint8 array with NUL terminated utf-8 encoded strings and offsets is an
+    integer array with the start of each string in data (plus the end of data).
+    """
+    labels = sorted(set(strings))
+    if any( not isinstance(s,str) for s in labels ):
+        raise ValueError("Only strings can be stored in binary tables.")
+    blob = '\x00'.join(labels)
+    if blob.count('\x00')!=max(len(labels)-1,0):
+        raise ValueError("Strings stored in binary tables must not contain NUL characters.")
+
+    encoded = [ s.encode('utf-8') for s in labels ]
+    data = numpy.frombuffer( b''.join( e+b'\x00' for e in encoded ), dtype=numpy.uint8 )
+    offsets = numpy.zeros(len(labels)+1, dtype=numpy.uint32 if len(data)<2**32 else numpy.int64)
+    numpy.cumsum([ len(e)+1 for e in encoded ], out=offsets[1:])
+    return dict( (s,i) for i,s in enumerate(labels) ), data, offsets
+
+
+class StringsTable:
+    """
+    A sorted strings table, as written by `encodeStrings`. Strings are decoded on access, and looked
+    up by binary search, so that a table can be used without decoding it as a whole.
+
+    Parameters
+    ----------
+    data : numpy array of uint8
+        NUL terminated utf-8 encoded strings.
+
+    offsets : numpy array of ints
+        Start of each string in data, plus the end of data.
+    """
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets)-1
+
+    def __getitem__(self, i):
+        return self._data[self._offsets[i]:self._offsets[i+1]-1].tobytes().decode('utf-8')
+
+    def _bytesAt(self, i):
+        return self._data[self._offsets[i]:self._offsets[i+1]-1].tobytes()
+
+    def index(self, s):
+        """
+        Returns the position of a string in the table, or -1 if it is not found. Utf-8 encoded
+        strings are sorted in the same order as python strings, so encoded bytes are compared.
+        """
+        key = s.encode('utf-8')
+        lo, hi = 0, len(self)
+        while lo<hi:
+            mid = (lo+hi)//2
+            if self._bytesAt(mid)<key: lo = mid+1
+            else: hi = mid
+        return lo if lo<len(self) and self._bytesAt(lo)==key else -1
+
+    def decodeAll(self):
+        """
+        Decodes all strings in the table at once, as a list.
+        """
+        if len(self)==0:
+            return []
+        return self._data[:-1].tobytes().decode('utf-8').split('\x00')
+
+
+def writeStringsMap(filename, kind, d, meta=None, extraArrays=None):
+    """
+    Writes a dict of strings to strings to a binary tables file, as two arrays of codes sorted by keys.
+    """
+    codes, data, offsets = encodeStrings( list(d.keys())+list(d.values()) )
+    sortedKeys = sorted(d)
+    keys = numpy.array( [ codes[k] for k in sortedKeys ], dtype=codesDtype(len(codes)) )
+    values = numpy.array( [ codes[d[k]] for k in sortedKeys ], dtype=codesDtype(len(codes)) )
+    arrays = {'strings_data':data, 'strings_offsets':offsets, 'keys':keys, 'values':values}
+    arrays.update(extraArrays or {})
+    writeTables(filename, kind, arrays, meta)
+
+
+def readStringsMap(arrays, keysArray='keys', valuesArray='values'):
+    """
+    Decodes a dict of strings to strings from arrays read from a binary tables file.
+    """
+    strings = StringsTable(arrays['strings_data'], arrays['strings_offsets']).decodeAll()
+    return dict( zip( map(strings.__getitem__, arrays[keysArray].tolist()),
+                      map(strings.__getitem__, arrays[valuesArray].tolist()) ) )
+
+
+class BinaryMapping(Mapping):
+    """
+    A read-only mapping of strings to strings, backed by arrays of a binary tables file. Keys are
+    looked up by binary search, so that the file does not have to be parsed as a whole.
+
+    Parameters
+    ----------
+    strings : StringsTable
+        The strings table of the file.
+
+    keys : numpy array of ints
+        Sorted codes of keys.
+
+    values : numpy array of ints
+        Codes of values, aligned with keys. Negative codes mark keys whose values cannot be
+        looked up, for which `missingValue` is called.
+
+    missingValue (optional) : function
+        Called with a key whose value code is negative. It must raise an exception.
+    """
+    def __init__(self, strings, keys, values, missingValue=None):
+        self._strings = strings
+        self._keys = keys
+        self._values = values
+        self._missingValue = missingValue
+
+    def _position(self, key):
+        code = self._strings.index(key) if isinstance(key,str) else -1
+        if code<0:
+            return -1
+        i = int(numpy.searchsorted(self._keys, self._keys.dtype.type(code)))
+        return i if i<len(self._keys) and self._keys[i]==code else -1
+
+    def __getitem__(self, key):
+        i = self._position(key)
+        if i<0:
+            raise KeyError(key)
+        v = int(self._values[i])
+        if v<0:
+            self._missingValue(key)
+        return self._strings[v]
+
+    def __contains__(self, key):
+        return self._position(key)>=0
+
+    def __iter__(self):
+        for k in self._keys.tolist():
+            yield self._strings[k]
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Disk Cache module
+"""
+
+import json
+import sqlite3
+import hashlib
+import types
+
+
+def _hashCode(h, code):
+    # nested code objects (e.g. of comprehensions) are hashed by content, since their repr holds
+    # memory addresses
+    h.update( code.co_code )
+    h.update( repr(code.co_names).encode('utf-8') )
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType): _hashCode(h, c)
+        else: h.update( repr(c).encode('utf-8') )
+
+
+def _codeNames(code):
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType): names |= _codeNames(c)
+    return names
+
+
+def _hashPart(h, p, seen):
+    func = getattr(p, '__wrapped__', p) # e.g. functions memoized with lru_cache
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        if id(func) in seen:
+            return
+        seen.add(id(func))
+        _hashCode(h, code)
+        # globals the function refers to, such as the functions it calls and the tables they use,
+        # and variables it captures are fingerprinted too
+        globs = getattr(func, '__globals__', {})
+        for name in sorted( n for n in _codeNames(code) if n in globs ):
+            h.update( name.encode('utf-8') )
+            _hashPart(h, globs[name], seen)
+        for cell in (func.__closure__ or ()):
+            _hashPart(h, cell.cell_contents, seen)
+    elif isinstance(p, types.ModuleType) or callable(p):
+        h.update( '{}.{}'.format(getattr(p,'__module__',''), getattr(p,'__qualname__',getattr(p,'__name__',repr(p)))).encode('utf-8') )
+    else:
+        h.update( json.dumps(p, sort_keys=True, ensure_ascii=False, default=repr).encode('utf-8') )
+    h.update(b'\x00')
+
+
+def fingerprint(*parts):
+    """
+    Computes a fingerprint for the parts that determine results of a cached operation. Functions
+    are fingerprinted from their bytecode and constants, along with the global variables and
+    functions they refer to (recursively) and the variables they capture. Other parts are
+    fingerprinted from their json representation.
+
+    Parameters
+    ----------
+    parts : functions, strings, dicts or other json serializable objects
+        Parts to be fingerprinted, e.g. an atomizing function and a replaces dict.
+
+    Returns
+    -------
+    A hex digest string.
+
+    Note
+    ----
+    Modules, classes and builtin functions are fingerprinted from their names only, so changes in
+    their implementation (e.g. after a library upgrade) do not change the fingerprint.
+    """
+    h = hashlib.sha1()
+    seen = set()
+    for p in parts:
+        _hashPart(h, p, seen)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    A persistent cache of results of names operations (e.g. atomization and normalization), stored
+    in a sqlite database. Results are keyed by the input string and by a fingerprint of the operation
+    which produced them, so that results of different operations never mix. The cache has a bounded
+    size, and the least recently used entries are evicted when it is exceeded.
+
+    Parameters
+    ----------
+    path : str
+        Path to the database file. It is created if it does not exist.
+
+    maxSize : int, default 1000000
+        The maximum number of entries stored in the cache.
+
+    Class methods
+    -------------
+    .getMany
+    .setMany
+    .clear
+    .close
+
+    Examples
+    --------
+    >>> cache = DiskCache('names_cache.db')
+    >>> fp = fingerprint(normalize)
+    >>> cache.setMany(fp, {'Silva, J.':'silva,j'})
+    >>> cache.getMany(fp, ['Silva, J.','Souza, A.'])
+    {'Silva, J.': 'silva,j'}
+    """
+    _chunkSize = 500 # number of keys per query, bounded by sqlite's variables limit
+
+    def __init__(self, path, maxSize=1000000):
+        self._path = path
+        self._maxSize = maxSize
+        self._conn = sqlite3.connect(path)
+        self._conn.execute( "CREATE TABLE IF NOT EXISTS entries ("
+                            "fingerprint TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                            "used INTEGER NOT NULL, PRIMARY KEY (fingerprint, key))" )
+        self._conn.execute( "CREATE INDEX IF NOT EXISTS entries_used ON entries (used)" )
+        self._conn.commit()
+        self._clock = self._conn.execute("SELECT COALESCE(MAX(used),0) FROM entries").fetchone()[0]
+        # the number of entries is counted once, and then kept up to date by setMany and clear
+        self._size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        # entries read are marked as used in memory, and written along with the next changes
+        self._uses = dict()
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def __len__(self):
+        return self._size
+
+    def _writeUses(self):
+        """
+        Writes the access times of entries read since the last write, without committing.
+        """
+        if len(self._uses)>0:
+            self._conn.executemany( "UPDATE entries SET used=? WHERE fingerprint=? AND key=?",
+                                    ( (now,fp,k) for (fp,k),now in self._uses.items() ) )
+            self._uses = dict()
+
+    def _countKeys(self, fingerprint, keys):
+        """
+        Counts how many of the keys are stored for a fingerprint.
+        """
+        n = 0
+        for i in range(0, len(keys), self._chunkSize):
+            chunk = keys[i:i+self._chunkSize]
+            query = "SELECT COUNT(*) FROM entries WHERE fingerprint=? AND key IN ({})".format(','.join('?'*len(chunk)))
+            n += self._conn.execute(query, [fingerprint]+chunk).fetchone()[0]
+        return n
+
+    def getMany(self, fingerprint, keys):
+        """
+        Looks up results for several keys at once. Entries found are marked as recently used, but
+        access times are only written to the database by the next `setMany` or `close` call, so
+        lookups never write to the database.
+
+        Parameters
+        ----------
+        fingerprint : str
+            Fingerprint of the operation which produced the results.
+
+        keys : iterable of str
+            Input strings to look up.
+
+        Returns
+        -------
+        A dict with results of keys found in the cache. Lists in results are returned as lists.
+        """
+        keys = list(set( k for k in keys if isinstance(k,str) ))
+        res = dict()
+        for i in range(0, len(keys), self._chunkSize):
+            chunk = keys[i:i+self._chunkSize]
+            query = "SELECT key, value FROM entries WHERE fingerprint=? AND key IN ({})".format(','.join('?'*len(chunk)))
+            res.update( (k,json.loads(v)) for k,v in self._conn.execute(query, [fingerprint]+chunk) )
+
+        if len(res)>0:
+            now = self._tick()
+            self._uses.update( ((fingerprint,k),now) for k in res )
+        return res
+
+    def setMany(self, fingerprint, items):
+        """
+        Stores results for several keys at once, evicting the least recently used entries if the
+        maximum size is exceeded.
+
+        Parameters
+        ----------
+        fingerprint : str
+            Fingerprint of the operation which produced the results.
+
+        items : dict or iterable of 2-tuples
+            Pairs (key, result), where results are json serializable (tuples are stored as lists).
+        """
+        items = dict( (k,v) for k,v in (items.items() if isinstance(items,dict) else items) if isinstance(k,str) )
+        # entries replaced do not change the size of the cache
+        replaced = self._countKeys(fingerprint, list(items))
+        # entries read before are marked as used first, so that they are not evicted
+        self._writeUses()
+        now = self._tick()
+        self._conn.executemany( "INSERT OR REPLACE INTO entries (fingerprint, key, value, used) VALUES (?,?,?,?)",
+                                ( (fingerprint, k, json.dumps(v,ensure_ascii=False), now) for k,v in items.items() ) )
+        self._size += len(items) - replaced
+        excess = self._size - self._maxSize
+        if excess>0:
+            self._conn.execute( "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY used LIMIT ?)", (excess,) )
+            self._size -= excess
+        self._conn.commit()
+
+    def clear(self, fingerprint=None):
+        """
+        Removes all entries from the cache, or only those of an operation if its fingerprint is set.
+        """
+        self._uses = dict( (k,t) for k,t in self._uses.items() if fingerprint is not None and k[0]!=fingerprint )
+        if fingerprint is None:
+            self._conn.execute("DELETE FROM entries")
+            self._size = 0
+        else:
+            self._size -= self._conn.execute("DELETE FROM entries WHERE fingerprint=?", (fingerprint,)).rowcount
+        self._conn.commit()
+
+    def close(self):
+        """
+        Writes access times of entries read, and closes the connection to the database file.
+        """
+        self._writeUses()
+        self._conn.commit()
+        self._conn.close()
+
+
+def openDiskCache(diskCache):
+    """
+    Returns a DiskCache from either a DiskCache instance, a path to a database file or None.
+    """
+    if diskCache is None or isinstance(diskCache, DiskCache):
+        return diskCache
+    return DiskCache(diskCache)
@@ -4,8 +4,14 @@
 Names Cleaning module
 """
 from . import NamesMap
+from .namesmap import NamesMapFile
+from .namesindex import NamesIndex
+from ..encoding import factorize
 import json, re, string, unicodedata
-from collections import Counter
+import numpy
+from functools import lru_cache
+from operator import methodcaller
+from itertools import chain
 from warnings import warn
 
 
@@ -45,8 +51,7 @@ def namesFromString( namesStr, delim=';', unique=False, preserveOrder=False ):
         namesSplit = namesStr.split(delim)
         
     elif type(delim)==list:
-        delim = [ '\|' if i=='|' else i for i in delim ] 
-        namesSplit = re.split( '|'.join( c for c in delim ), namesStr)
+        namesSplit = _delimPattern(tuple(delim)).split(namesStr)
     
     namesList = [ n for n in [ name.strip() for name in namesSplit ] if n!='' ]
     
@@ -64,6 +69,131 @@ def namesFromString( namesStr, delim=';', unique=False, preserveOrder=False ):
     return namesList
 
 
+@lru_cache(maxsize=64)
+def _delimPattern(delim):
+    """
+    Compiles a tuple of delimiters into a regular expression for splitting. Delimiters are
+    regular expressions themselves, except for the '|' character, which is escaped.
+    """
+    return re.compile( '|'.join( '\\|' if i=='|' else i for i in delim ) )
+
+
+# separators of rows and names in the joined column string
+_ROWSEP, _NAMESEP = '\x00', '\x1f'
+
+# anchors and lookarounds, whose matches depend on the text around them
+_contextualPattern = re.compile(r'\\[AZ]|\$|(?<!\[)\^|\(\?<?[=!]')
+
+
+class NamesColumn:
+    """
+    Names atomized from a names column, stored as a flat array of names and row offsets: names of
+    the i-th row are tokens[offsets[i]:offsets[i+1]]. It can be iterated as a list of lists of
+    names, and network models (SCN, CWN) consume its offsets directly.
+
+    Parameters
+    ----------
+    tokens : numpy array of objects
+        Names of all rows, in order.
+
+    offsets : numpy array of ints
+        Start of names of each row in tokens, plus the end of tokens.
+    """
+    def __init__(self, tokens, offsets):
+        self.tokens = tokens
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i]:self.offsets[i+1]].tolist()
+
+    def __iter__(self):
+        tokens, offsets = self.tokens.tolist(), self.offsets.tolist()
+        return ( tokens[a:b] for a,b in zip(offsets[:-1],offsets[1:]) )
+
+    def toLists(self):
+        """
+        Returns names of each row as a list of lists.
+        """
+        return list(self)
+
+
+def _splitJoined( rows, delim ):
+    # rows are joined into a single string, so that delimiters are replaced in a single pass. Returns
+    # None if separators cannot be told apart from the rows contents.
+    blob = _ROWSEP.join(rows)
+    if blob.count(_ROWSEP)!=len(rows)-1 or _NAMESEP in blob:
+        return None
+    if type(delim)==str:
+        blob = blob.replace(delim, _NAMESEP)
+    else:
+        pattern = _delimPattern(tuple(delim))
+        # delimiters bound to the start or end of a row, or to their surroundings, would also match
+        # across rows, so rows are split one by one
+        if _contextualPattern.search(pattern.pattern):
+            return None
+        blob = pattern.sub(_NAMESEP, blob)
+        # delimiters matching row separators would merge rows
+        if blob.count(_ROWSEP)!=len(rows)-1:
+            return None
+    lengths = numpy.fromiter( map(methodcaller('count',_NAMESEP), blob.split(_ROWSEP)), dtype=numpy.int64, count=len(rows) )+1
+    return blob.replace(_ROWSEP,_NAMESEP).split(_NAMESEP), lengths
+
+
+def namesFromColumn( col, delim=';', unique=False, preserveOrder=False ):
+    """
+    Atomizes names in a whole names column using specified delimiters. It is equivalent to applying
+    `namesFromString` to each row, but rows are split at once, and the result is stored as a flat
+    array of names with row offsets instead of a list per row.
+    
+    Parameters
+    ----------
+    col : pandas.Series or iterable of str
+        Names column to be atomized. Rows which are not strings (e.g. missing values) have no names.
+        
+    delim : str or list, default ';'
+        Delimiter that is used to separate names in the names strings. 
+        If a list of delimiters is passed they will be concatenated
+        into a regular expression for splitting.
+    
+    unique : bool, default False
+        If set to true, names are unique within each row. Names are always kept
+        in the order in which they first appear, so `preserveOrder` is implied.
+    
+    preserveOrder : bool, default False
+        Kept for compatibility with `namesFromString`.
+        
+    Returns
+    -------
+        A NamesColumn, with a flat array of names and row offsets.
+    """
+    rows = [ r if isinstance(r,str) else '' for r in col ]
+    split = _splitJoined(rows, delim) if len(rows)>0 else ([], numpy.zeros(0, dtype=numpy.int64))
+    if split is None:
+        namesLists = [ namesFromString(r, delim) for r in rows ]
+        split = list(chain.from_iterable(namesLists)), numpy.fromiter( map(len,namesLists), dtype=numpy.int64, count=len(rows) )
+    tokens, lengths = split
+    
+    # names are stripped and empty names dropped in bulk, keeping track of rows
+    tokens = numpy.array( list(map(str.strip, tokens)), dtype=object )
+    rowsIx = numpy.repeat( numpy.arange(len(rows), dtype=numpy.int64), lengths )
+    keep = numpy.fromiter( map(len,tokens), dtype=numpy.int64, count=len(tokens) )>0
+    tokens, rowsIx = tokens[keep], rowsIx[keep]
+    
+    if unique and len(tokens)>0:
+        # first occurrences of each (row, name) pair are kept
+        codes = factorize(tokens)[0]
+        first = numpy.unique( rowsIx*(codes.max()+1) + codes, return_index=True )[1]
+        first.sort()
+        tokens, rowsIx = tokens[first], rowsIx[first]
+    
+    offsets = numpy.zeros(len(rows)+1, dtype=numpy.int64)
+    numpy.cumsum( numpy.bincount(rowsIx, minlength=len(rows)), out=offsets[1:] )
+    return NamesColumn(tokens, offsets)
+
+
 def atomizeNames( col, operation=None, replaces=None ):
     """
     Applies an atomization operation on a names column, which must be a pandas Series. 
@@ -99,7 +229,7 @@ def getNamesList( col, with_counts=False, orderBy=None ):
     
     Parameters
     ----------
-    col : pandas.Series
+    col : pandas.Series or NamesColumn
         Atomized names column from which to retrieve names.
     
     with_counts : bool
@@ -114,8 +244,14 @@ def getNamesList( col, with_counts=False, orderBy=None ):
     if orderBy not in [ None, "alphabetic", "counts"]:
         raise ValueError("Invalid argument for 'orderBy': {}".format(orderBy))
     
+    # names are encoded as integers in a single pass over the column, and counted at once
+    if hasattr(col,'tokens'):
+        codes, names = factorize( col.tokens )
+    else:
+        codes, names = factorize( list(chain.from_iterable(col)) )
+    
     if with_counts or orderBy=="counts":
-        l = [ (n,c) for (n,c) in Counter( n for nlst in col for n in nlst ).items() ] 
+        l = list(zip( names, numpy.bincount(codes, minlength=len(names)).tolist() ))
         if orderBy=="alphabetic":
             return sorted( l, key=lambda x: x[0] )
         elif orderBy=="counts":
@@ -129,18 +265,36 @@ def getNamesList( col, with_counts=False, orderBy=None ):
                 
     else:
         if orderBy=="alphabetic":
-            return sorted(list(set( n for nlst in col for n in nlst )))
+            return sorted(names)
         else:
-            return list(set( n for nlst in col for n in nlst ))
+            return names
 
 
 # ===================
 # Names normalization
 # -------------------
 
+# bytes deleted from normalized names: all but ascii letters, and all but ascii letters and commas
+_nonLettersBytes = bytes( b for b in range(256) if chr(b) not in string.ascii_letters )
+_nonLettersCommaBytes = bytes( b for b in _nonLettersBytes if b!=ord(',') )
+
+@lru_cache(maxsize=2**18)
+def _normalize(name, normalizationForm):
+    # accents are separated from letters by unicode normalization and dropped by ascii encoding,
+    # and then non-letters are deleted by a translation table, in a single pass
+    name = name.lower()
+    normName = unicodedata.normalize(normalizationForm, name)
+    if normName.count(',')==name.count(','):
+        return normName.encode('ascii','ignore').translate(None,_nonLettersCommaBytes).decode('ascii')
+    
+    # unicode normalization turned some characters into commas, so names are split beforehand
+    return ','.join( unicodedata.normalize(normalizationForm, p).encode('ascii','ignore').translate(None,_nonLettersBytes).decode('ascii') for p in name.split(',') )
+
+
 def normalize(name, normalizationForm='NFKD'):
     """
     A simple normalization function. A name is split on commas, periods and spaces are removed and it is then set to a unicode normalization form.
+    Results are memoized, so repeated names are normalized only once.
     
     Parameters
     ----------
@@ -156,14 +310,27 @@ def normalize(name, normalizationForm='NFKD'):
     "Leite, A.M." -> "leite,am"
     "J. R. Souza" -> "jrsouza"
     """
-    name = name.lower() # to lowecase
-    name = name.replace('.','') # remove periods
-    name_ls = tuple( part.strip() for part in name.split(',') ) # split and strip names into tuples
+    return _normalize(name, normalizationForm)
+
 
-    normalize = lambda s: ''.join( x for x in unicodedata.normalize(normalizationForm, s) if x in string.ascii_letters ) # remove accents
-    name_ls = tuple( normalize(name) for name in name_ls )
+def normalize_many(names, normalizationForm='NFKD'):
+    """
+    Normalizes a list of names with the `normalize` function. Each distinct name is normalized only once.
+    
+    Parameters
+    ----------
+    names : iterable of str
+        Names to be normalized.
     
-    return ','.join(name_ls)
+    normalizationForm: str, default 'NFKD'
+        Unicode normalization form to apply during the process.
+    
+    Returns
+    -------
+        A list with normalized names, in the same order as the input.
+    """
+    memo = dict()
+    return [ memo[n] if n in memo else memo.setdefault(n, _normalize(n,normalizationForm)) for n in names ]
 
 
 # ------------------
@@ -202,21 +369,58 @@ def read_NamesMap_fromJson(filepath, normalizationFunc=None):
 
 
 
+def read_NamesMap_fromBinary(filepath, normalizationFunc=None, lazy=False):
+    """
+    Creates a NamesMap instance from a binary file written by `NamesMap.write_toBinary`.
+    
+    Parameters
+    ----------
+    filepath : str
+        Path to the binary file containing the map
+        
+    normalizationFunc : function
+        A normalization function to be passed to the NamesMap constructor. If it is 
+        not set a warning is issued, as the NamesMap will not be assigned to any
+        normalization rule. It is ignored if lazy is True.
+        
+    lazy : bool, default False
+        If set to True the file is not read, but memory-mapped, and a read-only NamesMapFile is
+        returned. Names are looked up in the file on demand.
+    """
+    if lazy:
+        return NamesMapFile(filepath)
+    
+    if normalizationFunc is None:
+        warn("A names map was created without a normalization function!")
+    return NamesMapFile(filepath).toNamesMap(normalizationFunc)
+
+
+
 # ==============
 # Names indexing
 # --------------
 
-def getNamesIndexes( df, atomizedNamesCol, namesMap=None ):
-    # split_names_col is a column with names already split
-    namesIndexes = dict( (name,[]) for name in namesMap.values() )
-    for i,names in df[atomizedNamesCol].iteritems():
-        for name in names:
-            if namesMap is not None:
-                try:
-                    namesIndexes[namesMap[name]].append(i)
-                except KeyError:
-                    pass
-            else:
-                namesIndexes[name].append(i)
-            
-    return namesIndexes
+def getNamesIndexes( df, atomizedNamesCol, namesMap=None, asIndex=False ):
+    """
+    Gets the records in which each name appears.
+    
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The records data frame.
+        
+    atomizedNamesCol : str
+        Name of a column with names already split (atomized) into lists.
+        
+    namesMap (optional) : dict
+        A mapping used to normalize names. Names which are not in the map are ignored.
+        
+    asIndex : bool, default False
+        If set to True a NamesIndex, backed by integer arrays, is returned instead of a dict.
+        
+    Returns
+    -------
+    A dict keyed by names, with lists of labels of the records in which they appear; or a NamesIndex.
+    """
+    idx = NamesIndex.fromColumn( df[atomizedNamesCol], namesMap=namesMap )
+    return idx if asIndex else idx.toDict()
@@ -6,7 +6,17 @@ Names Atomizer module
 """
 
 import json
-from collections import Counter
+import numpy
+from itertools import chain
+from ..encoding import factorize
+from .diskcache import fingerprint, openDiskCache
+from .binaryformat import isBinaryFile, writeStringsMap, readTables, readStringsMap
+
+def _byLengthAndCount(x):
+    """
+    Default sorting key of cached names: shortest names first, and then most frequent names first.
+    """
+    return [len(x[0]),-x[2]]
 
 class NamesAtomizer:
     """
@@ -29,19 +39,28 @@ class NamesAtomizer:
     .writeReplaces
     .readReplaces
     .getCachedNames
+    .getNamesList
     """
         
-    def __init__(self, atomizeOp, replaces=None):
+    def __init__(self, atomizeOp, replaces=None, diskCache=None):
         """
         Initialization of NamesAtomizer class.
         Parameters
         ----------
         atomizeOp : function
         replaces: list of tuples
+        diskCache: caryocar.cleaning.DiskCache or str (optional)
+            A persistent cache (or a path to its file) where atomized names are stored, keyed by
+            names strings and by a fingerprint of the atomizing operation and the replaces. Strings
+            found in the cache are not atomized again.
         """
         self._replaces = self._buildReplaces(replaces)
+        self._replacesFingerprint = None
         self._operation = atomizeOp
         self._cache = None
+        self._cacheUniques = None
+        self._namesStats = None
+        self._diskCache = openDiskCache(diskCache)
         
     def _buildReplaces(self, replacesList):
         """
@@ -65,7 +84,7 @@ class NamesAtomizer:
                 
         return res                 
     
-    def atomize(self, col, operation=None, withReplacing=True, cacheResult=True):
+    def atomize(self, col, operation=None, withReplacing=True, cacheResult=True, unique=False):
         """
         This method takes a column with names strings and atomizes them
         
@@ -84,9 +103,22 @@ class NamesAtomizer:
         
         cacheResult : bool, default True
             If set to True the resulting series is cached for later use.
+            
+        unique : bool, default False
+            If set to True the column is factorized, and replacing and atomization are performed 
+            only once for each distinct names string. Atomized names are stored as tuples, which
+            are shared by all rows with the same names string. This is much faster and lighter 
+            for columns with many repeated values.
         """
         if operation is None:
             operation = self._operation
+            
+        if unique:
+            return self._atomizeUnique(col, operation, withReplacing, cacheResult)
+        
+        # with a disk cache distinct strings are looked up, and results are copied to each row
+        if self._diskCache is not None:
+            return self._atomizeUnique(col, operation, withReplacing, cacheResult).apply(list)
         
         if withReplacing:
             col=col.replace(self._replaces)
@@ -94,32 +126,110 @@ class NamesAtomizer:
         atomizedCol = col.apply(operation)
         if cacheResult:
             self._cache = (col, atomizedCol)
+            self._cacheUniques = None
+            self._namesStats = None
         return atomizedCol
     
+    def _atomizeUnique(self, col, operation, withReplacing, cacheResult):
+        codes, uniques = col.factorize()
+        uniques = list(uniques)
+        
+        # missing values are encoded as -1, so they are given a code of their own
+        missing = codes<0
+        if missing.any():
+            codes = codes.copy()
+            codes[missing] = len(uniques)
+            uniques.append( col[missing].iloc[0] )
+        
+        # strings atomized in previous runs are looked up in the disk cache
+        hits = dict()
+        if self._diskCache is not None:
+            fp = self._getFingerprint(operation, withReplacing)
+            hits = self._diskCache.getMany(fp, uniques)
+        
+        # distinct strings may become equal after replacing, so they are encoded again
+        replaced = [ self._replaces.get(u,u) if withReplacing and isinstance(u,str) else u for u in uniques ]
+        ix, atomized, misses = dict(), [], dict()
+        recodes = numpy.empty(len(uniques), dtype=codes.dtype)
+        for i,(u,r) in enumerate(zip(uniques,replaced)):
+            if r not in ix:
+                ix[r] = len(ix)
+                atomized.append( tuple(hits[u]) if u in hits else tuple(operation(r)) )
+            if u not in hits:
+                misses[u] = atomized[ix[r]]
+            recodes[i] = ix[r]
+        codes = recodes[codes]
+        
+        if self._diskCache is not None and len(misses)>0:
+            self._diskCache.setMany(fp, misses)
+        
+        # object arrays are filled item by item, so that tuples are not unpacked into a 2d array
+        replacedArr = numpy.empty(len(ix), dtype=object)
+        atomizedArr = numpy.empty(len(ix), dtype=object)
+        for i,(r,a) in enumerate(zip(ix,atomized)):
+            replacedArr[i] = r
+            atomizedArr[i] = a
+            
+        atomizedCol = type(col)( atomizedArr[codes], index=col.index, name=col.name )
+        if cacheResult:
+            self._cache = ( type(col)(replacedArr[codes], index=col.index, name=col.name), atomizedCol )
+            self._cacheUniques = ( codes, atomizedArr )
+            self._namesStats = None
+        return atomizedCol
+    
+    def _getFingerprint(self, operation, withReplacing=True):
+        """
+        Fingerprint of an atomizing operation and the instance's replaces, which keys results in the
+        disk cache. The replaces part is recomputed whenever replaces are changed.
+        """
+        if self._replacesFingerprint is None:
+            self._replacesFingerprint = fingerprint(self._replaces)
+        return fingerprint(operation, self._replacesFingerprint if withReplacing else None)
+    
     def addReplaces(self, replacesList):
         replacesDict = self._buildReplaces(replacesList)
         self._replaces.update(replacesDict)
+        self._replacesFingerprint = None
     
-    def write_replaces(self, filename):
+    def write_replaces(self, filename, binary=False):
         """
         Writes replaces to a json file
+        
+        Parameters
+        ----------
+        filename : str
+            Path to the file to be created.
+            
+        binary : bool, default False
+            If set to True replaces are written in a compact binary format instead, with interned
+            strings stored as arrays of integer codes.
         """
+        if binary:
+            writeStringsMap(filename, 'replaces', self._replaces)
+            return
+        
         with open(filename,'w') as f:
             d = {'_replaces':self._replaces}
             json.dump(d, f, sort_keys=True, indent=4, ensure_ascii=False)
             
     def read_replaces(self, filepath, update=True):
         """
-        Reads replaces from a json file
+        Reads replaces from a json file, or from a binary file written with `write_replaces(binary=True)`.
+        The file format is detected automatically.
         """
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-            if update:
-                self._replaces.update( data['_replaces'] )
-            else:
-                self._replaces = data['_replaces']
+        if isBinaryFile(filepath):
+            replaces = readStringsMap( readTables(filepath, 'replaces', mmap=False)[0] )
+        else:
+            with open(filepath, 'r') as f:
+                replaces = json.load(f)['_replaces']
+                
+        if update:
+            self._replaces.update( replaces )
+        else:
+            self._replaces = replaces
+        self._replacesFingerprint = None
         
-    def getCachedNames(self, namesToFilter=['et al.'], sortingExp=lambda x: [len(x[0]),-x[2]]):
+    def getCachedNames(self, namesToFilter=['et al.'], sortingExp=_byLengthAndCount):
         """
         This method uses data in the instance's cache. Returns atomized names from the instance's cache. Names are associated to their original namestring as well as the number of records they appear in the dataset. The result is structured as a 3-tuple, with elements in the same order stated above.
         
@@ -140,7 +250,87 @@ class NamesAtomizer:
           v = original name string that was used to atomize names;
           w = count of the total occurrences of an atomized name in the dataset.
         """
-        c = self._cache
-        l = [ (n,nstr) for nstr,norm in zip(c[0],c[1]) for n in norm if n not in namesToFilter ]
-        ctr = Counter(i[0] for i in l)
-        return sorted([ (u,v,ctr[u]) for u,v in set(l) ],key=sortingExp)
\ No newline at end of file
+        stats = self._getNamesStats()
+        pairsNames, pairsStrings = stats['pairsNames'], stats['pairsStrings']
+        if namesToFilter:
+            filtered = numpy.array( [ n in namesToFilter for n in stats['names'] ], dtype=bool )
+            keep = ~filtered[pairsNames]
+            pairsNames, pairsStrings = pairsNames[keep], pairsStrings[keep]
+        
+        # pairs are in order of first appearance, which is kept for ties by stable sorts
+        names, strings, counts = stats['names'], stats['strings'], stats['counts'][pairsNames]
+        if sortingExp is _byLengthAndCount:
+            order = numpy.lexsort( (-counts, stats['lengths'][pairsNames]) )
+            pairsNames, pairsStrings, counts = pairsNames[order], pairsStrings[order], counts[order]
+        res = list(zip( map(names.__getitem__, pairsNames.tolist()),
+                        map(strings.__getitem__, pairsStrings.tolist()),
+                        counts.tolist() ))
+        return res if sortingExp is _byLengthAndCount else sorted(res, key=sortingExp)
+    
+    def getNamesList(self, with_counts=False, orderBy=None):
+        """
+        This method uses data in the instance's cache. Gets a list of names from the cached atomized
+        column, as `caryocar.cleaning.getNamesList` does, but from cached names statistics.
+        
+        Parameters
+        ----------
+        with_counts : bool
+            If set to True the result includes the number of occurrences of each name.
+        
+        orderBy : str
+            Either 'alphabetic' or 'counts'. If not set names are in order of first appearance.
+        """
+        if orderBy not in [ None, "alphabetic", "counts"]:
+            raise ValueError("Invalid argument for 'orderBy': {}".format(orderBy))
+        
+        stats = self._getNamesStats()
+        l = list(zip( stats['names'], stats['counts'].tolist() ))
+        if orderBy=="alphabetic":
+            l.sort(key=lambda x: x[0])
+        elif orderBy=="counts":
+            l.sort(key=lambda x: x[1], reverse=True)
+        return l if with_counts else [ n for (n,c) in l ]
+    
+    def _getNamesStats(self):
+        """
+        Computes names statistics of the cached atomized column from integer codes, and caches
+        them until the column is atomized again. Statistics are a dict with:
+          names = distinct names, in order of first appearance;
+          strings = distinct names strings, in order of first appearance;
+          counts = number of occurrences of each name;
+          lengths = length of each name;
+          pairsNames, pairsStrings = codes of distinct (name, names string) pairs, in order of first appearance.
+        """
+        if self._namesStats is not None:
+            return self._namesStats
+        if self._cache is None:
+            raise ValueError("No atomized column is cached.")
+        
+        # strings of each code, and their atomized names, are taken from their first row
+        if self._cacheUniques is not None:
+            strCodes, atomized = self._cacheUniques
+            first = numpy.unique(strCodes, return_index=True)[1]
+            strings = self._cache[0].iloc[first].tolist()
+            atomized = atomized.tolist()
+        else:
+            col, atomizedCol = self._cache
+            strCodes, strings = factorize( list(col) )
+            first = numpy.unique(strCodes, return_index=True)[1]
+            atomizedCol = list(atomizedCol)
+            atomized = [ atomizedCol[i] for i in first.tolist() ]
+        
+        # names of each distinct string are counted once, weighted by the number of rows of the string
+        rowsCounts = numpy.bincount(strCodes, minlength=len(strings))
+        lengths = numpy.fromiter( map(len,atomized), dtype=numpy.int64, count=len(atomized) )
+        pairsStrings = numpy.repeat( numpy.arange(len(atomized), dtype=numpy.int64), lengths )
+        pairsNames, names = factorize( list(chain.from_iterable(atomized)) )
+        counts = numpy.bincount(pairsNames, weights=rowsCounts[pairsStrings], minlength=len(names)).astype(numpy.int64)
+        
+        # distinct pairs, keeping first appearances
+        first = numpy.unique( pairsNames*max(len(strings),1) + pairsStrings, return_index=True )[1]
+        first.sort()
+        
+        self._namesStats = { 'names':names, 'strings':strings, 'counts':counts,
+                             'lengths':numpy.fromiter( map(len,names), dtype=numpy.int64, count=len(names) ),
+                             'pairsNames':pairsNames[first], 'pairsStrings':pairsStrings[first] }
+        return self._namesStats
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Names Index module
+"""
+
+import numpy
+from itertools import chain
+from ..encoding import factorize
+
+
+class NamesIndex:
+    """
+    An inverted index of names, mapping each name to the set of records in which it appears. Records
+    of all names are stored in a single integer array in CSR layout: records of the i-th name are
+    positions[indptr[i]:indptr[i+1]], sorted. Positions refer to records labels (e.g. the index of a
+    pandas DataFrame).
+
+    Parameters
+    ----------
+    names : iterable of str
+        Indexed names.
+
+    indptr : array-like of ints
+        Offsets of the records of each name in the positions array, with length len(names)+1.
+
+    positions : array-like of ints
+        Positions of records, grouped by name.
+
+    labels (optional) : array-like
+        Labels of records, indexed by positions. If not set, positions are used as labels.
+
+    Class methods
+    -------------
+    .fromColumn
+    .getPositions
+    .getRecords
+    .union
+    .intersection
+    .toDict
+    .save
+    .load
+
+    Examples
+    --------
+    >>> idx = NamesIndex.fromColumn( df['recordedBy_atomized'], namesMap=nm.getMap() )
+    >>> idx['silva,j']
+    array([  12,  845, 1022])
+    >>> idx.intersection(['silva,j','souza,a'])
+    array([845])
+    """
+    def __init__(self, names, indptr, positions, labels=None):
+        self._names = tuple(names)
+        self._ix = dict( (n,i) for i,n in enumerate(self._names) )
+        self._indptr = numpy.asarray(indptr, dtype=numpy.int64)
+        self._positions = numpy.asarray(positions, dtype=numpy.int64)
+        self._labels = None if labels is None else numpy.asarray(labels)
+        if len(self._indptr)!=len(self._names)+1:
+            raise ValueError("Names offsets must have one more element than names.")
+
+    @classmethod
+    def fromColumn(cls, col, namesMap=None):
+        """
+        Builds the inverted index of an atomized names column.
+
+        Parameters
+        ----------
+        col : pandas.Series or iterable
+            A column with lists of names in each record. If it has an index, its labels are used as
+            records labels.
+
+        namesMap (optional) : dict
+            A mapping used to normalize names. Names which are not in the map are ignored, and all
+            names the map points to are indexed, even if they are in no record.
+
+        Returns
+        -------
+        A NamesIndex.
+        """
+        labels = getattr(col, 'index', None)
+        col = list(col)
+        lengths = numpy.fromiter( map(len,col), dtype=numpy.int64, count=len(col) )
+        names = list(chain.from_iterable(col))
+        rows = numpy.repeat( numpy.arange(len(lengths), dtype=numpy.int64), lengths )
+
+        # names are encoded as integers, and distinct names are normalized only once
+        codes, distinct = factorize(names)
+        if namesMap is None:
+            ix = dict( (n,i) for i,n in enumerate(distinct) )
+        else:
+            ix = dict( (n,i) for i,n in enumerate(dict.fromkeys(namesMap.values())) )
+            distinctCodes = numpy.array( [ ix[namesMap[n]] if n in namesMap else -1 for n in distinct ], dtype=numpy.int64 )
+            codes = distinctCodes[codes]
+            keep = codes>=0
+            codes, rows = codes[keep], rows[keep]
+
+        # pairs are deduplicated and sorted by name and record at once
+        nrecords = max(len(col),1)
+        keys = numpy.unique( codes*nrecords + rows )
+        codes, rows = keys//nrecords, keys%nrecords
+        indptr = numpy.zeros(len(ix)+1, dtype=numpy.int64)
+        numpy.cumsum( numpy.bincount(codes, minlength=len(ix)), out=indptr[1:] )
+        return cls( list(ix), indptr, rows, labels=None if labels is None else numpy.asarray(labels) )
+
+    @property
+    def names(self):
+        """
+        A tuple with indexed names.
+        """
+        return self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __contains__(self, name):
+        return name in self._ix
+
+    def __getitem__(self, name):
+        return self.getRecords(name)
+
+    def _toLabels(self, positions):
+        return positions if self._labels is None else self._labels[positions]
+
+    def getPositions(self, name):
+        """
+        Returns a sorted array with positions of records in which a name appears. The array is a
+        view on the index, and must not be modified.
+        """
+        i = self._ix[name]
+        return self._positions[self._indptr[i]:self._indptr[i+1]]
+
+    def getRecords(self, name):
+        """
+        Returns an array with labels of records in which a name appears.
+        """
+        return self._toLabels(self.getPositions(name))
+
+    def union(self, names):
+        """
+        Returns an array with labels of records in which any of the names appear.
+        """
+        positions = [ self.getPositions(n) for n in names ]
+        if len(positions)==0:
+            return self._toLabels( numpy.zeros(0, dtype=numpy.int64) )
+        return self._toLabels( numpy.unique(numpy.concatenate(positions)) )
+
+    def intersection(self, names):
+        """
+        Returns an array with labels of records in which all of the names appear.
+        """
+        positions = sorted( (self.getPositions(n) for n in names), key=len )
+        if len(positions)==0:
+            return self._toLabels( numpy.zeros(0, dtype=numpy.int64) )
+        # smallest sets are intersected first
+        res = positions[0]
+        for p in positions[1:]:
+            res = numpy.intersect1d(res, p, assume_unique=True)
+        return self._toLabels(res)
+
+    def toDict(self):
+        """
+        Returns the index as a dict of lists of records labels, keyed by name.
+        """
+        labels = self._toLabels(self._positions).tolist()
+        indptr = self._indptr.tolist()
+        return dict( (n,labels[indptr[i]:indptr[i+1]]) for i,n in enumerate(self._names) )
+
+    def save(self, filepath):
+        """
+        Saves the index to a numpy .npz file. Records labels of object type (e.g. strings) are saved
+        as strings.
+        """
+        arrays = { 'names': numpy.array(self._names, dtype=str),
+                   'indptr': self._indptr,
+                   'positions': self._positions }
+        if self._labels is not None:
+            arrays['labels'] = self._labels.astype(str) if self._labels.dtype==object else self._labels
+        numpy.savez(filepath, **arrays)
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Loads an index from a numpy .npz file written by `save`.
+        """
+        with numpy.load(filepath) as f:
+            labels = f['labels'] if 'labels' in f.files else None
+            return cls( f['names'].tolist(), f['indptr'], f['positions'], labels=labels )
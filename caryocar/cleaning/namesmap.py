@@ -7,8 +7,12 @@ Names Map module
 
 import json
 from copy import deepcopy
+from types import MappingProxyType
 from warnings import warn
 from collections import Counter
+from .diskcache import fingerprint, openDiskCache
+from .binaryformat import writeTables, readTables, encodeStrings, codesDtype, StringsTable, BinaryMapping
+import numpy
 
 
 class NamesMap:
@@ -19,13 +23,15 @@ class NamesMap:
     -------------
     .getInconsistencies
     .getMap
+    .version
     .addNames
     .remap
     .setEndpoint
     .write_toJson
+    .write_toBinary
     """
     
-    def __init__(self, names, normalizationFunc, remappingIndex=None, *args, **kwargs):
+    def __init__(self, names, normalizationFunc, remappingIndex=None, diskCache=None, *args, **kwargs):
         """
         The NamesMap constructor
         
@@ -39,16 +45,173 @@ class NamesMap:
             
         remappingIndex : dict
             A dictionary with mapped names to initialize the instance's remapping index
+            
+        diskCache : caryocar.cleaning.DiskCache or str (optional)
+            A persistent cache (or a path to its file) where normalized names are stored, keyed by
+            names and by a fingerprint of the normalization function. Names found in the cache are
+            not normalized again.
         """
         self._normalizationFunc = normalizationFunc
+        self._diskCache = openDiskCache(diskCache)
         
         load_map_prim_norm = kwargs.get('_map_prim_norm',None)
         load_remappingIndex = kwargs.get('_remappingIndex',None)
         
-        normNamesDict = lambda nlst: dict( (n,self._normalizationFunc(n)) for n in nlst )
-        self._map_prim_norm = normNamesDict(names) if load_map_prim_norm is None else load_map_prim_norm 
+        self._map_prim_norm = self._normalizeNames(names) if load_map_prim_norm is None else load_map_prim_norm 
         self._remappingIndex = remappingIndex if load_remappingIndex is None else load_remappingIndex
+        self._version = 0
+        self._resetRefs()
+    
+
+    def _normalizeNames(self, names, normalizationFunc=None):
+        """
+        Normalizes a list of names, returning a dict keyed by names. If the instance has a disk 
+        cache, names normalized in previous runs are looked up, and only new names are normalized.
+        """
+        normFunc = self._normalizationFunc if normalizationFunc is None else normalizationFunc
+        if self._diskCache is None:
+            return dict( (n,normFunc(n)) for n in names )
+        
+        names = list(names)
+        fp = fingerprint(normFunc)
+        d = self._diskCache.getMany(fp, names)
+        misses = dict( (n,normFunc(n)) for n in names if n not in d )
+        if len(misses)>0:
+            self._diskCache.setMany(fp, misses)
+        d.update(misses)
+        return dict( (n,d[n]) for n in names )
+    
+    def _resolveRefs(self):
+        """
+        Resolves the final reference of every key in the remapping index, in a single linear pass.
+        Resolved references are cached, and only those affected by changes to the remapping index
+        are resolved again.
+        
+        Returns
+        -------
+        A dict mapping each key of the remapping index to its final reference.
+        """
+        if self._resolvedRefs is None:
+            self._resolvedRefs = dict()
+            self._resolveKeys(self._remappingIndex if self._remappingIndex is not None else [])
+        return self._resolvedRefs
+    
+    def _resolveKeys(self, keys):
+        """
+        Resolves references of keys. Chains are followed until a name which is not a key, an already 
+        resolved key or a key already visited in the same chain (a loopback) is found, and then every
+        key in the chain is assigned to the same final reference (path compression). Keys whose chains
+        loop back are assigned to None.
+        """
+        index = self._remappingIndex if self._remappingIndex is not None else {}
+        resolved = self._resolvedRefs
+        for k in keys:
+            if k in resolved or k not in index: continue
+            chain, visited = [], set()
+            n = k
+            while n in index and n not in resolved and n not in visited:
+                chain.append(n)
+                visited.add(n)
+                n = index[n]
+                
+            if n in resolved: ref = resolved[n]
+            elif n in visited: ref = None
+            else: ref = n
+            for c in chain: resolved[c] = ref
+    
+    def _resetRefs(self):
+        """
+        Discards resolved references and the flattened names map.
+        """
+        self._resolvedRefs = None
+        self._remapReverse = None
+        self._flatMap = None
+        self._flatLoops = None
+        self._normReverse = None
+    
+    def _getRemapReverse(self):
+        """
+        Reverse remapping index, mapping each name to the keys directly remapped to it. Keys are
+        stored as dict keys, so that they are iterated in insertion order.
+        """
+        if self._remapReverse is None:
+            self._remapReverse = dict()
+            for k,t in (self._remappingIndex or {}).items():
+                self._remapReverse.setdefault(t,dict())[k] = None
+        return self._remapReverse
+    
+    def _setRemap(self, key, target):
+        """
+        Sets a remap in the remapping index, keeping the reverse index up to date.
+        """
+        if self._remapReverse is not None:
+            if key in self._remappingIndex: self._remapReverse[self._remappingIndex[key]].pop(key,None)
+            self._remapReverse.setdefault(target,dict())[key] = None
+        self._remappingIndex[key] = target
+    
+    def _popRemap(self, key):
+        """
+        Removes a remap from the remapping index, keeping the reverse index up to date.
+        """
+        target = self._remappingIndex.pop(key)
+        if self._remapReverse is not None:
+            self._remapReverse[target].pop(key,None)
+        return target
     
+    def _updateRefs(self, changedKeys):
+        """
+        Updates resolved references and the flattened names map after the remapping index is changed
+        at some keys. Only keys whose chains pass through a changed key are resolved again, and only
+        primitives normalized to those keys are updated in the flattened map. Returns the list of
+        those keys, starting from the changed keys.
+        """
+        self._version += 1
+        self._resolveRefs()
+        
+        # keys upstream of changed keys are found by walking the reverse remapping index
+        reverse = self._getRemapReverse()
+        affected = list(dict.fromkeys(changedKeys))
+        visited = set(affected)
+        i = 0
+        while i<len(affected):
+            for k in reverse.get(affected[i],()):
+                if k not in visited:
+                    visited.add(k)
+                    affected.append(k)
+            i += 1
+                    
+        for k in affected: self._resolvedRefs.pop(k,None)
+        self._resolveKeys(affected)
+        if self._flatMap is not None:
+            self._updateFlatMap( s for t in affected for s in self._normReverse.get(t,()) )
+        return affected
+    
+    def _buildFlatMap(self):
+        """
+        Builds the flattened names map, mapping each primitive to its final reference, along with a
+        reverse index from normalized names to primitives.
+        """
+        self._flatMap, self._flatLoops, self._normReverse = dict(), set(), dict()
+        for s,t in self._map_prim_norm.items():
+            self._normReverse.setdefault(t,set()).add(s)
+        self._updateFlatMap(self._map_prim_norm)
+    
+    def _updateFlatMap(self, prims):
+        resolved = self._resolveRefs()
+        for s in prims:
+            t = self._map_prim_norm[s]
+            ref = resolved.get(t,t)
+            self._flatMap[s] = ref
+            if ref is None: self._flatLoops.add(s)
+            else: self._flatLoops.discard(s)
+    
+    @property
+    def version(self):
+        """
+        A counter of modifications of the names map. It is increased whenever names are added or
+        the remapping index is changed.
+        """
+        return self._version
 
     def _getRef(self,n):
         """
@@ -59,31 +222,39 @@ class NamesMap:
         n : str
             The name to be de-referenced
         """
+        ref = self._resolveRefs().get(n,n)
+        if ref is not None:
+            return ref
+        
+        # the chain is only walked again for reporting loopbacks
         start=n
         chain=[]
-        remappingKeys = self._remappingIndex.keys()
-        while n in remappingKeys:
+        visited=set()
+        while n in self._remappingIndex:
             chain.append(n)
+            visited.add(n)
             n = self._remappingIndex[n]
-            if n in chain:
+            if n in visited:
                 chain.append(n)
                 raise RuntimeError("Loopback detected", start, chain)
         return n
     
     
-    def _get_loopback_inconsistencies(self):
+    def _get_loopback_inconsistencies(self, keys=None):
         """
-        Detects loopbacks in in mapping chains
+        Detects loopbacks in in mapping chains. If keys are set, only chains starting from them are checked.
         """
         inconsistencies = {}
-        for k in self._remappingIndex.keys():
+        resolved = self._resolveRefs()
+        for k in (self._remappingIndex.keys() if keys is None else keys):
+            if resolved.get(k,k) is not None: continue
             try:
                 self._getRef(k)
                 
             except RuntimeError as e:
-                inconsistencies['mes'] = inconsistencies.get('mes',[]) + [e.args[0]]
-                inconsistencies['key'] = inconsistencies.get('key',[]) + [e.args[1]]
-                inconsistencies['chain'] = inconsistencies.get('chain',[]) + [e.args[2]]
+                inconsistencies.setdefault('mes',[]).append(e.args[0])
+                inconsistencies.setdefault('key',[]).append(e.args[1])
+                inconsistencies.setdefault('chain',[]).append(e.args[2])
         
         if len(inconsistencies)==0:
             return None
@@ -91,16 +262,40 @@ class NamesMap:
             return inconsistencies
     
     
-    def _remove_selfloops(self):
-        keys_to_remove = [ k for k in self._remappingIndex.keys() if k==self._remappingIndex[k]]       
+    def _remove_selfloops(self, keys=None):
+        """
+        Removes keys remapped to themselves from the remapping index. If keys are set, only those
+        keys are checked. Returns the list of removed keys.
+        """
+        index = self._remappingIndex
+        keys_to_remove = [ k for k in (list(index.keys()) if keys is None else keys) if k in index and k==index[k] ]
         for k in keys_to_remove:
-            self._remappingIndex.pop(k)
+            if k in index: self._popRemap(k)
+        return keys_to_remove
                   
             
-    def getInconsistencies(self, prettyPrint=True):
-        d = {}
-        d['loopback_inconsistencies'] = self._get_loopback_inconsistencies()
+    def getInconsistencies(self, prettyPrint=True, keys=None):
+        """
+        Checks the remapping index for inconsistencies, i.e. loopbacks in mapping chains.
         
+        Parameters
+        ----------
+        prettyPrint : bool, default True
+            If set to True inconsistencies are returned as a message string, otherwise as a dict.
+            
+        keys : iterable (optional)
+            If set only chains starting from these keys are checked. By default all keys in the
+            remapping index are checked.
+            
+        Returns
+        -------
+        Either a message string or a dict with inconsistencies, or None if no inconsistency is found.
+        """
+        d = {}
+        d['loopback_inconsistencies'] = self._get_loopback_inconsistencies(keys)
+        return self._reportInconsistencies(d, prettyPrint)
+    
+    def _reportInconsistencies(self, d, prettyPrint=True):
         if any( True if v is not None else False for v in d.values()  ):
             if prettyPrint:
                 mes = "INCONSISTENCIES\n===============\n"
@@ -112,6 +307,14 @@ class NamesMap:
                     dataStr = lambda t: "  > {}: Starting from key '{}' got chain {}\n".format(*t)
                     mes += ''.join( dataStr(t) for t in data )
                     mes += '---------------'
+                    
+                # self-loops removed from remaps
+                if d.get('selfloop_inconsistencies') is not None:
+                    if not mes.endswith('\n'): mes += '\n'
+                    mes += "Self-loops Removed\n"
+                    dataStr = lambda k: "  > Key '{}' was remapped to itself\n".format(k)
+                    mes += ''.join( dataStr(k) for k in d['selfloop_inconsistencies']['key'] )
+                    mes += '---------------'
 
                 return mes
             
@@ -120,9 +323,10 @@ class NamesMap:
         return None
                 
         
-    def getMap(self, remap=True):
+    def getMap(self, remap=True, copy=False):
         """
-        Returns a COPY of the names map.
+        Returns a read-only view of the names map. The flattened map (with remaps de-referenced) is
+        cached, and only entries affected by changes are updated, so no copy is made on each call.
         
         Parameters
         ----------
@@ -130,15 +334,25 @@ class NamesMap:
             If set to True, the names map is buit by first de-referencing
             remaps in the remapping index. Otherwise all remaps will not
             be considered for building the names map.
+            
+        copy : bool, default False
+            If set to True a COPY of the names map is returned, as a dict.
+            
+        Note
+        ----
+        The view reflects later changes to the names map. Either pass copy=True or check the `version`
+        attribute if a snapshot is needed.
         """
-        res = deepcopy(self._map_prim_norm)
-        if remap and self._remappingIndex is not None:
-            for s,t in self._map_prim_norm.items():
-                try:
-                    res[s] = self._getRef(t)
-                except RuntimeError as e:
-                    raise(e)
-        return res
+        if not remap or self._remappingIndex is None:
+            m = self._map_prim_norm
+        else:
+            if self._flatMap is None:
+                self._buildFlatMap()
+            if len(self._flatLoops)>0:
+                s = next( s for s in self._map_prim_norm if s in self._flatLoops )
+                self._getRef(self._map_prim_norm[s]) # raises a loopback error
+            m = self._flatMap
+        return deepcopy(m) if copy else MappingProxyType(m)
     
     def addNames(self, names, normalizationFunc=None, updateExistingKeys=False):
         """
@@ -161,13 +375,18 @@ class NamesMap:
             names map are normalized and updated. If set to True all input names will be 
             updated in the names map.  
         """
-        normFunc = self._normalizationFunc if normalizationFunc is None else normalizationFunc
-        d = dict( ( n,normFunc(n) ) for n in names )
-        
         if not updateExistingKeys:
-            d = dict( (k,v) for k,v in d.items() if k not in self._map_prim_norm.keys() )
+            names = [ n for n in names if n not in self._map_prim_norm ]
         
-        self._map_prim_norm.update(d) 
+        d = self._normalizeNames(names, normalizationFunc)
+        if self._flatMap is not None:
+            for s,t in d.items():
+                if s in self._map_prim_norm: self._normReverse[self._map_prim_norm[s]].discard(s)
+                self._normReverse.setdefault(t,set()).add(s)
+        self._map_prim_norm.update(d)
+        if self._flatMap is not None:
+            self._updateFlatMap(d)
+        self._version += 1
             
     
     def remap(self, remaps, fromScratch=False):
@@ -188,6 +407,9 @@ class NamesMap:
         ----
         If the list of tuples passed in contains duplicated keys a warning is issued, and the
         latest (key,value) pair is the one which will persist.
+        Only chains passing through remapped keys are checked for inconsistencies, which are returned.
+        Keys remapped to themselves are removed and reported. Use `getInconsistencies` for checking the
+        whole remapping index.
         """        
         # check for duplicated keys
         duplicatedKeys = [ s for s,cnts in Counter( s for s,t in remaps ).items() if cnts>1 ]
@@ -196,14 +418,23 @@ class NamesMap:
             warn(warningMsg)
         
         # update remapping index
-        if fromScratch: self._remappingIndex=None
+        if fromScratch: 
+            self._remappingIndex=None
+            self._resetRefs()
         if self._remappingIndex is None: self._remappingIndex={}
         
         for s,t in remaps:
-            self._remappingIndex[s] = t
+            self._setRemap(s,t)
+            
+        # only chains through remapped keys are checked for inconsistencies
+        keys = [ s for s,t in remaps ]
+        selfloops = self._remove_selfloops(keys)
+        affected = self._updateRefs(keys)
         
-        self._remove_selfloops()
-        return self.getInconsistencies()
+        d = {}
+        d['loopback_inconsistencies'] = self._get_loopback_inconsistencies(affected)
+        d['selfloop_inconsistencies'] = { 'key': list(dict.fromkeys(selfloops)) } if len(selfloops)>0 else None
+        return self._reportInconsistencies(d)
     
     
     def setEndpoint(self, key):
@@ -217,7 +448,9 @@ class NamesMap:
         key : str
             The name to be set as the latest reference.
         """
-        return self._remappingIndex.pop(key)
+        target = self._popRemap(key)
+        self._updateRefs([key])
+        return target
     
     
     def write_toJson(self, filename, flatten=False):
@@ -236,8 +469,117 @@ class NamesMap:
             are then removed from the remapping index.
         
         """
-        json_dict = dict([ ('_map_prim_norm', self.getMap() if flatten else self._map_prim_norm),
+        json_dict = dict([ ('_map_prim_norm', dict(self.getMap()) if flatten else self._map_prim_norm),
                            ('_remappingIndex', {} if flatten else self._remappingIndex) ])
         
         with open(filename, 'w') as output_file:
-            json.dump( json_dict, output_file, sort_keys=True, indent=4, ensure_ascii=False)           
\ No newline at end of file
+            json.dump( json_dict, output_file, sort_keys=True, indent=4, ensure_ascii=False)           
+            
+    
+    def write_toBinary(self, filename, flatten=False):
+        """
+        Creates a binary file to store a NamesMap's primitive-to-normalized names map and remapping index.
+        All names are interned in a sorted strings table, and both maps are stored as arrays of integer 
+        codes, sorted by keys. Final references of primitives are also stored, so that the file can be 
+        opened lazily (see `read_NamesMap_fromBinary`) and looked up without parsing it as a whole.
+        
+        Parameters
+        ----------
+        filename : str
+            Path to the file to be created.
+        
+        flatten : bool, default False
+            If set to true, all remappings are consolidated into the primitive-to-normalized names map,
+            and the remapping index is left empty.
+        """
+        prim_norm = dict(self.getMap()) if flatten else self._map_prim_norm
+        remappingIndex = {} if flatten or self._remappingIndex is None else self._remappingIndex
+        resolved = self._resolveRefs() if not flatten else {}
+        
+        codes, data, offsets = encodeStrings( list(prim_norm.keys()) + list(prim_norm.values()) +
+                                              list(remappingIndex.keys()) + list(remappingIndex.values()) )
+        prims, keys = sorted(prim_norm), sorted(remappingIndex)
+        refs = ( resolved.get(prim_norm[p],prim_norm[p]) for p in prims )
+        dtype = codesDtype(len(codes))
+        arrays = { 'strings_data': data,
+                   'strings_offsets': offsets,
+                   'prims': numpy.array( [ codes[p] for p in prims ], dtype=dtype ),
+                   'norms': numpy.array( [ codes[prim_norm[p]] for p in prims ], dtype=dtype ),
+                   'refs': numpy.array( [ codes[r] if r is not None else -1 for r in refs ], dtype=dtype ),
+                   'remap_keys': numpy.array( [ codes[k] for k in keys ], dtype=dtype ),
+                   'remap_values': numpy.array( [ codes[remappingIndex[k]] for k in keys ], dtype=dtype ) }
+        meta = { 'remapping': flatten or self._remappingIndex is not None }
+        writeTables(filename, 'namesmap', arrays, meta)
+
+
+class NamesMapFile:
+    """
+    A read-only names map opened lazily from a binary file written by `NamesMap.write_toBinary`. The
+    file is memory-mapped, and names are looked up by binary search, without parsing the whole file.
+    It can be used wherever a NamesMap is only used for looking names up (e.g. SCN and CWN models).
+    
+    Parameters
+    ----------
+    filepath : str
+        Path to the binary file.
+    
+    Class methods
+    -------------
+    .getMap
+    .toNamesMap
+    """
+    def __init__(self, filepath):
+        arrays, meta = readTables(filepath, 'namesmap', mmap=True)
+        self._arrays = arrays
+        self._meta = meta
+        self._strings = StringsTable(arrays['strings_data'], arrays['strings_offsets'])
+        self._remappingIndex = BinaryMapping(self._strings, arrays['remap_keys'], arrays['remap_values'])
+        
+    def _getRef(self, n):
+        """
+        Follows chained references for a name in the remapping index, raising a RuntimeError on loopbacks.
+        """
+        start=n
+        chain=[]
+        visited=set()
+        while n in self._remappingIndex:
+            chain.append(n)
+            visited.add(n)
+            n = self._remappingIndex[n]
+            if n in visited:
+                chain.append(n)
+                raise RuntimeError("Loopback detected", start, chain)
+        return n
+    
+    def getMap(self, remap=True, copy=False):
+        """
+        Returns a read-only mapping view of the names map, backed by the file.
+        
+        Parameters
+        ----------
+        remap : bool, default True
+            If set to True names are mapped to their final references in the remapping index.
+            Looking up a name whose chain loops back raises a RuntimeError.
+            
+        copy : bool, default False
+            If set to True the whole names map is read, and returned as a dict.
+        """
+        arrays = self._arrays
+        if remap:
+            normOf = BinaryMapping(self._strings, arrays['prims'], arrays['norms'])
+            m = BinaryMapping(self._strings, arrays['prims'], arrays['refs'], 
+                              missingValue=lambda p: self._getRef(normOf[p]))
+        else:
+            m = BinaryMapping(self._strings, arrays['prims'], arrays['norms'])
+        return dict(m.items()) if copy else m
+    
+    def toNamesMap(self, normalizationFunc=None):
+        """
+        Reads the whole file into a NamesMap.
+        """
+        strings = self._strings.decodeAll()
+        decode = lambda k,v: dict( zip( map(strings.__getitem__, self._arrays[k].tolist()),
+                                        map(strings.__getitem__, self._arrays[v].tolist()) ) )
+        return NamesMap( names=None, normalizationFunc=normalizationFunc,
+                         _map_prim_norm=decode('prims','norms'),
+                         _remappingIndex=decode('remap_keys','remap_values') if self._meta['remapping'] else None )
@@ -1,5 +1,9 @@
 import pytest
-from caryocar.cleaning import NamesMap
+from caryocar.cleaning import NamesMap, NamesAtomizer, DiskCache, namesFromString, normalize, normalize_many
+from caryocar.cleaning import namesFromColumn, getNamesList
+from caryocar.cleaning import read_NamesMap_fromJson, read_NamesMap_fromBinary
+from caryocar.cleaning import NamesIndex, getNamesIndexes
+from caryocar.cleaning.diskcache import fingerprint
 
 # ===================
 # test NamesMap class
@@ -75,6 +79,300 @@ def test_namesmap_remapped_loopbacks_setting_endpoints(remap,endpoint):
     assert nm.getMap()
     assert any( upper(u)==v for u,v in nm.getMap().items() if v==endpoint ) # the endpoint should have its non-normalized form as a source
     
+def test_namesmap_long_remapping_chains():
+    '''Long remapping chains are resolved, and resolved references follow changes to the remapping index'''
+    names = ["name"+str(i) for i in range(20000)]
+    remap = dict( (n,m) for n,m in zip(names[:-1],names[1:]) )
+    nm = NamesMap(names=names, normalizationFunc=lambda x: x, remappingIndex=remap)
+    assert set(nm.getMap().values())=={'name19999'}
+    assert nm.getInconsistencies() is None
+    nm.setEndpoint('name100')
+    assert nm.getMap()['name0']=='name100'
+    nm.remap([('name19999','name0')])
+    assert nm.getMap()['name0']=='name100'
+    assert nm.getMap()['name200']=='name100'
+
+def test_namesmap_loopbacks_inconsistencies():
+    '''Loopbacks are reported with the chain followed from each key'''
+    names = ["name"+str(i) for i in range(1,10)]
+    nm = NamesMap(names=names, normalizationFunc=lambda x: x, remappingIndex={'name1':'name2','name2':'name3','name3':'name2'})
+    d = nm.getInconsistencies(prettyPrint=False)['loopback_inconsistencies']
+    assert d['key']==['name1','name2','name3']
+    assert d['chain'][0]==['name1','name2','name3','name2']
+    with pytest.raises(RuntimeError):
+        nm.getMap()
+
+def test_namesmap_getMap_read_only_view(nm_remapped):
+    '''The names map is handed out as a read-only view, kept up to date as the map changes'''
+    m = nm_remapped.getMap()
+    with pytest.raises(TypeError):
+        m['name1'] = 'x'
+    assert nm_remapped.getMap() is not m and dict(nm_remapped.getMap())==dict(m)
+    version = nm_remapped.version
+    nm_remapped.remap([('name_3','NAME9')])
+    nm_remapped.addNames(['name10'])
+    assert nm_remapped.version==version+2
+    assert m['name1']=='NAME9' and m['name10']=='NAME10'
+    assert isinstance(nm_remapped.getMap(copy=True),dict)
+
+def test_namesmap_remap_checks_touched_chains():
+    '''Remapping reports loopbacks through remapped keys and removed self-loops, while the full check reports all loopbacks'''
+    names = ["name"+str(i) for i in range(1,10)]
+    remap = { 'NAME1':'NAME2', 'NAME2':'NAME3', 'NAME3':'name_3', 'NAME7':'NAME8', 'NAME8':'NAME7' }
+    nm_remapped = NamesMap(names=names, normalizationFunc=lambda x: x.upper(), remappingIndex=remap)
+    assert nm_remapped.remap([('NAME9','NAME9')])=="INCONSISTENCIES\n===============\nSelf-loops Removed\n  > Key 'NAME9' was remapped to itself\n---------------"
+    assert 'NAME9' not in nm_remapped._remappingIndex
+    
+    d = nm_remapped.remap([('name_3','NAME1')])
+    assert "Starting from key 'name_3'" in d and "Starting from key 'NAME1'" in d and 'NAME7' not in d
+    d = nm_remapped.getInconsistencies(prettyPrint=False)['loopback_inconsistencies']
+    assert set(d['key'])=={'NAME1','NAME2','NAME3','name_3','NAME7','NAME8'}
+    d = nm_remapped.getInconsistencies(prettyPrint=False, keys=['NAME7'])['loopback_inconsistencies']
+    assert d['key']==['NAME7']
+
+@pytest.mark.parametrize("flatten",[False,True])
+def test_namesmap_binary_roundtrip(nm_remapped,tmp_path,flatten):
+    '''Names maps read from binary files are the same as those read from json files'''
+    nm_remapped.addNames(['Jos\u00e9'])
+    jsonPath, binPath = str(tmp_path/'nm.json'), str(tmp_path/'nm.bin')
+    nm_remapped.write_toJson(jsonPath, flatten=flatten)
+    nm_remapped.write_toBinary(binPath, flatten=flatten)
+    nm_json = read_NamesMap_fromJson(jsonPath, normalizationFunc=str.upper)
+    nm_bin = read_NamesMap_fromBinary(binPath, normalizationFunc=str.upper)
+    assert nm_bin._map_prim_norm==nm_json._map_prim_norm
+    assert nm_bin._remappingIndex==nm_json._remappingIndex
+    assert dict(nm_bin.getMap())==dict(nm_remapped.getMap())
+
+def test_namesmap_binary_lazy(nm_remapped,tmp_path):
+    '''Names maps can be opened lazily from binary files and looked up'''
+    path = str(tmp_path/'nm.bin')
+    nm_remapped.write_toBinary(path)
+    m = read_NamesMap_fromBinary(path, lazy=True).getMap()
+    assert m['name1']=='name_3' and m['name9']=='NAME9'
+    assert 'name10' not in m and len(m)==9
+    assert dict(m)==dict(nm_remapped.getMap())
+    
+    nm_remapped.remap([('NAME_4','NAME4')])
+    nm_remapped.write_toBinary(path)
+    m = read_NamesMap_fromBinary(path, lazy=True).getMap()
+    assert m['name1']=='name_3'
+    with pytest.raises(RuntimeError):
+        m['name4']
+
+# ========================
+# test names atomization
+# ========================
+@pytest.mark.parametrize("delim,unique",[
+        (';',False), (';',True), ([';','|','&'],False), ([';','|','&'],True) ])
+def test_names_from_column(delim,unique):
+    '''Atomizing a whole column gives the same names as atomizing each row'''
+    col = [ 'Silva, J.; Souza, A.', ' Lima, B. ;; Silva, J.;Lima, B.', '', None, 'Costa|Silva & Souza;Costa', ';' ]
+    res = namesFromColumn(col, delim=delim, unique=unique)
+    assert len(res)==len(col) and res.offsets[-1]==len(res.tokens)
+    expected = [ namesFromString(s if isinstance(s,str) else '', delim, unique, preserveOrder=True) for s in col ]
+    assert res.toLists()==expected
+    assert res[1]==expected[1]
+
+def test_names_from_column_separators_in_names():
+    '''Rows containing characters used as separators internally are still split correctly'''
+    col = [ 'Silva\x1fJ.;Souza', 'Lima\x00B.' ]
+    assert namesFromColumn(col).toLists()==[ ['Silva\x1fJ.','Souza'], ['Lima\x00B.'] ]
+    assert namesFromColumn(col, delim=['\x00',';']).toLists()==[ ['Silva\x1fJ.','Souza'], ['Lima','B.'] ]
+
+@pytest.mark.parametrize("delim",[ ['^et al\\. ',';'], [';','\\.$'], [' (?=Lima)',';'], ['(?<=Silva) ',';'] ])
+def test_names_from_column_contextual_delimiters(delim):
+    '''Anchored and lookaround delimiters only match within each row'''
+    col = [ 'et al. Silva', 'et al. Souza; Lima', 'Silva Souza.', 'Souza Lima.' ]
+    expected = [ namesFromString(s, delim) for s in col ]
+    assert namesFromColumn(col, delim=delim).toLists()==expected
+
+
+# ========================
+# test NamesAtomizer class
+# ========================
+@pytest.fixture
+def names_col():
+    pandas = pytest.importorskip('pandas')
+    return pandas.Series([ 'Silva, J.; Souza, A.', 'Silva, J.', 'Silva, J.; Souza, A.', None, 'Silva J', 'Silva, J.' ], name='recordedBy')
+
+@pytest.fixture
+def na():
+    op = lambda s: namesFromString(s) if isinstance(s,str) else []
+    return NamesAtomizer(atomizeOp=op, replaces=[ (['Silva J'],'Silva, J.') ])
+
+def test_namesatomizer_unique_same_result(na,names_col):
+    '''Atomizing distinct values only gives the same names as atomizing every row'''
+    expected = na.atomize(names_col)
+    res = na.atomize(names_col, unique=True)
+    assert list(res.index)==list(expected.index) and res.name==expected.name
+    assert [ list(t) for t in res ]==list(expected)
+    assert res[4]==('Silva, J.',)
+
+def test_namesatomizer_unique_shares_tuples(na,names_col):
+    '''Rows with the same names string share a single immutable tuple'''
+    res = na.atomize(names_col, unique=True)
+    assert isinstance(res[0],tuple)
+    assert res[0] is res[2]
+    assert res[1] is res[4] is res[5]
+
+@pytest.mark.parametrize("unique",[False,True])
+def test_namesatomizer_cached_names(na,names_col,unique):
+    '''Cached names are paired with their names strings and counted over all records'''
+    na.atomize(names_col, unique=unique)
+    assert na.getCachedNames()==[ ('Silva, J.','Silva, J.; Souza, A.',5), ('Silva, J.','Silva, J.',5), ('Souza, A.','Silva, J.; Souza, A.',2) ]
+    assert na.getCachedNames(namesToFilter=['Silva, J.'], sortingExp=lambda x: x[0])==[ ('Souza, A.','Silva, J.; Souza, A.',2) ]
+    assert na.getNamesList(with_counts=True, orderBy='counts')==[ ('Silva, J.',5), ('Souza, A.',2) ]
+    
+    # statistics are recomputed when another column is atomized
+    na.atomize(names_col[:2], unique=unique)
+    assert na.getNamesList(with_counts=True)==[ ('Silva, J.',2), ('Souza, A.',1) ]
+
+def test_get_names_list(na,names_col):
+    '''Names are listed and counted from lists of names or from a names column'''
+    col = na.atomize(names_col)
+    assert getNamesList(col, with_counts=True, orderBy='counts')==[ ('Silva, J.',5), ('Souza, A.',2) ]
+    assert getNamesList(col, orderBy='alphabetic')==['Silva, J.','Souza, A.']
+    assert getNamesList(namesFromColumn(names_col), with_counts=True)==[ ('Silva, J.',4), ('Souza, A.',2), ('Silva J',1) ]
+
+def test_namesatomizer_disk_cache(names_col,tmp_path):
+    '''Names strings atomized in a previous run are read from the disk cache, which is invalidated by new replaces'''
+    calls = []
+    def op(s):
+        calls.append(s)
+        return namesFromString(s) if isinstance(s,str) else []
+    path = str(tmp_path/'cache.db')
+    expected = NamesAtomizer(atomizeOp=op).atomize(names_col)
+    
+    calls.clear()
+    NamesAtomizer(atomizeOp=op, diskCache=path).atomize(names_col)
+    assert len(calls)==4
+    calls.clear()
+    na = NamesAtomizer(atomizeOp=op, diskCache=path)
+    assert list(na.atomize(names_col))==list(expected)
+    assert calls==[None]
+    
+    na.addReplaces([ (['Silva J'],'Silva, J.') ])
+    calls.clear()
+    assert na.atomize(names_col)[4]==['Silva, J.']
+    assert len(calls)==3
+
+_replaces_table = {'Silva J':'Silva, J.'}
+
+def _replace(s):
+    return _replaces_table.get(s,s)
+
+def test_fingerprint_follows_globals(monkeypatch):
+    '''Fingerprints change with the functions and tables a function refers to, and are stable otherwise'''
+    op = lambda s: _replace(s).lower()
+    fp = fingerprint(op)
+    assert fingerprint(op)==fp
+    monkeypatch.setitem(_replaces_table, 'Souza A', 'Souza, A.')
+    assert fingerprint(op)!=fp
+    assert fingerprint(normalize)==fingerprint(normalize)
+
+def test_disk_cache_lookups_do_not_write(tmp_path):
+    '''Lookups only mark entries as used in memory, and access times are written later'''
+    cache = DiskCache(str(tmp_path/'cache.db'), maxSize=2)
+    cache.setMany('fp', {'a':['a'], 'b':['b']})
+    changes = cache._conn.total_changes
+    assert cache.getMany('fp', ['a','b'])=={'a':['a'], 'b':['b']}
+    assert cache._conn.total_changes==changes
+    cache.close()
+
+def test_disk_cache_eviction(tmp_path):
+    '''The disk cache is bounded, and evicts least recently used entries'''
+    cache = DiskCache(str(tmp_path/'cache.db'), maxSize=2)
+    cache.setMany('fp', {'a':['a'], 'b':['b']})
+    assert cache.getMany('fp', ['a'])=={'a':['a']}
+    cache.setMany('fp', {'c':['c']})
+    assert len(cache)==2
+    assert cache.getMany('fp', ['a','b','c'])=={'a':['a'], 'c':['c']}
+    assert cache.getMany('other_fp', ['a'])=={}
+
+    # replaced entries do not count as new ones, and the count is kept when the cache is reopened
+    cache.setMany('fp', {'a':['A']})
+    cache.setMany('other_fp', [ ('a',['a']) ])
+    assert len(cache)==2
+    cache.close()
+    cache = DiskCache(str(tmp_path/'cache.db'), maxSize=2)
+    assert len(cache)==2
+    cache.clear('fp')
+    assert len(cache)==1
+
+def test_namesmap_disk_cache(tmp_path):
+    '''Names maps read normalized names from the disk cache'''
+    calls = []
+    def upper(s):
+        calls.append(s)
+        return s.upper()
+    names = ["name"+str(i) for i in range(1,10)]
+    path = str(tmp_path/'cache.db')
+    NamesMap(names=names[:5], normalizationFunc=upper, diskCache=path)
+    calls.clear()
+    nm = NamesMap(names=names[:3], normalizationFunc=upper, diskCache=path)
+    nm.addNames(names)
+    assert calls==names[5:]
+    assert nm.getMap()==dict( (n,n.upper()) for n in names )
+
+def test_namesatomizer_binary_replaces(na,tmp_path):
+    '''Replaces are written to and read from binary files'''
+    path = str(tmp_path/'replaces.bin')
+    na.addReplaces([ (['Souza A'],'Souza, A.') ])
+    na.write_replaces(path, binary=True)
+    na2 = NamesAtomizer(atomizeOp=namesFromString)
+    na2.read_replaces(path)
+    assert na2._replaces==na._replaces
+
+# ===================
+# test normalization
+# ===================
+@pytest.mark.parametrize("name,normName",[
+        ("João da Silva","joaodasilva"),
+        ("Leite, A.M.","leite,am"),
+        ("J. R. Souza","jrsouza"),
+        ("Müller, Ñ.; Ø. Ström","muller,nstrom"),
+        ("Silva\ufe50 J.","silvaj"),
+        ("", "") ])
+def test_normalize(name,normName):
+    '''Names are lowercased, split on commas, stripped from accents and non-letters'''
+    assert normalize(name)==normName
+    
+def test_normalize_many():
+    '''Batch normalization gives the same results as normalizing each name'''
+    names = ["João da Silva","Leite, A.M.","João da Silva","Silva\ufe50 J.,"]
+    assert normalize_many(names)==[ normalize(n) for n in names ]
+    assert normalize_many(names,'NFC')==[ normalize(n,'NFC') for n in names ]
+
+# ====================
+# test names indexing
+# ====================
+@pytest.fixture
+def records():
+    pandas = pytest.importorskip('pandas')
+    return pandas.DataFrame( {'names':[ ['Silva, J.','Souza, A.'], ['Silva J'], [], ['Souza, A.','Lima, B.'], ['Souza, A.'] ]},
+                             index=[10,11,12,13,14] )
+
+def test_get_names_indexes(records):
+    '''Names indexes hold labels of records in which names appear, with or without a names map'''
+    assert getNamesIndexes(records,'names')=={'Silva, J.':[10], 'Souza, A.':[10,13,14], 'Silva J':[11], 'Lima, B.':[13]}
+    nmap = {'Silva, J.':'silva,j', 'Silva J':'silva,j', 'Souza, A.':'souza,a', 'Costa, C.':'costa,c'}
+    assert getNamesIndexes(records,'names',namesMap=nmap)=={'silva,j':[10,11], 'souza,a':[10,13,14], 'costa,c':[]}
+
+def test_names_index_set_operations(records):
+    '''Names indexes support unions and intersections of records sets'''
+    idx = getNamesIndexes(records,'names',asIndex=True)
+    assert list(idx['Souza, A.'])==[10,13,14]
+    assert list(idx.union(['Silva, J.','Silva J','Lima, B.']))==[10,11,13]
+    assert list(idx.intersection(['Souza, A.','Lima, B.']))==[13]
+    assert list(idx.intersection(['Silva J','Lima, B.']))==[]
+
+def test_names_index_save_load(records,tmp_path):
+    '''Names indexes are saved to and loaded from numpy files'''
+    idx = NamesIndex.fromColumn(records['names'])
+    path = str(tmp_path/'idx.npz')
+    idx.save(path)
+    assert NamesIndex.load(path).toDict()==idx.toDict()
+
 # Execute tests above on script run
 if __name__ == '__main__':
     pytest.main(['-v', __file__ ])
\ No newline at end of file
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Integer encoding of values, shared by names cleaning and network models
+"""
+
+import numpy
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2018"
+
+
+def factorize( values ):
+    """
+    Encodes values as integer codes.
+
+    Parameters
+    ----------
+    values : iterable
+        Hashable values to be encoded.
+
+    Returns
+    -------
+    A 2-tuple (codes, labels), where codes is an integer array with the code of each value and
+    labels is a list with distinct values, in order of first appearance, such that
+    labels[codes[i]]==values[i].
+
+    Note
+    ----
+    If pandas is available it is used for hashing values, which is much faster. Missing values
+    (None, NaN) are encoded as any other value.
+    """
+    if not isinstance(values,(list,numpy.ndarray)) and not (pandas is not None and isinstance(values,pandas.Series)):
+        values = list(values)
+
+    if pandas is not None and len(values)>0:
+        codes, labels = pandas.factorize(values, sort=False)
+        # missing values are encoded as -1 by pandas, so they are encoded in python instead
+        if not (codes<0).any():
+            return codes.astype(numpy.int64), list(labels)
+
+    ix = dict()
+    codes = numpy.fromiter( (ix.setdefault(v,len(ix)) for v in values), dtype=numpy.int64, count=len(values) )
+    return codes, list(ix)
@@ -1,2 +1,7 @@
 from .cwn import CWN
-from .scn import SCN
\ No newline at end of file
+from .scn import SCN
+from .sparsescn import SparseSCN
+from .builders import SCNAccumulator, CWNAccumulator, ModelsBuilder
+from .builders import mergeAccumulators, accumulateInParallel
+from .temporal import SCNSeries, CWNSeries
+from .hypercwn import HyperCWN
@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Streaming builders of network models
+
+Records are consumed in batches (e.g. chunks of an occurrence file), and aggregated into nodes
+and edges counts as they arrive, so that memory depends on the number of distinct names and
+edges, not on the number of records.
+"""
+
+import multiprocessing
+import numpy
+import scipy.sparse
+from itertools import chain
+from .scn import SCN
+from .cwn import CWN
+from .sparsescn import SparseSCN
+from .matrices import biadjacencyFromRecords, incidenceMatrix, cliquesPairs, factorize, EdgesTaxonsMatrix
+from .matrices import coworkingMatrices, coworkingEdgesArrays, coworkingEdges
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2018"
+
+
+class _Vocabulary:
+    """
+    Labels encoded as integer codes, in order of first appearance. New labels are appended.
+    """
+    def __init__( self ):
+        self._ix = dict()
+        self.labels = []
+
+    def __len__( self ):
+        return len(self.labels)
+
+    def encode( self, labels ):
+        """
+        Returns an integer array with codes of labels, adding the new ones to the vocabulary.
+        """
+        ix, labelsList = self._ix, self.labels
+        def code(l):
+            c = ix.get(l)
+            if c is None:
+                c = ix[l] = len(labelsList)
+                labelsList.append(l)
+            return c
+        return numpy.fromiter( map(code,labels), dtype=numpy.int64, count=len(labels) )
+
+    def __getstate__( self ):
+        # codes are implied by the order of labels
+        return self.labels
+
+    def __setstate__( self, labels ):
+        self.labels = list(labels)
+        self._ix = dict( (l,i) for i,l in enumerate(self.labels) )
+
+
+class _Tallies:
+    """
+    Sums of values keyed by tuples of integer codes. Batches of keys and values are appended as
+    they arrive, and reduced (sorted by keys, and summed) once pending entries outgrow the reduced
+    ones, so that memory stays proportional to the number of distinct keys.
+
+    Parameters
+    ----------
+    nkeys : int
+        Number of codes in each key.
+
+    dtypes : list
+        Types of the values summed for each key.
+    """
+    _minPending = 2**20
+
+    def __init__( self, nkeys, dtypes ):
+        self._keys = [ numpy.zeros(0, dtype=numpy.int64) for i in range(nkeys) ]
+        self._values = [ numpy.zeros(0, dtype=dt) for dt in dtypes ]
+        self._pending = []
+        self._npending = 0
+
+    def add( self, keys, values ):
+        """
+        Adds values to keys. Keys and values are sequences of aligned arrays, one per key code and
+        one per value.
+        """
+        keys = [ numpy.asarray(k, dtype=numpy.int64) for k in keys ]
+        values = [ numpy.asarray(v, dtype=r.dtype) for v,r in zip(values,self._values) ]
+        self._pending.append( (keys,values) )
+        self._npending += len(keys[0])
+        if self._npending > max(len(self._keys[0]), self._minPending):
+            self.reduce()
+
+    def reduce( self ):
+        """
+        Sums pending values into the reduced ones.
+        """
+        if len(self._pending)==0:
+            return
+        keys = [ numpy.concatenate( [k]+[ p[0][i] for p in self._pending ] ) for i,k in enumerate(self._keys) ]
+        values = [ numpy.concatenate( [v]+[ p[1][i] for p in self._pending ] ) for i,v in enumerate(self._values) ]
+        self._pending, self._npending = [], 0
+
+        # entries are sorted by keys, and the values of each distinct key summed up
+        order = numpy.lexsort(keys[::-1])
+        keys = [ k[order] for k in keys ]
+        starts = numpy.zeros(len(order), dtype=bool)
+        starts[:1] = True
+        for k in keys:
+            starts[1:] |= k[1:]!=k[:-1]
+        starts = numpy.flatnonzero(starts)
+        self._keys = [ k[starts] for k in keys ]
+        self._values = [ numpy.add.reduceat(v[order], starts) if len(starts)>0 else v for v in values ]
+
+    def items( self ):
+        """
+        Returns a 2-tuple (keys, values) of lists of arrays, with distinct keys sorted.
+        """
+        self.reduce()
+        return self._keys, self._values
+
+    def merge( self, other, codesMaps, sortKeys=None ):
+        """
+        Adds the values of another tallies, whose keys are encoded differently.
+
+        Parameters
+        ----------
+        other : _Tallies
+            The tallies to be merged into this one.
+
+        codesMaps : list
+            For each key code, an integer array mapping codes of the other tallies to codes of
+            this one, or None if codes are the same.
+
+        sortKeys (optional) : list
+            Positions of key codes which are sorted in each key, as the endpoints of undirected
+            edges. They are sorted again after being mapped.
+        """
+        keys, values = other.items()
+        keys = [ k if cmap is None else cmap[k] for k,cmap in zip(keys,codesMaps) ]
+        if sortKeys is not None:
+            i, j = sortKeys
+            keys[i], keys[j] = numpy.minimum(keys[i],keys[j]), numpy.maximum(keys[i],keys[j])
+        self.add(keys, values)
+
+
+class SCNAccumulator:
+    """
+    Accumulates records into the nodes and edges counts of a species-collectors network, batch by
+    batch. Memory depends on the number of distinct nodes and edges, not on the number of records.
+
+    Class methods
+    -------------
+    .addRecords
+    .merge
+    .toSCN
+    .toSparseSCN
+
+    Examples
+    --------
+    >>> acc = SCNAccumulator()
+    >>> for chunk in chunks:
+    ...     acc.addRecords(chunk['species'], chunk['recordedBy_atomized'], namesMap=nm)
+    >>> scn = acc.toSCN()
+    """
+    def __init__( self ):
+        self._collectors = _Vocabulary()
+        self._species = _Vocabulary()
+        self._edges = _Tallies(2, [numpy.int64])
+        self._speciesCounts = _Tallies(1, [numpy.int64])
+
+    def addRecords( self, species, collectors, namesMap=None ):
+        """
+        Adds a batch of records, with the same input formats as SCN.
+
+        Parameters
+        ----------
+        species : iterable
+            The species of each record.
+
+        collectors : iterable
+            An iterable of iterables with the collectors of each record.
+
+        namesMap (optional) : caryocar.NamesMap
+            A caryocar NamesMap object for normalizing collectors names.
+        """
+        nmap = namesMap.getMap() if namesMap else None
+        cols, spp, m, colsCounts, sppCounts = biadjacencyFromRecords(species, collectors, namesMap=nmap, dropEmptySpecies=False)
+        colsCodes, sppCodes = self._collectors.encode(cols), self._species.encode(spp)
+        m = m.tocoo()
+        self._edges.add( (colsCodes[m.row],sppCodes[m.col]), (m.data,) )
+        self._speciesCounts.add( (sppCodes,), (sppCounts,) )
+        return self
+
+    def merge( self, other ):
+        """
+        Adds the records accumulated by another SCNAccumulator (e.g. built on another shard of
+        records), reconciling nodes labels. Merging is associative, so partial accumulators can be
+        merged in any grouping.
+
+        Returns
+        -------
+        The accumulator itself.
+        """
+        colsMap = self._collectors.encode(other._collectors.labels)
+        sppMap = self._species.encode(other._species.labels)
+        self._edges.merge( other._edges, [colsMap,sppMap] )
+        self._speciesCounts.merge( other._speciesCounts, [sppMap] )
+        return self
+
+    def _getBiadjMatrix( self ):
+        """
+        Returns the accumulated biadjacency matrix as a 5-tuple, as `biadjacencyFromRecords` does.
+        """
+        (rows,cols), (data,) = self._edges.items()
+        (sppCodes,), (sppCounts,) = self._speciesCounts.items()
+        colsLabels, sppLabels = self._collectors.labels, self._species.labels
+
+        # labels are sorted, and species without collectors left out
+        colsOrder = numpy.array( sorted(range(len(colsLabels)), key=colsLabels.__getitem__), dtype=numpy.int64 )
+        hasCollectors = numpy.zeros(len(sppLabels), dtype=bool)
+        hasCollectors[cols] = True
+        sppOrder = numpy.array( sorted(numpy.flatnonzero(hasCollectors).tolist(), key=sppLabels.__getitem__), dtype=numpy.int64 )
+        colsRanks = numpy.argsort(colsOrder)
+        sppRanks = numpy.full(len(sppLabels), -1, dtype=numpy.int64)
+        sppRanks[sppOrder] = numpy.arange(len(sppOrder))
+
+        m = scipy.sparse.csr_matrix( (data,(colsRanks[rows],sppRanks[cols])), shape=(len(colsOrder),len(sppOrder)) )
+        m.sort_indices()
+        sppCountsAll = numpy.zeros(len(sppLabels), dtype=numpy.int64)
+        sppCountsAll[sppCodes] = sppCounts
+        return ( [ colsLabels[i] for i in colsOrder.tolist() ], [ sppLabels[i] for i in sppOrder.tolist() ], m,
+                 numpy.asarray(m.sum(axis=1)).ravel(), sppCountsAll[sppOrder] )
+
+    def toSCN( self ):
+        """
+        Creates a SCN from the accumulated records.
+        """
+        return SCN.fromBiadjMatrix( *self._getBiadjMatrix() )
+
+    def toSparseSCN( self ):
+        """
+        Creates a SparseSCN from the accumulated records.
+        """
+        return SparseSCN.fromBiadjMatrix( *self._getBiadjMatrix() )
+
+
+class CWNAccumulator:
+    """
+    Accumulates collectors cliques into the nodes and edges counts of a coworking network, batch by
+    batch. Memory depends on the number of distinct nodes, edges and (edge,taxon) pairs, not on
+    the number of records.
+
+    Parameters
+    ----------
+    taxonsStorage : str, default 'counter'
+        Either 'counter' or 'matrix', as in CWN. Taxons lists are not supported, as their length
+        is the number of records.
+
+    Class methods
+    -------------
+    .addRecords
+    .merge
+    .toCWN
+    """
+    def __init__( self, taxonsStorage='counter' ):
+        if taxonsStorage not in ['counter','matrix']:
+            raise ValueError("taxonsStorage argument must be either 'counter' or 'matrix'")
+        self._taxonsStorage = taxonsStorage
+        self._collectors = _Vocabulary()
+        self._taxons = _Vocabulary()
+        self._withTaxons = None
+        self._nodes = _Tallies(1, [numpy.int64])
+        self._edges = _Tallies(2, [numpy.int64,numpy.float64])
+        self._edgesTaxons = _Tallies(3, [numpy.int64])
+
+    def addRecords( self, cliques, taxons=None, namesMap=None ):
+        """
+        Adds a batch of records, with the same input formats as CWN.
+
+        Parameters
+        ----------
+        cliques : iterable
+            An iterable of iterables containing the collectors of each record.
+
+        taxons (optional) : iterable
+            The taxon of each record. Either all batches or none of them must have taxons.
+
+        namesMap (optional) : caryocar.NamesMap
+            A caryocar NamesMap object for normalizing collectors names.
+        """
+        if self._withTaxons is not None and self._withTaxons!=(taxons is not None):
+            raise ValueError("Either all batches of records or none of them must have taxons.")
+        self._withTaxons = taxons is not None
+
+        labels, m = incidenceMatrix(cliques, namesMap=namesMap.getMap() if namesMap else None)
+        codes = self._collectors.encode(labels)
+        self._nodes.add( (codes,), (m.getnnz(axis=0),) )
+
+        u, v, counts, weights = coworkingEdgesArrays( *coworkingMatrices(m) )
+        u, v = codes[u], codes[v]
+        self._edges.add( (numpy.minimum(u,v),numpy.maximum(u,v)), (counts,weights) )
+
+        if taxons is not None:
+            taxonsCodes, taxonsLabels = factorize(taxons)
+            taxonsCodes = self._taxons.encode(taxonsLabels)[taxonsCodes]
+            u, v, recs = cliquesPairs(m)
+            u, v = codes[u], codes[v]
+            self._edgesTaxons.add( (numpy.minimum(u,v),numpy.maximum(u,v),taxonsCodes[recs]),
+                                   (numpy.ones(len(recs), dtype=numpy.int64),) )
+        return self
+
+    def merge( self, other ):
+        """
+        Adds the records accumulated by another CWNAccumulator (e.g. built on another shard of
+        records), reconciling nodes and taxons labels. Merging is associative, so partial
+        accumulators can be merged in any grouping.
+
+        Returns
+        -------
+        The accumulator itself.
+        """
+        if self._taxonsStorage!=other._taxonsStorage:
+            raise ValueError("Accumulators with different taxons storages cannot be merged.")
+        if None not in (self._withTaxons,other._withTaxons) and self._withTaxons!=other._withTaxons:
+            raise ValueError("Either all batches of records or none of them must have taxons.")
+        if other._withTaxons is not None:
+            self._withTaxons = other._withTaxons
+
+        colsMap = self._collectors.encode(other._collectors.labels)
+        taxonsMap = self._taxons.encode(other._taxons.labels)
+        self._nodes.merge( other._nodes, [colsMap] )
+        self._edges.merge( other._edges, [colsMap,colsMap], sortKeys=(0,1) )
+        self._edgesTaxons.merge( other._edgesTaxons, [colsMap,colsMap,taxonsMap], sortKeys=(0,1) )
+        return self
+
+    def toCWN( self ):
+        """
+        Creates a CWN from the accumulated records.
+        """
+        labels = self._collectors.labels
+        (nodes,), (nodesCounts,) = self._nodes.items()
+        (u,v), (counts,weights) = self._edges.items()
+
+        edgesTaxons, taxons = None, None
+        if self._withTaxons:
+            (tu,tv,tt), (tcounts,) = self._edgesTaxons.items()
+            edgesTaxons = EdgesTaxonsMatrix(labels, tu, tv, tt, self._taxons.labels, tcounts)
+            if self._taxonsStorage=='counter':
+                taxons = [ edgesTaxons.rowTaxons(row) for row in range(len(edgesTaxons)) ]
+                edgesTaxons = None
+
+        edges = coworkingEdges(labels, u, v, counts, weights, taxons, taxonsAttr=edgesTaxons is None)
+
+        nodesCounts = dict( zip( map(labels.__getitem__, nodes.tolist()), nodesCounts.tolist() ) )
+        return CWN.fromAggregates(nodesCounts, edges, edgesTaxons, taxonsStorage=self._taxonsStorage)
+
+
+class ModelsBuilder:
+    """
+    Builds SCN and CWN models from occurrence records (e.g. a Darwin Core occurrence file), chunk
+    by chunk. Names in each chunk are atomized with a NamesAtomizer and normalized with a NamesMap,
+    and chunks are then accumulated into nodes and edges counts, so that the records never have to
+    be held in memory as a whole.
+
+    Parameters
+    ----------
+    atomizer : caryocar.cleaning.NamesAtomizer
+        The atomizer used to split names strings into names. Only distinct names strings of each
+        chunk are atomized.
+
+    namesMap (optional) : caryocar.cleaning.NamesMap
+        A names map used to normalize collectors names. Names which are not in the map yet are
+        added to it, chunk by chunk, if the map supports it.
+
+    collectorsCol : str, default 'recordedBy'
+        Column with collectors names strings.
+
+    speciesCol : str, default 'species'
+        Column with species of records, used by the SCN.
+
+    taxonsCol (optional) : str
+        Column with taxons recorded by collectors cliques, used by the CWN.
+
+    models : tuple, default ('scn','cwn')
+        Models to be built.
+
+    taxonsStorage : str, default 'counter'
+        How taxons recorded by each CWN edge are stored. Either 'counter' or 'matrix'.
+
+    Class methods
+    -------------
+    .addChunk
+    .readOccurrences
+    .merge
+    .getSCN
+    .getCWN
+
+    Examples
+    --------
+    >>> na = NamesAtomizer(atomizeOp=namesFromString)
+    >>> nm = read_NamesMap_fromJson(namesMap_file, normalizationFunc=normalize)
+    >>> builder = ModelsBuilder(na, namesMap=nm).readOccurrences('occurrence.txt', chunksize=500000)
+    >>> scn, cwn = builder.getSCN(), builder.getCWN()
+    """
+    def __init__( self, atomizer, namesMap=None, collectorsCol='recordedBy', speciesCol='species', taxonsCol=None,
+                  models=('scn','cwn'), taxonsStorage='counter' ):
+        if not set(models) <= {'scn','cwn'}:
+            raise ValueError("models must be either 'scn' or 'cwn'")
+        self._atomizer = atomizer
+        self._namesMap = namesMap
+        self._collectorsCol = collectorsCol
+        self._speciesCol = speciesCol
+        self._taxonsCol = taxonsCol
+        self._scn = SCNAccumulator() if 'scn' in models else None
+        self._cwn = CWNAccumulator(taxonsStorage=taxonsStorage) if 'cwn' in models else None
+        self.nrecords = 0
+
+    def _usedColumns( self ):
+        cols = [ self._collectorsCol ]
+        if self._scn is not None: cols.append(self._speciesCol)
+        if self._cwn is not None and self._taxonsCol is not None: cols.append(self._taxonsCol)
+        return list(dict.fromkeys(cols))
+
+    def addChunk( self, df ):
+        """
+        Adds a chunk of records. Each model ignores records missing any of the columns it uses:
+        records without collectors are ignored by both, records without species by the SCN, and
+        records without taxons by the CWN (if taxonsCol is set).
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            A chunk of occurrence records.
+        """
+        notnull = df[self._usedColumns()].notnull()
+        hasCollectors = notnull[self._collectorsCol]
+        forSCN = hasCollectors & (self._scn is not None)
+        if self._scn is not None: forSCN &= notnull[self._speciesCol]
+        forCWN = hasCollectors & (self._cwn is not None)
+        if self._cwn is not None and self._taxonsCol is not None: forCWN &= notnull[self._taxonsCol]
+
+        # collectors are atomized once for records used by any of the models
+        kept = forSCN | forCWN
+        df, forSCN, forCWN = df[kept], forSCN[kept], forCWN[kept]
+        collectors = self._atomizer.atomize( df[self._collectorsCol], unique=True, cacheResult=False )
+
+        if self._namesMap is not None and hasattr(self._namesMap, 'addNames'):
+            self._namesMap.addNames( list(set(chain.from_iterable(collectors))) )
+
+        if self._scn is not None:
+            self._scn.addRecords( df[self._speciesCol][forSCN], collectors[forSCN], namesMap=self._namesMap )
+        if self._cwn is not None:
+            taxons = None if self._taxonsCol is None else df[self._taxonsCol][forCWN]
+            self._cwn.addRecords( collectors[forCWN], taxons=taxons, namesMap=self._namesMap )
+        self.nrecords += len(df)
+        return self
+
+    def readOccurrences( self, filepath, chunksize=100000, sep='\t', **kwargs ):
+        """
+        Reads records from an occurrence file in chunks, and adds them to the models.
+
+        Parameters
+        ----------
+        filepath : str or file-like object
+            Path to the occurrence file, e.g. the occurrence.txt file of a Darwin Core archive.
+
+        chunksize : int, default 100000
+            Number of records read at once.
+
+        sep : str, default '\\t'
+            Columns delimiter. Darwin Core occurrence files are tab delimited.
+
+        kwargs :
+            Other arguments passed to `pandas.read_csv`. Only used columns are read.
+        """
+        if pandas is None:
+            raise ImportError("pandas is required for reading occurrence files.")
+        kwargs.setdefault('dtype', str)
+        reader = pandas.read_csv(filepath, sep=sep, usecols=self._usedColumns(), chunksize=chunksize, **kwargs)
+        for chunk in reader:
+            self.addChunk(chunk)
+        return self
+
+    def merge( self, other ):
+        """
+        Adds the records read by another ModelsBuilder (e.g. on another shard of the occurrence
+        records) to the models.
+
+        Returns
+        -------
+        The builder itself.
+        """
+        for acc, otherAcc in [ (self._scn,other._scn), (self._cwn,other._cwn) ]:
+            if (acc is None)!=(otherAcc is None):
+                raise ValueError("Builders of different models cannot be merged.")
+            if acc is not None:
+                acc.merge(otherAcc)
+        self.nrecords += other.nrecords
+        return self
+
+    def __getstate__( self ):
+        # builders sent between processes leave the atomizer and names map behind, as they are
+        # only needed for adding chunks, and may not be picklable (e.g. if they use lambdas)
+        state = self.__dict__.copy()
+        state['_atomizer'] = state['_namesMap'] = None
+        return state
+
+    def getSCN( self, sparse=False ):
+        """
+        Creates the SCN from the records read so far.
+
+        Parameters
+        ----------
+        sparse : bool, default False
+            If set to True a matrix-native SparseSCN is returned instead.
+        """
+        if self._scn is None:
+            raise ValueError("The builder does not build a SCN.")
+        return self._scn.toSparseSCN() if sparse else self._scn.toSCN()
+
+    def getCWN( self ):
+        """
+        Creates the CWN from the records read so far.
+        """
+        if self._cwn is None:
+            raise ValueError("The builder does not build a CWN.")
+        return self._cwn.toCWN()
+
+
+def mergeAccumulators( accumulators ):
+    """
+    Merges partial accumulators (SCNAccumulator, CWNAccumulator or ModelsBuilder instances of the
+    same kind) into the first one.
+
+    Parameters
+    ----------
+    accumulators : iterable
+        Partial accumulators, e.g. built on shards of records.
+
+    Returns
+    -------
+    The merged accumulator.
+    """
+    accumulators = iter(accumulators)
+    try:
+        merged = next(accumulators)
+    except StopIteration:
+        raise ValueError("There are no accumulators to merge.")
+    for acc in accumulators:
+        merged.merge(acc)
+    return merged
+
+
+def accumulateInParallel( accumulate, shards, processes=None ):
+    """
+    Builds partial accumulators from shards of records in a process pool, and merges them as they
+    are done.
+
+    Parameters
+    ----------
+    accumulate : function
+        A function called with a shard, which returns an accumulator (a SCNAccumulator, a
+        CWNAccumulator or a ModelsBuilder). It must be picklable, i.e. defined at module level.
+
+    shards : iterable
+        Shards of records, e.g. paths to occurrence files or (species, collectors) tuples.
+
+    processes (optional) : int
+        Number of worker processes. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    The merged accumulator, to be finalized into a network model.
+
+    Examples
+    --------
+    >>> def buildShard(path):
+    ...     na = NamesAtomizer(atomizeOp=namesFromString)
+    ...     nm = read_NamesMap_fromJson(namesMap_file, normalizationFunc=normalize)
+    ...     return ModelsBuilder(na, namesMap=nm).readOccurrences(path)
+    >>> builder = accumulateInParallel(buildShard, ['occurrence_1.txt','occurrence_2.txt'])
+    >>> scn, cwn = builder.getSCN(), builder.getCWN()
+    """
+    with multiprocessing.Pool(processes) as pool:
+        return mergeAccumulators( pool.imap(accumulate, shards) )
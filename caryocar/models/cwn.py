@@ -6,7 +6,10 @@ Coworking Networks
 """
 import networkx
 import itertools
+import numpy
 from collections import Counter
+from .matrices import incidenceMatrix, cliquesPairs, factorize, EdgesTaxonsMatrix
+from .matrices import coworkingMatrices, coworkingEdgesArrays, coworkingEdges
 
 __author__ = "Pedro Correia de Siracusa"
 __copyright__ = "Copyright 2018"
@@ -27,13 +30,30 @@ class CWN(networkx.Graph):
     namesMap (optional) : caryocar.NamesMap.
         A caryocar NamesMap object for normalizing nodes names.
         
+    engine : str, default 'python'
+        The engine used for aggregating cliques into edges. The 'python' engine
+        expands each clique into pairs of collectors. The 'sparse' engine encodes 
+        cliques as a sparse record x collector incidence matrix and derives edges 
+        attributes from sparse matrices products, which is much faster for large 
+        datasets. Both engines build the same network.
+        
+    taxonsStorage : str, default 'list'
+        How taxons recorded by each edge are stored. With 'list' the edge attribute `taxons`
+        is a list with the taxon of each record, and with 'counter' it is a Counter with the 
+        number of records of each taxon. With 'matrix' taxons are integer-coded and stored in 
+        a compact sparse edge x taxon counts matrix, which takes much less memory. In any case,
+        taxons recorded by an edge can be retrieved with the getEdgeTaxons method.
+        
     Edge attributes
     ---------------
     count: int
         The number of occurrences of the edge.
     
-    taxons: list (optional)
+    taxons: list or Counter (optional)
         A list with all taxons which were recorded by a pair of collectors (those forming the edge).
+        If taxons are stored as Counters this is a Counter with the number of records of each taxon.
+        If taxons are stored as a matrix this attribute is not set, and taxons are queried with
+        the getEdgeTaxons method.
     
     weight_hyperbolic: float
         The hyperbolic weight of the edge.
@@ -88,7 +108,7 @@ class CWN(networkx.Graph):
       ('d', 'e', {'count': 2, 'taxons': ['t2', 't1'], 'weight_hyperbolic': 1.5})])
     
     """
-    def __init__(self, data=None, cliques=None, taxons=None, namesMap=None, **attr):
+    def __init__(self, data=None, cliques=None, taxons=None, namesMap=None, engine='python', taxonsStorage='list', **attr):
         """
         Initialization of CWN class.
         
@@ -100,9 +120,26 @@ class CWN(networkx.Graph):
             
         namesMap (optional) : caryocar.NamesMap.
             A caryocar NamesMap object for normalizing nodes names.
+            
+        engine : str, default 'python'
+            Either 'python' or 'sparse'. The engine used for aggregating cliques into edges.
+            
+        taxonsStorage : str, default 'list'
+            Either 'list', 'counter' or 'matrix'. How taxons recorded by each edge are stored.
         """
+        if engine not in ['python','sparse']:
+            raise ValueError("engine argument must be either 'python' or 'sparse'")
+        if taxonsStorage not in ['list','counter','matrix']:
+            raise ValueError("taxonsStorage argument must be either 'list', 'counter' or 'matrix'")
+        
+        self._edges_taxons = None
+        self._taxonsStorage = taxonsStorage
+        nodes_counts = dict()
        
-        if cliques is not None:
+        if cliques is not None and engine=='sparse':
+            nodes_counts, data, self._edges_taxons = self._aggregateCliquesSparse(cliques, taxons, namesMap, taxonsStorage)
+            
+        elif cliques is not None:
             if namesMap:
                 nmap = namesMap.getMap()
                 cliques = [ [ nmap[n] for n in nset ] for nset in cliques ]
@@ -115,6 +152,7 @@ class CWN(networkx.Graph):
             e_attr_hyperbWeight=dict()
             e_attr_taxon=dict()
             e_attr_count=dict()
+            e_taxon_counts=Counter()
             
             # build edges from records
             if taxons is None: cliques_taxons = map( lambda c: (c,None), cliques)
@@ -125,25 +163,265 @@ class CWN(networkx.Graph):
                 for e in edgesFromClique:
                     e = tuple(sorted(e))
                     e_attr_count[e] = e_attr_count.get(e,0)+1
-                    e_attr_taxon[e] = e_attr_taxon.get(e,[])+[taxon] if taxons is not None else None
                     e_attr_hyperbWeight[e] = e_attr_hyperbWeight.get(e,0)+hyperb_weight(teamsize)
+                    if taxons is None: e_attr_taxon[e] = None
+                    elif taxonsStorage=='list': e_attr_taxon.setdefault(e,[]).append(taxon)
+                    elif taxonsStorage=='counter': e_attr_taxon.setdefault(e,Counter())[taxon]+=1
+                    else: e_taxon_counts[(e,taxon)]+=1
             
             edges = e_attr_count.keys()
             data = list(edges)
+            nodes_counts = Counter( col for clique in cliques for col in clique )
+            
+            if taxons is not None and taxonsStorage=='matrix':
+                self._edges_taxons = self._buildEdgesTaxonsMatrix(list(nodes_counts), e_taxon_counts)
             
         super().__init__(incoming_graph_data=data,**attr)
     
         # insert nodes and set count attribute
-        nodes_counts = Counter( col for clique in cliques for col in clique )
         nodes = nodes_counts.keys()
         
         self.add_nodes_from(nodes)
         networkx.set_node_attributes(self,values=nodes_counts,name='count')
        
         # set edges attributes
-        networkx.set_edge_attributes(self,e_attr_count,'count')
-        networkx.set_edge_attributes(self,e_attr_taxon,'taxons')
-        networkx.set_edge_attributes(self,e_attr_hyperbWeight,'weight_hyperbolic')
+        if engine=='python' and cliques is not None:
+            networkx.set_edge_attributes(self,e_attr_count,'count')
+            if self._edges_taxons is None:
+                networkx.set_edge_attributes(self,e_attr_taxon,'taxons')
+            networkx.set_edge_attributes(self,e_attr_hyperbWeight,'weight_hyperbolic')
+            
+    
+    @classmethod
+    def fromAggregates(cls, nodesCounts, edges, edgesTaxons=None, taxonsStorage='counter', **attr):
+        """
+        Creates a CWN from nodes counts and edges already aggregated from cliques (e.g. by a
+        CWNAccumulator).
+        
+        Parameters
+        ----------
+        nodesCounts : dict
+            Number of records of each collector, keyed by nodes.
+            
+        edges : iterable
+            3-tuples (u,v,attrDict), with edges attributes 'count', 'weight_hyperbolic' and
+            optionally 'taxons'.
+            
+        edgesTaxons (optional) : EdgesTaxonsMatrix
+            The compact edge x taxon store, if taxons are stored as a matrix.
+            
+        taxonsStorage : str, default 'counter'
+            How taxons are stored in edges, as in the constructor. It is 'matrix' if edgesTaxons is set.
+            
+        Returns
+        -------
+        A CWN.
+        """
+        g = cls(data=edges, taxonsStorage='matrix' if edgesTaxons is not None else taxonsStorage, **attr)
+        g._edges_taxons = edgesTaxons
+        g.add_nodes_from(nodesCounts.keys())
+        networkx.set_node_attributes(g, values=nodesCounts, name='count')
+        return g
+    
+    @staticmethod
+    def _buildEdgesTaxonsMatrix(nodes, e_taxon_counts):
+        """
+        Builds the compact edge x taxon store from a Counter keyed by (edge,taxon) tuples.
+        """
+        nodes_ix = dict( (n,i) for i,n in enumerate(nodes) )
+        taxons_codes, taxons_labels = factorize( t for e,t in e_taxon_counts.keys() )
+        u = [ nodes_ix[e[0]] for e,t in e_taxon_counts.keys() ]
+        v = [ nodes_ix[e[1]] for e,t in e_taxon_counts.keys() ]
+        counts = list(e_taxon_counts.values())
+        return EdgesTaxonsMatrix(nodes, u, v, taxons_codes, taxons_labels, counts)
+    
+    @staticmethod
+    def _aggregateCliquesSparse(cliques, taxons=None, namesMap=None, taxonsStorage='list'):
+        """
+        Aggregates cliques into nodes counts and edges, using a sparse record x collector incidence matrix.
+        
+        Returns
+        -------
+        A 3-tuple (nodes_counts, edges, edges_taxons), where nodes_counts is a dict keyed by nodes, edges
+        is a list of 3-tuples (u,v,attrDict) and edges_taxons is the compact edge x taxon store, if
+        taxons are stored as a matrix.
+        """
+        labels, m = incidenceMatrix(cliques, namesMap=namesMap.getMap() if namesMap else None)
+        e_u, e_v, e_counts, e_weights = coworkingEdgesArrays( *coworkingMatrices(m) )
+        
+        edges_taxons, e_attr_taxon = None, None
+            
+        # taxons lists are recovered in records order from the pairs of each record
+        if taxons is not None and taxonsStorage=='list':
+            taxons_arr = numpy.empty(m.shape[0], dtype=object)
+            for r,t in enumerate(taxons): taxons_arr[r] = t
+            n = m.shape[1]
+            u, v, recs = cliquesPairs(m)
+            keys = u*n+v
+            order = numpy.lexsort((recs,keys))
+            bounds = numpy.searchsorted( keys[order], e_u*n+e_v, side='right' )
+            e_attr_taxon = [ t.tolist() for t in numpy.split(taxons_arr[recs[order]], bounds[:-1]) ]
+            
+        # taxons of the pairs of each record are tallied in an edge x taxon matrix
+        elif taxons is not None:
+            taxons_codes, taxons_labels = factorize(taxons)
+            u, v, recs = cliquesPairs(m)
+            edges_taxons = EdgesTaxonsMatrix(labels, u, v, taxons_codes[recs], taxons_labels)
+            if taxonsStorage=='counter':
+                e_attr_taxon = [ edges_taxons.rowTaxons(row) for row in range(len(e_u)) ]
+                edges_taxons = None
+            
+        nodes_counts = dict( zip(labels, m.getnnz(axis=0).tolist()) )
+        edges = coworkingEdges(labels, e_u, e_v, e_counts, e_weights, e_attr_taxon, taxonsAttr=edges_taxons is None)
+        
+        return nodes_counts, edges, edges_taxons
+    
+    
+    def _recordsDeltas(self, cliques, taxons=None, namesMap=None):
+        """
+        Aggregates records into nodes counts and edges attributes deltas, as the python engine does.
+        Returns a 2-tuple (nodesDeltas, edgesDeltas), where nodesDeltas is a Counter keyed by nodes and
+        edgesDeltas is a dict of lists [count, weight_hyperbolic, taxonsList] keyed by edges.
+        """
+        if namesMap:
+            nmap = namesMap.getMap()
+            cliques = [ [ nmap[n] for n in nset ] for nset in cliques ]
+        cliques = [ list(set(nset)) for nset in cliques ]
+        
+        nodesDeltas = Counter( col for clique in cliques for col in clique )
+        edgesDeltas = dict()
+        for clique,taxon in zip(cliques, itertools.repeat(None) if taxons is None else taxons):
+            for e in itertools.combinations(clique,2):
+                delta = edgesDeltas.setdefault( tuple(sorted(e)), [0,0,[]] )
+                delta[0] += 1
+                delta[1] += 1/(len(clique)-1)
+                if taxons is not None: delta[2].append(taxon)
+        return nodesDeltas, edgesDeltas
+    
+    def _checkRecordsTaxons(self, taxons):
+        """
+        Raises a ValueError if records have taxons and the network does not, or vice versa. Networks
+        without edges accept records either way.
+        """
+        holdsTaxons = self._edges_taxons is not None or next( (t is not None for u,v,t in self.edges(data='taxons')), None )
+        if holdsTaxons is not None and holdsTaxons!=(taxons is not None):
+            raise ValueError("Either all records or none of them must have taxons.")
+    
+    def add_records(self, cliques, taxons=None, namesMap=None):
+        """
+        Adds records to the network in place. Nodes and edges 'count', edges 'weight_hyperbolic' and
+        taxons are increased, and new nodes and edges are added, so that the network is the same as
+        if it was built with all records. The cost is proportional to the number of records added.
+        
+        Parameters
+        ----------
+        cliques : iterable
+            An iterable of iterables containing the collectors of each record.
+            
+        taxons (optional) : iterable
+            The taxon of each record. It must be set if, and only if, the network holds taxons.
+            
+        namesMap (optional) : caryocar.NamesMap
+            A caryocar NamesMap object for normalizing nodes names.
+        """
+        self._checkRecordsTaxons(taxons)
+        nodesDeltas, edgesDeltas = self._recordsDeltas(cliques, taxons, namesMap)
+        for n,c in nodesDeltas.items():
+            if n in self._node: self._node[n]['count'] += c
+            else: self.add_node(n, count=c)
+        
+        for (u,v),(c,w,ts) in edgesDeltas.items():
+            if v not in self._adj[u]:
+                self.add_edge(u, v, count=0, weight_hyperbolic=0)
+                if self._edges_taxons is None: 
+                    self._adj[u][v]['taxons'] = None
+            d = self._adj[u][v]
+            d['count'] += c
+            d['weight_hyperbolic'] += w
+            if taxons is None:
+                continue
+            if self._edges_taxons is not None:
+                self._edges_taxons.addCounts( itertools.repeat(u), itertools.repeat(v), ts )
+            elif self._taxonsStorage=='counter':
+                d['taxons'] = (d['taxons'] or Counter()) + Counter(ts)
+            else:
+                d['taxons'] = (d['taxons'] or []) + ts
+    
+    def remove_records(self, cliques, taxons=None, namesMap=None):
+        """
+        Removes records from the network in place, e.g. to apply corrections. Nodes and edges
+        'count', edges 'weight_hyperbolic' and taxons are decreased, and nodes and edges left without
+        records are removed. The cost is proportional to the number of records removed. A ValueError
+        is raised, and the network is left unchanged, if records were not added to the network before.
+        
+        Parameters
+        ----------
+        cliques : iterable
+            An iterable of iterables containing the collectors of each record.
+            
+        taxons (optional) : iterable
+            The taxon of each record. It must be set if, and only if, the network holds taxons.
+            
+        namesMap (optional) : caryocar.NamesMap
+            A caryocar NamesMap object for normalizing nodes names.
+        """
+        self._checkRecordsTaxons(taxons)
+        nodesDeltas, edgesDeltas = self._recordsDeltas(cliques, taxons, namesMap)
+        
+        # records are checked before the network is changed
+        for n,c in nodesDeltas.items():
+            if n not in self._node or (self._node[n].get('count') or 0)<c:
+                raise ValueError("Records to be removed are not in the network (node '{}').".format(n))
+        for (u,v),(c,w,ts) in edgesDeltas.items():
+            if v not in self._adj[u] or (self._adj[u][v].get('count') or 0)<c:
+                raise ValueError("Records to be removed are not in the network (edge ('{}','{}')).".format(u,v))
+            if taxons is not None and Counter(ts) - (self.getEdgeTaxons(u,v) or Counter()):
+                raise ValueError("Taxons to be removed are not recorded by edge ('{}','{}').".format(u,v))
+        
+        for (u,v),(c,w,ts) in edgesDeltas.items():
+            d = self._adj[u][v]
+            d['count'] -= c
+            d['weight_hyperbolic'] -= w
+            if taxons is not None:
+                if self._edges_taxons is not None:
+                    self._edges_taxons.addCounts( itertools.repeat(u), itertools.repeat(v), ts, itertools.repeat(-1) )
+                elif self._taxonsStorage=='counter':
+                    d['taxons'] = d['taxons'] - Counter(ts)
+                else:
+                    remaining = Counter(ts)
+                    kept = []
+                    # the last occurrences of each taxon are removed
+                    for t in reversed(d['taxons']):
+                        if remaining[t]>0: remaining[t] -= 1
+                        else: kept.append(t)
+                    d['taxons'] = kept[::-1]
+            if d['count']==0:
+                self.remove_edge(u,v)
+        
+        for n,c in nodesDeltas.items():
+            self._node[n]['count'] -= c
+            if self._node[n]['count']==0:
+                self.remove_node(n)
+    
+    def getEdgeTaxons(self, u, v):
+        """
+        Gets the taxons recorded by a pair of collectors, regardless of how taxons are stored.
+        
+        Parameters
+        ----------
+        u, v : string
+            The ids of the collectors forming the edge.
+            
+        Returns
+        -------
+        A Counter with the number of records of each taxon by the edge, or None if the network
+        was built without taxons.
+        """
+        if self._edges_taxons is not None:
+            return self._edges_taxons.getTaxons(u,v)
+        
+        taxons = self.edges[(u,v)].get('taxons')
+        return None if taxons is None else Counter(taxons)
 
 
     def listCollectors(self,data=False):
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Hypergraph-backed Coworking Networks
+"""
+
+import numpy
+import scipy.sparse
+from collections import Counter
+from .cwn import CWN
+from .matrices import setReadOnly, incidenceMatrix, cliquesPairs, factorize, EdgesTaxonsMatrix
+from .matrices import hyperbolicWeights, coworkingMatrices, coworkingEdgesArrays, coworkingEdges
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2018"
+
+class HyperCWN:
+    """
+    Class for coworking networks backed by a hypergraph of collectors teams. Each distinct team is
+    stored once, as a row of a sparse binary team x collector incidence matrix, along with its
+    multiplicity (the number of records by the team) and the taxons it recorded. Teams are never
+    expanded into pairs of collectors, so large teams do not blow the network up. Edges attributes
+    and collaborators are computed on demand from the incidence matrix, and an equivalent CWN
+    (networkx graph) is only built on request, either for the whole network through the `graph`
+    property or for selected collectors through the `subgraph` method.
+
+    Parameters
+    ----------
+    cliques : iterable
+        An iterable of iterables containing names used to compose cliques in the network.
+
+    taxons (optional) : iterable
+        An iterable containing taxons recorded by each collector clique, in the same ordering as
+        the cliques iterable.
+
+    namesMap (optional) : caryocar.NamesMap
+        A caryocar NamesMap object for normalizing nodes names.
+
+    Class methods
+    -------------
+    .listCollectors
+    .listTeams
+    .listCollaborators
+    .listCollaborations
+    .getEdge
+    .getEdgeTaxons
+    .subgraph
+    .graph
+
+    Examples
+    --------
+    >>> collectors = [ ['a','b','c'], ['d','e'], ['a','c'], ['a','b','c'] ]
+    >>> cwn = HyperCWN(cliques=collectors)
+
+    >>> cwn.listTeams(data='count')
+    [(('a', 'b', 'c'), 2), (('d', 'e'), 1), (('a', 'c'), 1)]
+
+    >>> cwn.getEdge('a','c')
+    {'count': 3, 'weight_hyperbolic': 2.0}
+
+    >>> cwn.subgraph(['a','b']).edges(data=True)
+    [ ('a', 'b', {'count': 2, 'taxons': None, 'weight_hyperbolic': 1.0}) ]
+    """
+    def __init__(self, cliques=None, taxons=None, namesMap=None):
+        labels, m = incidenceMatrix(cliques if cliques is not None else [], namesMap=namesMap.getMap() if namesMap else None)
+        m.sort_indices()
+        if taxons is not None:
+            taxons = list(taxons)
+            if len(taxons)!=m.shape[0]:
+                raise ValueError("Cliques and taxons data lists have different lengths.")
+
+        # records are grouped by team, and records without collectors are left out
+        recs = numpy.flatnonzero( numpy.diff(m.indptr)>0 )
+        teamsCodes, teams = factorize( [ m.indices[m.indptr[r]:m.indptr[r+1]].tobytes() for r in recs.tolist() ] )
+        teamsRecs = numpy.zeros(len(teams), dtype=numpy.int64)
+        teamsRecs[teamsCodes[::-1]] = recs[::-1]
+        teamsMatrix = m[teamsRecs]
+        multiplicity = numpy.bincount(teamsCodes, minlength=len(teams))
+
+        teamsTaxons, taxonsLabels = None, None
+        if taxons is not None:
+            taxonsCodes, taxonsLabels = factorize( [ taxons[r] for r in recs.tolist() ] )
+            teamsTaxons = scipy.sparse.csr_matrix( (numpy.ones(len(recs),dtype=numpy.int64),(teamsCodes,taxonsCodes)),
+                                                   shape=(len(teams),len(taxonsLabels)) )
+            teamsTaxons.sum_duplicates()
+        self._setData(labels, teamsMatrix, multiplicity, teamsTaxons, taxonsLabels)
+
+    def _setData( self, collectors, teamsMatrix, multiplicity, teamsTaxons=None, taxons=None ):
+        m = scipy.sparse.csr_matrix(teamsMatrix)
+        m.sort_indices()
+
+        self._collectors = tuple(collectors)
+        self._collectors_ix = dict( (c,i) for i,c in enumerate(self._collectors) )
+        self._teams_matrix = setReadOnly(m)
+        self._teams_csc = None
+        self._multiplicity = numpy.asarray(multiplicity, dtype=numpy.int64)
+
+        self._teamsizes = numpy.diff(m.indptr)
+        self._hyperb_weights = hyperbolicWeights(self._teamsizes) * self._multiplicity
+
+        self._counts = numpy.asarray( m.T.dot(self._multiplicity) ).ravel()
+        self._teams_taxons = None if teamsTaxons is None else setReadOnly(scipy.sparse.csr_matrix(teamsTaxons))
+        self._taxons = None if taxons is None else tuple(taxons)
+        for arr in (self._multiplicity, self._teamsizes, self._hyperb_weights, self._counts): arr.flags.writeable = False
+        self._graph = None
+
+    def _getTeamsMatrix( self, fmt='csr' ):
+        """
+        Returns the team x collector incidence matrix, whose data arrays are read-only.
+
+        Parameters
+        ----------
+        fmt : str, default 'csr'
+            Sparse format of the matrix. Either 'csr' or 'csc'. Both forms are cached.
+        """
+        if fmt=='csc':
+            if self._teams_csc is None:
+                self._teams_csc = setReadOnly(self._teams_matrix.tocsc())
+            return self._teams_csc
+        elif fmt!='csr':
+            raise ValueError("fmt argument must be either 'csr' or 'csc'")
+        return self._teams_matrix
+
+    def _collectorTeams( self, collector ):
+        """
+        Returns a sorted array with the teams a collector belongs to.
+        """
+        m = self._getTeamsMatrix('csc')
+        j = self._collectors_ix[collector]
+        return m.indices[m.indptr[j]:m.indptr[j+1]]
+
+    def __len__( self ):
+        return len(self._collectors)
+
+    def __contains__( self, collector ):
+        return collector in self._collectors_ix
+
+    def listCollectors(self,data=False):
+        """
+        Lists collectors nodes.
+
+        Parameters
+        ----------
+        data : string or bool, default=False
+            If False only nodes ids are returned.
+            If True nodes ids are returned with their respective attribute dicts as (n, attrDict).
+            If a string is passed (with an attribute name) then its value is returned in a 2-tuple (n, attrValue).
+
+        Returns
+        -------
+        Either a list of tuples (n,attrDict) or (n,attrValue) where n is the node's id; or a list of nodes id's n.
+        """
+        if data==False:
+            return list(self._collectors)
+        elif data==True:
+            return [ (n,{'count':c}) for n,c in zip(self._collectors,self._counts.tolist()) ]
+        elif data=='count':
+            return list(zip(self._collectors,self._counts.tolist()))
+        else:
+            return [ (n,None) for n in self._collectors ]
+
+    def listTeams(self,data=False):
+        """
+        Lists distinct teams (hyperedges), as tuples of collectors.
+
+        Parameters
+        ----------
+        data : string or bool, default=False
+            If False only teams are returned.
+            If True teams are returned with their attribute dicts as (team, attrDict), with the
+            attributes 'count' (the team's multiplicity) and 'taxons' (a Counter, or None if the
+            network was built without taxons).
+            If a string is passed (with an attribute name) then its value is returned in a 2-tuple (team, attrValue).
+
+        Returns
+        -------
+        Either a list of tuples (team,attrDict) or (team,attrValue); or a list of teams.
+        """
+        m = self._teams_matrix
+        labels = self._collectors
+        teams = [ tuple( labels[j] for j in m.indices[m.indptr[i]:m.indptr[i+1]].tolist() ) for i in range(m.shape[0]) ]
+        if data==False:
+            return teams
+
+        counts = self._multiplicity.tolist()
+        taxons = [ self._rowsTaxons([i]) for i in range(len(teams)) ]
+        attrs = [ {'count':c,'taxons':t} for c,t in zip(counts,taxons) ]
+        if data==True:
+            return list(zip(teams,attrs))
+        return [ (t,d.get(data)) for t,d in zip(teams,attrs) ]
+
+    def _rowsTaxons( self, teams ):
+        if self._teams_taxons is None:
+            return None
+        tally = numpy.asarray( self._teams_taxons[teams].sum(axis=0) ).ravel()
+        return Counter( dict( (self._taxons[t],c) for t,c in zip(numpy.flatnonzero(tally).tolist(),tally[tally>0].tolist()) ) )
+
+    def _commonTeams( self, u, v ):
+        teams = numpy.intersect1d( self._collectorTeams(u), self._collectorTeams(v), assume_unique=True )
+        if u==v or len(teams)==0:
+            raise KeyError((u,v))
+        return teams
+
+    def getEdge(self, u, v):
+        """
+        Gets the attributes of the edge formed by a pair of collectors, from the teams they share.
+
+        Parameters
+        ----------
+        u, v : string
+            The ids of the collectors forming the edge.
+
+        Returns
+        -------
+        A dict with the 'count' and 'weight_hyperbolic' attributes of the edge. A KeyError is raised
+        if the collectors never recorded together.
+        """
+        teams = self._commonTeams(u,v)
+        return { 'count': int(self._multiplicity[teams].sum()),
+                 'weight_hyperbolic': float(self._hyperb_weights[teams].sum()) }
+
+    def getEdgeTaxons(self, u, v):
+        """
+        Gets the taxons recorded by a pair of collectors.
+
+        Parameters
+        ----------
+        u, v : string
+            The ids of the collectors forming the edge.
+
+        Returns
+        -------
+        A Counter with the number of records of each taxon by the edge, or None if the network
+        was built without taxons.
+        """
+        return self._rowsTaxons( self._commonTeams(u,v) )
+
+    def listCollaborations(self, collector):
+        """
+        Lists edges of a given collector, computed from its teams.
+
+        Parameters
+        ----------
+        collector: string
+            The id of the collector to retrieve collaborations from.
+
+        Returns
+        -------
+        A list of tuples (n,attrDict), where n is a collaborator and attrDict holds the 'count' and
+        'weight_hyperbolic' attributes of the edge between them.
+        """
+        teams = self._collectorTeams(collector)
+        sub = self._teams_matrix[teams]
+        counts = sub.T.dot(self._multiplicity[teams])
+        weights = sub.T.dot(self._hyperb_weights[teams])
+        j = self._collectors_ix[collector]
+        nbrs = [ n for n in numpy.flatnonzero(counts).tolist() if n!=j ]
+        return [ (self._collectors[n],{'count':int(counts[n]),'weight_hyperbolic':float(weights[n])}) for n in nbrs ]
+
+    def listCollaborators(self, collector, data=False):
+        """
+        Lists collaborators (neighbor nodes) of a given collector.
+
+        Parameters
+        ----------
+        collector: string
+            The id of the collector to retrieve collaborations from.
+
+        data : string or bool, default=False
+            If False only nodes ids are returned.
+            If True nodes ids are returned with their respective attribute dicts as (n, attrDict).
+            If a string is passed (with an attribute name) then its value is returned in a 2-tuple (n, attrValue).
+
+        Returns
+        -------
+        Either a list of tuples (n,attrDict) or (n,attrValue) where n is the node's id; or a list of nodes id's n.
+        """
+        nbrs = [ n for n,d in self.listCollaborations(collector) ]
+        if data==False:
+            return nbrs
+        counts = [ int(self._counts[self._collectors_ix[n]]) for n in nbrs ]
+        if data==True:
+            return [ (n,{'count':c}) for n,c in zip(nbrs,counts) ]
+        return [ (n,c if data=='count' else None) for n,c in zip(nbrs,counts) ]
+
+    def _pairwiseGraph( self, cols, taxonsStorage ):
+        """
+        Expands teams into pairs of the given collectors, building a CWN (networkx graph). Teams
+        keep their original sizes for hyperbolic weights.
+        """
+        labels = [ self._collectors[j] for j in cols.tolist() ]
+        m = self._teams_matrix[:,cols].tocsr()
+        m.sort_indices()
+
+        u, v, counts, weights = coworkingEdgesArrays( *coworkingMatrices(m, self._multiplicity, self._teamsizes) )
+
+        # taxons of the teams of each pair are tallied in an edge x taxon matrix
+        edgesTaxons, e_attr_taxon = None, None
+        if self._teams_taxons is not None:
+            pu, pv, teams = cliquesPairs(m)
+            tt = self._teams_taxons
+            nnz = numpy.diff(tt.indptr)[teams]
+            entries = numpy.repeat(tt.indptr[teams], nnz) + numpy.arange(nnz.sum()) - numpy.repeat(numpy.cumsum(nnz)-nnz, nnz)
+            edgesTaxons = EdgesTaxonsMatrix(labels, numpy.repeat(pu,nnz), numpy.repeat(pv,nnz), tt.indices[entries], self._taxons, tt.data[entries])
+            if taxonsStorage!='matrix':
+                e_attr_taxon = [ edgesTaxons.rowTaxons(row) for row in range(len(u)) ]
+                edgesTaxons = None
+
+        edges = coworkingEdges(labels, u, v, counts, weights, e_attr_taxon, taxonsAttr=edgesTaxons is None)
+        nodesCounts = dict( zip(labels, self._counts[cols].tolist()) )
+        return CWN.fromAggregates(nodesCounts, edges, edgesTaxons=edgesTaxons, taxonsStorage=taxonsStorage)
+
+    def subgraph(self, collectors, taxonsStorage='counter'):
+        """
+        Builds the CWN (networkx graph) induced by the given collectors, expanding only their pairs.
+
+        Parameters
+        ----------
+        collectors : iterable
+            The ids of the collectors to be included.
+
+        taxonsStorage : str, default 'counter'
+            How taxons recorded by each edge are stored, either 'counter' or 'matrix', as in CWN.
+
+        Returns
+        -------
+        A CWN.
+        """
+        if taxonsStorage not in ('counter','matrix'):
+            raise ValueError("taxonsStorage argument must be either 'counter' or 'matrix'")
+        cols = numpy.array( sorted( set( self._collectors_ix[c] for c in collectors ) ), dtype=numpy.int64 )
+        return self._pairwiseGraph(cols, taxonsStorage)
+
+    @property
+    def graph( self ):
+        """
+        A CWN (networkx graph) equivalent to this network, with taxons stored as Counters. It is
+        built on the first access and cached. Changes to the graph are not reflected in this network.
+        """
+        if self._graph is None:
+            self._graph = self._pairwiseGraph( numpy.arange(len(self._collectors)), 'counter' )
+        return self._graph
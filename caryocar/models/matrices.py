@@ -0,0 +1,677 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sparse matrices helpers for building and querying network models
+"""
+
+import itertools
+import numpy
+import scipy.sparse
+from collections import Counter
+from ..encoding import factorize
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2018"
+
+
+def flattenNames( namesLists ):
+    """
+    Flattens an iterable of names iterables into a single list.
+
+    Parameters
+    ----------
+    namesLists : iterable
+        An iterable of iterables containing names (e.g. collectors cliques). Names already
+        flattened, such as a NamesColumn with `tokens` and `offsets` attributes, are used as is.
+
+    Returns
+    -------
+    A 2-tuple (names, offsets), where names is a flat list with all names and offsets is
+    an integer array such that names in record i are names[offsets[i]:offsets[i+1]].
+    """
+    if hasattr(namesLists,'tokens') and hasattr(namesLists,'offsets'):
+        return list(namesLists.tokens), numpy.asarray(namesLists.offsets, dtype=numpy.int64)
+
+    names = []
+    lengths = []
+    for nlst in namesLists:
+        if isinstance(nlst,str):
+            raise ValueError("Names data input must be in the format of list of lists of strings.")
+        names.extend(nlst)
+        lengths.append(len(nlst))
+
+    offsets = numpy.zeros(len(lengths)+1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    return names, offsets
+
+
+def incidenceMatrix( namesLists, namesMap=None ):
+    """
+    Builds a binary record x name incidence matrix from an iterable of names iterables.
+    Names repeated in a same record are counted once.
+
+    Parameters
+    ----------
+    namesLists : iterable
+        An iterable of iterables containing names. Each iterable is a record (row).
+
+    namesMap (optional) : dict
+        A mapping used to normalize names before encoding them.
+
+    Returns
+    -------
+    A 2-tuple (labels, m), where labels is a list with names associated to matrix columns and
+    m is a scipy CSR sparse matrix.
+    """
+    names, offsets = flattenNames(namesLists)
+    codes, labels = factorize(names)
+
+    # normalize distinct names only, then re-encode
+    if namesMap is not None:
+        mappedCodes, labels = factorize( namesMap[n] for n in labels )
+        codes = mappedCodes[codes]
+
+    nrecords = len(offsets)-1
+    rows = numpy.repeat( numpy.arange(nrecords), numpy.diff(offsets) )
+    data = numpy.ones(len(codes), dtype=numpy.int64)
+    m = scipy.sparse.csr_matrix( (data,(rows,codes)), shape=(nrecords,len(labels)) )
+    m.sum_duplicates()
+    m.data[:] = 1
+    return labels, m
+
+
+def encodeRecords( species, collectors, namesMap=None ):
+    """
+    Encodes records, where each record associates a species to a list of collectors, as integer
+    codes into sorted labels.
+
+    Parameters
+    ----------
+    species : iterable
+        The species of each record.
+
+    collectors : iterable
+        An iterable of iterables with the collectors of each record.
+
+    namesMap (optional) : dict
+        A mapping used to normalize collectors names before encoding them.
+
+    Returns
+    -------
+    A 5-tuple (collectors, species, collectorsCodes, offsets, speciesCodes), where collectors and
+    species are sorted lists of labels, collectorsCodes is an integer array with codes of collectors
+    of all records, such that those of record i are collectorsCodes[offsets[i]:offsets[i+1]], and
+    speciesCodes is an integer array with the species code of each record.
+    """
+    names, offsets = flattenNames(collectors)
+    colCodes, colLabels = factorize(names)
+    if namesMap is not None:
+        mappedCodes, colLabels = factorize( namesMap[n] for n in colLabels )
+        colCodes = mappedCodes[colCodes]
+
+    spCodes, spLabels = factorize(species)
+    if len(spCodes)!=len(offsets)-1:
+        raise ValueError("Species and collectors data lists have different lengths.")
+
+    # names types are checked only once for each distinct name
+    if not all( isinstance(c,str) for c in colLabels ):
+        raise ValueError("Collectors data input must be in the format of list of lists of strings.")
+    if not all( isinstance(sp,str) for sp in spLabels ):
+        raise ValueError("Species data input must be in the format of list of strings.")
+
+    # labels are sorted, and so are codes
+    argsort = lambda labels: numpy.array( sorted(range(len(labels)), key=labels.__getitem__), dtype=numpy.int64 )
+    colOrder, spOrder = argsort(colLabels), argsort(spLabels)
+    colRanks, spRanks = numpy.argsort(colOrder), numpy.argsort(spOrder)
+    colLabels, spLabels = [ colLabels[i] for i in colOrder ], [ spLabels[i] for i in spOrder ]
+    return colLabels, spLabels, colRanks[colCodes], offsets, spRanks[spCodes]
+
+
+def biadjacencyFromRecords( species, collectors, namesMap=None, dropEmptySpecies=True ):
+    """
+    Builds a collector x species biadjacency matrix from records, where each record associates 
+    a species to a list of collectors. Species without any collector are left out, unless
+    dropEmptySpecies is False.
+
+    Parameters
+    ----------
+    species : iterable
+        The species of each record.
+
+    collectors : iterable
+        An iterable of iterables with the collectors of each record.
+
+    namesMap (optional) : dict
+        A mapping used to normalize collectors names before encoding them.
+
+    dropEmptySpecies : bool, default True
+        If set to False species recorded without collectors are kept, as empty columns.
+
+    Returns
+    -------
+    A 5-tuple (collectors, species, m, collectorsCounts, speciesCounts), where collectors and species
+    are sorted lists with labels of rows and columns of m, a scipy CSR sparse matrix with the number of
+    records of each species by each collector. collectorsCounts and speciesCounts are integer arrays 
+    with the number of records of each collector and species.
+    """
+    colLabels, spLabels, rows, offsets, spCodes = encodeRecords(species, collectors, namesMap=namesMap)
+    cols = numpy.repeat( spCodes, numpy.diff(offsets) )
+
+    m = scipy.sparse.csr_matrix( (numpy.ones(len(rows),dtype=numpy.int64),(rows,cols)), shape=(len(colLabels),len(spLabels)) )
+    m.sum_duplicates()
+    spCounts = numpy.bincount( spCodes, minlength=len(spLabels) )
+
+    # species recorded without collectors are not nodes of the network
+    hasCollectors = m.getnnz(axis=0)>0
+    if dropEmptySpecies and not hasCollectors.all():
+        m = m[:,hasCollectors]
+        spLabels = [ sp for sp,keep in zip(spLabels,hasCollectors) if keep ]
+        spCounts = spCounts[hasCollectors]
+
+    colCounts = numpy.asarray(m.sum(axis=1)).ravel()
+    return colLabels, spLabels, m, colCounts, spCounts
+
+
+def groupingMatrix( grouping, index ):
+    """
+    Builds a binary group x item indicator matrix from a grouping of items (e.g. a grouping of
+    species into genera or families). Items which are not in the index are ignored, and so are
+    groups left without any item.
+
+    Parameters
+    ----------
+    grouping : dict
+        Either a dict mapping each group to an iterable of its items, or a dict mapping each
+        item to its group (a string).
+
+    index : dict
+        A dict mapping items labels to matrix columns.
+
+    Returns
+    -------
+    A 2-tuple (groups, m), where groups is a list with groups labels associated to matrix rows and
+    m is a scipy CSR sparse matrix with shape (len(groups), len(index)).
+    """
+    members = dict()
+    for k,v in grouping.items():
+        if isinstance(v,str):
+            if k in index: members.setdefault(v,set()).add(index[k])
+        else:
+            members.setdefault(k,set()).update( index[i] for i in v if i in index )
+
+    groups = [ grp for grp,ixes in members.items() if len(ixes)>0 ]
+    lengths = [ len(members[grp]) for grp in groups ]
+    rows = numpy.repeat( numpy.arange(len(groups)), lengths )
+    cols = numpy.fromiter( (i for grp in groups for i in sorted(members[grp])), dtype=numpy.int64, count=sum(lengths) )
+    m = scipy.sparse.csr_matrix( (numpy.ones(len(rows),dtype=numpy.int64),(rows,cols)), shape=(len(groups),len(index)) )
+    return groups, m
+
+
+def cliquesPairs( m ):
+    """
+    Expands every record of a binary record x name incidence matrix into all pairs of names
+    in that record, without building Python objects for each pair.
+
+    Parameters
+    ----------
+    m : scipy CSR sparse matrix
+        A binary record x name incidence matrix, as built by `incidenceMatrix`.
+
+    Returns
+    -------
+    A 3-tuple of integer arrays (u, v, records), where u<v are the columns of each pair and
+    records are the rows in which the pair appears.
+    """
+    m = m.tocsr()
+    m.sort_indices()
+    teamsizes = numpy.diff(m.indptr)
+    us, vs, recs = [], [], []
+    # records are grouped by team size, so that pairs are generated by plain array indexing
+    for k in numpy.unique(teamsizes[teamsizes>1]):
+        rows = numpy.flatnonzero(teamsizes==k)
+        members = m.indices[ m.indptr[rows][:,None] + numpy.arange(k) ]
+        iu, ju = numpy.triu_indices(k, 1)
+        us.append( members[:,iu].ravel() )
+        vs.append( members[:,ju].ravel() )
+        recs.append( numpy.repeat(rows, len(iu)) )
+
+    if len(recs)==0:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return empty, empty, empty
+    return numpy.concatenate(us), numpy.concatenate(vs), numpy.concatenate(recs)
+
+
+def hyperbolicWeights( teamsizes ):
+    """
+    Computes the hyperbolic weight of each record, 1/(k-1) where k is the number of names in the
+    record. Records with less than two names weigh zero.
+    """
+    teamsizes = numpy.asarray(teamsizes)
+    weights = numpy.zeros(len(teamsizes))
+    numpy.divide(1, teamsizes-1, out=weights, where=teamsizes>1)
+    return weights
+
+
+def coworkingMatrices( m, recordWeights=None, teamsizes=None ):
+    """
+    Computes the number of records and the hyperbolic weight of every pair of names which appear
+    together in records of a binary record x name incidence matrix. The hyperbolic weight of a pair
+    sums 1/(k-1) over the records in which it appears, where k is the number of names in the record.
+
+    Parameters
+    ----------
+    m : scipy CSR sparse matrix
+        A binary record x name incidence matrix, as built by `incidenceMatrix`.
+
+    recordWeights (optional) : array-like of ints
+        Number of times each record is observed (e.g. the multiplicity of a team). Defaults to 1.
+
+    teamsizes (optional) : array-like of ints
+        Number of names in each record, if m only holds some of the names (e.g. a subset of
+        columns). Defaults to the number of names of each row of m.
+
+    Returns
+    -------
+    A 2-tuple (counts, hyperb) of upper triangular scipy CSR sparse name x name matrices, with
+    sorted indices. Counts are integers.
+    """
+    hyperbWeights = hyperbolicWeights( m.getnnz(axis=1) if teamsizes is None else teamsizes )
+    recordWeights = numpy.ones(m.shape[0], dtype=numpy.int64) if recordWeights is None else numpy.asarray(recordWeights, dtype=numpy.int64)
+
+    mT = m.T.tocsr()
+    counts = scipy.sparse.triu( mT.dot(m.multiply(recordWeights[:,None]).tocsr()), k=1 ).tocsr().astype(numpy.int64)
+    hyperb = scipy.sparse.triu( mT.dot(m.multiply((hyperbWeights*recordWeights)[:,None]).tocsr()), k=1 ).tocsr()
+    counts.sort_indices()
+    hyperb.sort_indices()
+    return counts, hyperb
+
+
+def coworkingEdgesArrays( counts, hyperb ):
+    """
+    Lists the entries of a pairs counts matrix along with the matching hyperbolic weights, as
+    computed by `coworkingMatrices`. Pairs whose count is zero are left out.
+
+    Returns
+    -------
+    A 4-tuple of arrays (u, v, counts, weights), sorted by u and v.
+    """
+    counts = scipy.sparse.csr_matrix(counts)
+    counts.eliminate_zeros()
+    counts.sort_indices()
+    counts = counts.tocoo()
+    weights = numpy.asarray( scipy.sparse.csr_matrix(hyperb)[counts.row,counts.col] ).ravel() if counts.nnz>0 else numpy.zeros(0)
+    return counts.row.astype(numpy.int64), counts.col.astype(numpy.int64), counts.data, weights
+
+
+def coworkingEdges( labels, u, v, counts, weights, taxons=None, taxonsAttr=True ):
+    """
+    Builds a list of coworking network edges, with their 'count', 'weight_hyperbolic' and 'taxons'
+    attributes, from arrays of pairs.
+
+    Parameters
+    ----------
+    labels : list
+        Nodes labels. Pairs endpoints are given as positions in this list.
+
+    u, v, counts, weights : array-like
+        Endpoints, counts and hyperbolic weights of each pair.
+
+    taxons (optional) : list
+        Taxons recorded by each pair. If not set, the 'taxons' attribute is None.
+
+    taxonsAttr : bool, default True
+        If set to False the 'taxons' attribute is not set, e.g. because taxons are stored apart
+        from edges.
+
+    Returns
+    -------
+    A list of 3-tuples (u,v,attrDict).
+    """
+    edgesAttrs = zip( numpy.asarray(u).tolist(), numpy.asarray(v).tolist(), numpy.asarray(counts).tolist(), numpy.asarray(weights).tolist() )
+    if not taxonsAttr:
+        return [ (labels[i],labels[j],{'count':c,'weight_hyperbolic':w}) for i,j,c,w in edgesAttrs ]
+    taxons = itertools.repeat(None) if taxons is None else taxons
+    return [ (labels[i],labels[j],{'count':c,'taxons':t,'weight_hyperbolic':w}) for (i,j,c,w),t in zip(edgesAttrs,taxons) ]
+
+
+def setReadOnly( m ):
+    """
+    Makes the data and index arrays of a scipy CSR or CSC sparse matrix read-only, so that a
+    matrix can be shared without being copied. Returns the matrix itself.
+    """
+    for arr in (m.data, m.indices, m.indptr):
+        arr.flags.writeable = False
+    return m
+
+
+def sliceVector( m, i ):
+    """
+    Gets a row of a CSR matrix (or a column of a CSC matrix) as a 1xn CSR matrix, in time proportional
+    to the number of nonzeros in that row (or column). The result shares data with the matrix.
+
+    Parameters
+    ----------
+    m : scipy CSR or CSC sparse matrix
+        The matrix to be sliced.
+
+    i : int
+        Index of the row (or column, for CSC matrices) to be sliced.
+    """
+    start, end = m.indptr[i], m.indptr[i+1]
+    n = m.shape[1] if m.format=='csr' else m.shape[0]
+    # arrays are assigned directly, as the constructor may copy them
+    v = scipy.sparse.csr_matrix( (1,n), dtype=m.dtype )
+    v.data, v.indices = m.data[start:end], m.indices[start:end]
+    v.indptr = numpy.array([0,end-start], dtype=m.indptr.dtype)
+    return v
+
+
+def addEdgesFromMatrix( g, m, rowLabels, colLabels=None, attr='weight' ):
+    """
+    Adds an edge to a graph for each nonzero entry of a sparse matrix, in a single batched call.
+    Values of entries are set as an edge attribute.
+
+    Parameters
+    ----------
+    g : networkx.Graph
+        The graph to which edges are added.
+
+    m : scipy sparse matrix
+        The matrix whose nonzero entries are turned into edges.
+
+    rowLabels : sequence
+        Nodes associated to the matrix rows.
+
+    colLabels (optional) : sequence
+        Nodes associated to the matrix columns. Defaults to rowLabels, for square matrices.
+
+    attr : str, default 'weight'
+        Name of the edge attribute where entries values are stored.
+
+    Returns
+    -------
+    The graph g.
+    """
+    m = scipy.sparse.coo_matrix(m)
+    colLabels = rowLabels if colLabels is None else colLabels
+    us = map( rowLabels.__getitem__, m.row.tolist() )
+    vs = map( colLabels.__getitem__, m.col.tolist() )
+    g.add_edges_from( (u,v,{attr:w}) for u,v,w in zip(us,vs,m.data.tolist()) )
+    return g
+
+
+def applyThreshold( m, thresh=None ):
+    """
+    Drops entries of a sparse matrix below a threshold value. The matrix is changed in place.
+    """
+    if thresh is not None:
+        m.data = numpy.where( m.data >= thresh, m.data, 0 )
+    m.eliminate_zeros()
+    return m
+
+
+def simpleWeighting( m, thresh=None ):
+    """
+    Computes the number of nonzero columns shared by each pair of rows of a sparse matrix.
+
+    Returns
+    -------
+    A strictly upper triangular scipy CSR sparse matrix with weights between rows.
+    """
+    m = scipy.sparse.csr_matrix(m)
+    b = scipy.sparse.csr_matrix( (numpy.ones(len(m.data),dtype=int),m.indices,m.indptr), shape=m.shape )
+    w = scipy.sparse.triu( b.dot(b.T), k=1 ).tocsr()
+    return applyThreshold(w, thresh)
+
+
+def additiveWeighting( m, thresh=None ):
+    """
+    Computes, for each pair of rows (u,v) of a sparse matrix, the sum of (m[u,n]+m[v,n])/2 over 
+    all columns n which are nonzero in both rows. It is obtained from products between the 
+    matrix and its binary pattern.
+
+    Returns
+    -------
+    A strictly upper triangular scipy CSR sparse matrix with weights between rows.
+    """
+    m = scipy.sparse.csr_matrix(m)
+    c = scipy.sparse.csr_matrix(m, dtype=float)
+    b = scipy.sparse.csr_matrix( (numpy.ones(len(m.data)),m.indices,m.indptr), shape=m.shape )
+    cb = c.dot(b.T)
+    w = scipy.sparse.triu( (cb + cb.T)/2, k=1 ).tocsr()
+    return applyThreshold(w, thresh)
+
+
+def topKPerRow( rows, cols, data, k ):
+    """
+    Selects the k largest entries in each row of a sparse matrix given in coordinates format.
+
+    Returns
+    -------
+    A boolean mask over the entries, which is True for entries that are kept.
+    """
+    order = numpy.lexsort( (-data,rows) )
+    sortedRows = rows[order]
+    rowStarts = numpy.searchsorted(sortedRows, sortedRows, side='left')
+    ranks = numpy.arange(len(order)) - rowStarts
+    mask = numpy.zeros(len(order), dtype=bool)
+    mask[order] = ranks<k
+    return mask
+
+
+def cosineSimilarity( m, thresh=None, topK=None, blockSize=1024 ):
+    """
+    Computes the cosine similarity between rows of a sparse matrix, without ever building the dense
+    similarity matrix. Rows are normalized and their products are computed in blocks of rows, in
+    which thresholding and top-k selection are applied. Peak memory is therefore bounded by the
+    block size.
+
+    Parameters
+    ----------
+    m : scipy sparse matrix
+        The matrix whose rows are compared.
+
+    thresh : numerical (optional)
+        Similarities below this value are dropped.
+
+    topK : int (optional)
+        If set, only the topK largest similarities of each row are kept. A pair of rows is kept if
+        any of them is among the topK most similar to the other, so that the result is symmetric.
+
+    blockSize : int, default 1024
+        The number of rows whose similarities are computed at once.
+
+    Returns
+    -------
+    A symmetric scipy CSR sparse matrix with similarities between rows. Its diagonal is zero.
+    """
+    m = scipy.sparse.csr_matrix(m, dtype=float)
+    norms = numpy.sqrt( numpy.asarray(m.multiply(m).sum(axis=1)).ravel() )
+    invNorms = numpy.zeros(len(norms))
+    numpy.divide(1, norms, out=invNorms, where=norms>0)
+    mn = scipy.sparse.diags(invNorms).dot(m).tocsr()
+    mnT = mn.T.tocsc()
+
+    n = m.shape[0]
+    rows, cols, data = [], [], []
+    for start in range(0, n, blockSize):
+        block = mn[start:start+blockSize].dot(mnT).tocoo()
+        r, c, d = block.row.astype(numpy.int64)+start, block.col.astype(numpy.int64), block.data
+        mask = r!=c
+        if thresh is not None: mask &= d>=thresh
+        r, c, d = r[mask], c[mask], d[mask]
+        if topK is not None:
+            mask = topKPerRow(r, c, d, topK)
+            r, c, d = r[mask], c[mask], d[mask]
+        rows.append(r); cols.append(c); data.append(d)
+
+    if n==0:
+        return scipy.sparse.csr_matrix((0,0))
+    sim = scipy.sparse.csr_matrix( (numpy.concatenate(data),(numpy.concatenate(rows),numpy.concatenate(cols))), shape=(n,n) )
+    if topK is not None:
+        sim = sim.maximum(sim.T).tocsr()
+    return sim
+
+
+class EdgesTaxonsMatrix:
+    """
+    A compact store of the taxons recorded by each edge of a network. Taxons are integer-coded
+    and their counts are stored in a sparse edge x taxon matrix, whose rows are looked up from
+    edges endpoints.
+
+    Parameters
+    ----------
+    nodes : list
+        Nodes labels. Edges endpoints are given as positions in this list.
+
+    u, v : array-like of ints
+        Endpoints of the edge associated to each taxon occurrence.
+
+    taxonsCodes : array-like of ints
+        Codes of the taxon of each occurrence, as positions in the taxons list.
+
+    taxons : list
+        Taxons labels.
+
+    counts (optional) : array-like of ints
+        Number of times each (edge,taxon) occurrence is observed. Defaults to 1.
+        Repeated occurrences are summed up.
+    """
+    def __init__( self, nodes, u, v, taxonsCodes, taxons, counts=None ):
+        self._setData( list(nodes), u, v, taxonsCodes, list(taxons), counts )
+
+    def _setData( self, nodes, u, v, taxonsCodes, taxons, counts=None ):
+        u = numpy.asarray(u, dtype=numpy.int64)
+        v = numpy.asarray(v, dtype=numpy.int64)
+        taxonsCodes = numpy.asarray(taxonsCodes, dtype=numpy.int64)
+        if counts is None: counts = numpy.ones(len(u), dtype=numpy.int64)
+
+        self._nodes_ix = dict( (n,i) for i,n in enumerate(nodes) )
+        self._n = len(nodes)
+        self._taxons = taxons
+        self._taxons_ix = dict( (t,i) for i,t in enumerate(taxons) )
+        self._keys, rows = numpy.unique( self._edgeKeys(u,v), return_inverse=True )
+        self._m = scipy.sparse.csr_matrix( (counts,(rows,taxonsCodes)), shape=(len(self._keys),len(self._taxons)) )
+        self._m.sum_duplicates()
+
+        # edges whose taxons counts were all cancelled out are dropped
+        self._m.eliminate_zeros()
+        keep = self._m.getnnz(axis=1)>0
+        if not keep.all():
+            self._keys, self._m = self._keys[keep], self._m[keep]
+        self._deltas = dict()
+
+    def _edgeKeys( self, u, v ):
+        n = self._n
+        return numpy.minimum(u,v)*n + numpy.maximum(u,v)
+
+    def _getRow( self, u, v ):
+        try:
+            i,j = self._nodes_ix[u], self._nodes_ix[v]
+        except KeyError:
+            raise KeyError((u,v))
+        # nodes added after the matrix was built have no rows
+        if max(i,j)>=self._n:
+            raise KeyError((u,v))
+        key = self._edgeKeys(i,j)
+        row = numpy.searchsorted(self._keys, key)
+        if row==len(self._keys) or self._keys[row]!=key:
+            raise KeyError((u,v))
+        return row
+
+    def addCounts( self, u, v, taxons, counts=None ):
+        """
+        Adds (or subtracts, with negative counts) taxons occurrences to edges. Changes are stored
+        apart from the matrix, so that their cost is proportional to their number, and they are
+        merged into the matrix when it is requested.
+
+        Parameters
+        ----------
+        u, v : iterables
+            Labels of the endpoints of the edge associated to each taxon occurrence. New nodes
+            are added to the store.
+
+        taxons : iterable
+            Labels of the taxon of each occurrence.
+
+        counts (optional) : iterable of ints
+            Number of times each occurrence is added. Defaults to 1.
+        """
+        nodes_ix = self._nodes_ix
+        counts = itertools.repeat(1) if counts is None else counts
+        for a,b,t,c in zip(u,v,taxons,counts):
+            i, j = nodes_ix.setdefault(a,len(nodes_ix)), nodes_ix.setdefault(b,len(nodes_ix))
+            delta = self._deltas.setdefault( (min(i,j),max(i,j)), Counter() )
+            delta[t] += c
+
+    def compact( self ):
+        """
+        Merges changes added by `addCounts` into the matrix.
+        """
+        if len(self._deltas)==0:
+            return
+        for d in self._deltas.values():
+            for t in d:
+                if t not in self._taxons_ix:
+                    self._taxons_ix[t] = len(self._taxons)
+                    self._taxons.append(t)
+
+        m = self._m.tocoo()
+        keys = self._keys[m.row]
+        pairs = [ (i,j,self._taxons_ix[t],c) for (i,j),d in self._deltas.items() for t,c in d.items() ]
+        du, dv, dt, dc = ( numpy.array(x, dtype=numpy.int64) for x in zip(*pairs) ) if pairs else [numpy.zeros(0,dtype=numpy.int64)]*4
+        self._setData( list(self._nodes_ix), numpy.concatenate([keys//self._n,du]), numpy.concatenate([keys%self._n,dv]),
+                       numpy.concatenate([m.col,dt]), self._taxons, numpy.concatenate([m.data,dc]) )
+
+    def __contains__( self, edge ):
+        try:
+            self._getRow(*edge)
+        except KeyError:
+            return False
+        return True
+
+    def __len__( self ):
+        self.compact()
+        return len(self._keys)
+
+    def getTaxons( self, u, v ):
+        """
+        Returns a Counter with the taxons recorded by the edge (u,v).
+        """
+        delta = None
+        if u in self._nodes_ix and v in self._nodes_ix:
+            i, j = self._nodes_ix[u], self._nodes_ix[v]
+            delta = self._deltas.get( (min(i,j),max(i,j)) )
+        try:
+            taxons = self.rowTaxons( self._getRow(u,v) )
+        except KeyError:
+            if delta is None:
+                raise
+            taxons = Counter()
+        if delta is not None:
+            taxons.update(delta)
+            taxons = Counter( dict( (t,c) for t,c in taxons.items() if c>0 ) )
+            if len(taxons)==0:
+                raise KeyError((u,v))
+        return taxons
+
+    def rowTaxons( self, row ):
+        """
+        Returns a Counter with the taxons stored in a row of the edge x taxon matrix.
+        """
+        m = self._m
+        ixes = m.indices[m.indptr[row]:m.indptr[row+1]]
+        cnts = m.data[m.indptr[row]:m.indptr[row+1]]
+        return Counter( dict( (self._taxons[t],c) for t,c in zip(ixes.tolist(),cnts.tolist()) ) )
+
+    def getMatrix( self ):
+        """
+        Returns a 3-tuple (edges, taxons, m), where edges is a list of 2-tuples with edges
+        endpoints, taxons is a list of taxons labels and m is the edge x taxon counts matrix.
+        """
+        self.compact()
+        nodes = list(self._nodes_ix)
+        n = len(nodes)
+        edges = [ (nodes[k//n],nodes[k%n]) for k in self._keys.tolist() ]
+        return edges, list(self._taxons), self._m
@@ -8,11 +8,228 @@ Species-collectors Network Module
 import networkx
 import scipy
 import numpy
-import copy
-from collections import Counter
-from sklearn.metrics.pairwise import cosine_similarity
+from .matrices import setReadOnly, sliceVector, addEdgesFromMatrix, biadjacencyFromRecords
+from .matrices import simpleWeighting, additiveWeighting, cosineSimilarity, groupingMatrix
 
-class SCN(networkx.Graph):
+
+def _invalidatesCache( method ):
+    """
+    Decorates a networkx.Graph mutator so that the network's cache is invalidated after it is called.
+    """
+    def mutator( self, *args, **kwargs ):
+        res = method( self, *args, **kwargs )
+        self.invalidateCache()
+        return res
+    mutator.__name__ = method.__name__
+    mutator.__doc__ = "Overrides parent method, invalidating the network's cache.\n" + (method.__doc__ or '')
+    return mutator
+
+
+class _BiadjMatrixQueries:
+    """
+    Queries on species-collectors networks which are answered from their biadjacency matrix.
+    Classes using it must implement the `_getBiadjMatrix`, `_nodesCounts`, `_fromAggregation` and
+    `listSpeciesNodes`/`listCollectorsNodes` methods, and hold `_biadj_ix` (a 2-tuple with collectors and species indexes) and `_derived` 
+    (a dict for caching derived data) attributes.
+    """
+    def _getDerived( self, key, builder ):
+        """
+        Gets data derived from the network from cache, building it if needed. Cached data is 
+        discarded whenever the network is modified.
+        
+        Parameters
+        ----------
+        key : hashable
+            The key identifying the derived data.
+            
+        builder : function
+            A function with no arguments, which builds the derived data.
+        """
+        if key not in self._derived:
+            self._derived[key] = builder()
+        return self._derived[key]
+    
+    def getSpeciesBag( self, collector ):
+        """
+        Parameters
+        ----------
+        collector : string
+          The id of the collector from which to derive the species bag vector.
+          
+        Returns
+        -------
+        A tuple (spIds, vector), where the first element is a tuple containing all species names and
+        the second is the vector containing their counts.
+        The species bag vector is stored as a 1xn SciPy sparse matrix. It shares data with the network's
+        cached biadjacency matrix, and is therefore read-only.
+        """
+        colList, spList, m = self._getBiadjMatrix()
+        i = self._biadj_ix[0][collector]
+        vector = sliceVector(m,i)
+        return (spList, vector)
+    
+    def getInterestVector( self, species ):
+        """
+        Parameters
+        ----------
+        species : string
+          The id of the species from which to derive the interest vector.
+          
+        Returns
+        -------
+        A tuple (colIds, vector), where the first element is a tuple containing all collectors names and
+        the second is the vector containing their counts.
+        The interest vector is stored as a 1xn SciPy sparse matrix. It shares data with the network's
+        cached biadjacency matrix, and is therefore read-only.
+        """
+        colList, spList, m = self._getBiadjMatrix(fmt='csc')
+        i = self._biadj_ix[1][species]
+        vector = sliceVector(m,i)
+        return (colList,vector)
+    
+    def _projectionMatrix( self, nodesSet, rule='simple_weighting', thresh=None, topK=None, blockSize=1024 ):
+        """
+        Computes the weights matrix of a projection of the network onto a nodes set. Weights matrices 
+        are cached until the network is modified.
+        
+        Returns
+        -------
+        A 2-tuple (nodes, m), where nodes is a tuple with nodes labels and m is a strictly upper 
+        triangular scipy CSR sparse matrix with edges weights.
+        """
+        if nodesSet=='species':
+            cols,spp,m = self._getBiadjMatrix(fmt='csc')
+            nodes, m = spp, m.T
+        elif nodesSet=='collectors':
+            cols,spp,m = self._getBiadjMatrix()
+            nodes = cols
+        else:
+            raise ValueError( "nodesSet argument must be 'species' or 'collectors'" )
+        
+        if rule=='simple_weighting':
+            build = lambda: simpleWeighting(m, thresh=thresh)
+        elif rule=='additive_weighting':
+            build = lambda: additiveWeighting(m, thresh=thresh)
+        elif rule=='cosine_similarity':
+            build = lambda: scipy.sparse.triu( cosineSimilarity(m,thresh=thresh,topK=topK,blockSize=blockSize), k=1 ).tocsr()
+        else:
+            raise ValueError("Invalid projection rule")
+        
+        weightsM = self._getDerived( (rule,nodesSet,thresh,topK), lambda: setReadOnly(build()) )
+        return nodes, weightsM
+    
+    def project( self, nodesSet, rule='simple_weighting', thresh=None, topK=None, blockSize=1024, asMatrix=False ):
+        """
+        Generates a SCN projection onto a nodes set, using one of the available rules.
+        
+        Parameters
+        ----------
+        nodesSet : str
+            The nodes set to project the graph onto. Input can be either 'species' or 'collectors'.
+        
+        rule : str, default 'simple_weighting'
+            The rule that should be used to assign weights to edges in the projected graph. Available rules are: 'simple_weighting', 'additive_weighting', 'cosine_similarity' 
+            
+        thresh : numerical (optional)
+            A weight threshold value for edge creation. If weight value is below threshold the edge is not created.
+            
+        topK : int (optional)
+            Only available for the 'cosine_similarity' rule. If set, a pair of nodes is only linked if
+            any of them is among the topK nodes most similar to the other. Nodes may therefore have
+            more than topK edges.
+            
+        blockSize : int, default 1024
+            Only used by the 'cosine_similarity' rule. Similarities are computed in blocks of blockSize 
+            rows, so that the dense similarity matrix is never built. Peak memory is bounded by the 
+            block size.
+            
+        asMatrix : bool, default False
+            If set to True the projection is returned as a sparse weights matrix, and no graph is built.
+            
+        Returns
+        -------
+        A networkx Graph with edges 'weight' attributes. If asMatrix is True, a 2-tuple (nodes, m) is
+        returned instead, where nodes is a tuple with nodes labels and m is a symmetric scipy CSR 
+        sparse matrix with edges weights.
+        """
+        if nodesSet not in ['species','collectors']:
+            raise ValueError("nodesSet argument must be 'species' or 'collectors'")
+            
+        if topK is not None and rule!='cosine_similarity':
+            raise ValueError("topK argument is only available for the 'cosine_similarity' rule")
+            
+        nodes, weightsM = self._projectionMatrix(nodesSet, rule=rule, thresh=thresh, topK=topK, blockSize=blockSize)
+        if asMatrix:
+            return nodes, (weightsM + weightsM.T).tocsr()
+        
+        g = networkx.Graph()
+        if nodesSet=='species':
+            g.add_nodes_from(self.listSpeciesNodes(data=True))
+        else:
+            g.add_nodes_from(self.listCollectorsNodes(data=True))
+        return addEdgesFromMatrix(g, weightsM, nodes)
+    
+    def taxonomicAggregations( self, groupings ):
+        """
+        Generates taxonomically aggregated versions of this network for several grouping levels at once
+        (e.g. genus, family and order). Species are grouped by a sparse group x species indicator 
+        matrix, and the indicators of all levels are stacked, so that all levels are aggregated by a 
+        single product with the cached biadjacency matrix.
+        
+        Parameters
+        ----------
+        groupings : dict of groupings
+            Groupings to be used on aggregation, keyed by level. Each grouping is either a dict of
+            iterables, keyed by group, or a dict mapping each species to its group. Valid groupings are
+            >>> grps = { 'genus': {'sp1':'genus_a', 'sp2':'genus_a', 'sp3':'genus_b'},
+                         'family': { 'family_a': {'sp1','sp2','sp3'} } }
+            
+        Returns
+        -------
+        A dict with an aggregated network for each level, in which species are replaced by groups.
+        Species which are not in the network are ignored, and so are groups left without species.
+        """
+        cols, spp, m = self._getBiadjMatrix()
+        colsCounts, spCounts = self._nodesCounts()
+        
+        levels = [ (level,)+groupingMatrix(grouping, self._biadj_ix[1]) for level,grouping in groupings.items() ]
+        if len(levels)==0:
+            return dict()
+        indicator = scipy.sparse.vstack([ ind for level,groups,ind in levels ], format='csr')
+        aggreg = m.dot(indicator.T).tocsc()
+        groupsCounts = indicator.dot(spCounts)
+        
+        aggregations = dict()
+        start = 0
+        for level,groups,ind in levels:
+            end = start+len(groups)
+            levelM = aggreg[:,start:end].tocsr()
+            levelM.sort_indices()
+            aggregations[level] = self._fromAggregation( cols, groups, levelM, colsCounts, groupsCounts[start:end] )
+            start = end
+        return aggregations
+    
+    def taxonomicAggregation( self, grouping ):
+        """
+        Generates a taxonomically aggregated version of this network.
+        
+        Parameters
+        ----------
+        grouping : dict of iterables (preferrably dict of sets)
+            The grouping to be used on aggregation. A valid grouping example is
+            >>> grp = { 'family_a': {'sp1','sp2','sp3'},
+                        'family_b': {'sp4'},
+                        'family_c': {'sp5','sp6'} }
+            A dict mapping each species to its group is also accepted. 
+            
+        Returns
+        -------
+        A network of the same class, in which species are replaced by groups.
+        """
+        return self.taxonomicAggregations({ None: grouping })[None]
+
+
+class SCN(_BiadjMatrixQueries,networkx.Graph):
     """
     Class for Species-collectors networks. Extends networkx Graph class.
     
@@ -20,9 +237,11 @@ class SCN(networkx.Graph):
     ----------
     species : List or iterable
         A list containing names of species to be associated, in order, to elements in the collectors list.
+        A pandas Series is also accepted.
         
     collectors : List or iterable
         A list containing lists of collectors names, to be associated, in order, to elements in the species list.
+        A pandas Series with atomized names (e.g. from NamesAtomizer.atomize) is also accepted.
         
     namesMap (optional) : caryocar.NamesMap
         A caryocar NamesMap object for normalizing nodes names.
@@ -31,6 +250,8 @@ class SCN(networkx.Graph):
     -----
     For the model to be created both the species and collectors lists must have the same length.
     The ordering of both species and collectors list is important for creating bipartite edges.
+    Records are factorized to integer codes and aggregated into a biadjacency matrix in a single pass,
+    from which nodes and edges are added in bulk.
     
     Methods
     -------------
@@ -40,8 +261,20 @@ class SCN(networkx.Graph):
     .getInterestVector
     .remove_nodes_from
     .fromCrsBiadjMatrix
+    .fromBiadjMatrix
     .project
     .taxonomicAggregation
+    .taxonomicAggregations
+    .invalidateCache
+    .add_records
+    .remove_records
+    
+    Notes on caching
+    ----------------
+    The biadjacency matrix and data derived from it (e.g. projections weights) are cached. The cache
+    is invalidated whenever nodes or edges are added or removed through networkx methods, which also
+    increase the network's `version`. Changing edges attributes in place is not tracked, so 
+    `invalidateCache` must be called afterwards.
     
     Examples
     --------
@@ -82,47 +315,61 @@ class SCN(networkx.Graph):
     def __init__(self, data=None, species=None, collectors=None, namesMap=None, **attr):
         
         # Class attributes
+        self._version = 0
         self._biadj_matrix = None
+        self._biadj_csc = None
+        self._biadj_ix = None
+        self._derived = dict()
         
         # Class construction routine
         if attr.get('initialize_empty')==True:
             super().__init__(data=data,**attr)
             return        
         
-        self._parseInputData(species,collectors)
+        if species is None or collectors is None:
+            super().__init__(incoming_graph_data=data,**attr)
+            return
+        
+        # records are factorized into a biadjacency matrix, from which nodes and edges are built in bulk
+        nmap = namesMap.getMap() if namesMap else None
+        cols, spp, m, cols_counts, spp_counts = biadjacencyFromRecords(species, collectors, namesMap=nmap)
+        
+        super().__init__(incoming_graph_data=data,**attr)
+        self._addFromBiadjMatrix(cols, spp, m, cols_counts, spp_counts)
+    
+    def _addFromBiadjMatrix( self, collectors, species, m, collectorsCounts, speciesCounts ):
+        self.add_nodes_from( (n,{'bipartite':1,'count':c}) for n,c in zip(species,numpy.asarray(speciesCounts).tolist()) )
+        self.add_nodes_from( (n,{'bipartite':0,'count':c}) for n,c in zip(collectors,numpy.asarray(collectorsCounts).tolist()) )
+        return addEdgesFromMatrix(self, m, collectors, species, attr='count')
+    
+    @classmethod
+    def fromBiadjMatrix( cls, collectors, species, m, collectorsCounts=None, speciesCounts=None ):
+        """
+        Creates a SCN from a collector x species biadjacency matrix, as SparseSCN.fromBiadjMatrix.
 
-        set_bipartite_attr=False # a flag for setting bipartite attribute after graph creation
-        if species is not None and collectors is not None:
-            if namesMap:
-                nmap = namesMap.getMap()
-                collectors = [ [ nmap[n] for n in nset ] for nset in collectors ]
-            
-            # build edges
-            if len(species)==len(collectors):
-                species = list(species)
-                collectors = list(collectors)
-                
-                data = [ (sp,col) for i,sp in enumerate(species) for col in collectors[i] ]
-                set_bipartite_attr=True
+        Parameters
+        ----------
+        collectors : iterable
+            Collectors labels, associated to rows of the matrix.
 
-        super().__init__(incoming_graph_data=data,**attr)
-        
-        if set_bipartite_attr:
-            networkx.set_node_attributes( self, values=dict( (n,1) for n in species), name='bipartite' )
-            networkx.set_node_attributes( self, values=dict( (n,0) for cols in collectors for n in cols), name='bipartite' )
-            
-        # set nodes count attribute
-        nodes_cols_counts = Counter( c for cols in collectors for c in cols )
-        nodes_sp_counts = Counter( species )
-        nodes_counts = nodes_cols_counts.copy()
-        nodes_counts.update(nodes_sp_counts)
-        networkx.set_node_attributes( self, values=nodes_counts, name='count' )
+        species : iterable
+            Species labels, associated to columns of the matrix.
+
+        m : scipy sparse matrix
+            The biadjacency matrix, with the number of records of each species by each collector.
+
+        collectorsCounts, speciesCounts (optional) : array-like of ints
+            Nodes counts. If not set, collectors counts are the rows sums and species counts are
+            the columns sums of the matrix.
 
-        # set edges count attribute
-        edges = data
-        edges_counts = Counter(edges)
-        for (u,v),cnt in edges_counts.items():
-            self[u][v]['count'] = self[u][v].get('count',0)+cnt
+        Returns
+        -------
+        A Species Collectors Network
+        """
+        if collectorsCounts is None: collectorsCounts = numpy.asarray(m.sum(axis=1)).ravel()
+        if speciesCounts is None: speciesCounts = numpy.asarray(m.sum(axis=0)).ravel()
+        g = cls(initialize_empty=True)
+        return g._addFromBiadjMatrix(list(collectors), list(species), m, collectorsCounts, speciesCounts)
     
     @classmethod
     def fromCrsBiadjMatrix( cls, nset1, nset2, m, cols_sp_axes=(0,1) ):
@@ -153,27 +400,7 @@ class SCN(networkx.Graph):
         g.add_nodes_from(nset1, bipartite = 0 if cols_sp_axes==(0,1) else 1)
         g.add_nodes_from(nset2, bipartite = 1 if cols_sp_axes==(0,1) else 0)
 
-        for i,row in enumerate(m):
-            data=row.data
-            colIndices=row.indices
-            for j,cnt in zip(colIndices,data):
-                g.add_edge(nset1[i],nset2[j],count=cnt)
-        
-        return g
-    
-    def _parseInputData( self, species, collectors ):
-        # Check format
-        if not all( isinstance(lst,list) for lst in collectors ) and \
-               all( isinstance(c,str) for lst in collectors for c in lst ):
-            raise ValueError("Collectors data input must be in the format of list of lists of strings.")
-        
-        if not all( isinstance(sp,str) for sp in species ):
-            raise ValueError("Species data input must be in the format of list of strings.")
-            
-        # Check lengths
-        if len(species)!=len(collectors):
-            raise ValueError("Species and collectors data lists have different lengths.")
-        return
+        return addEdgesFromMatrix(g, m, list(nset1), list(nset2), attr='count')
     
     def _buildBiadjMatrix( self, col_sp_order=None ):
         if col_sp_order is None:
@@ -183,20 +410,155 @@ class SCN(networkx.Graph):
         m = networkx.bipartite.biadjacency_matrix(self,
                                                   row_order=col_sp_order[0],
                                                   column_order=col_sp_order[1],
-                                                  weight='count')
+                                                  weight='count',
+                                                  format='csr')
+        m.sort_indices()
         
         self._biadj_ix = ( dict( (c,i) for i,c in enumerate(col_sp_order[0]) ), \
                            dict( (s,i) for i,s in enumerate(col_sp_order[1]) ) )
         
-        self._biadj_matrix = (*col_sp_order,m)
+        self._biadj_matrix = (tuple(col_sp_order[0]),tuple(col_sp_order[1]),setReadOnly(m))
+        self._biadj_csc = setReadOnly(m.tocsc())
         
-    def _getBiadjMatrix( self ):
+    def _getBiadjMatrix( self, fmt='csr', copy=False ):
         """
-        Returns a COPY of the biadjacency matrix
+        Returns the biadjacency matrix as a 3-tuple (collectors, species, m), where collectors and
+        species are tuples with the labels of rows and columns of the matrix, respectively.
+        
+        Parameters
+        ----------
+        fmt : str, default 'csr'
+            Sparse format of the matrix. Either 'csr' or 'csc'. Both forms are cached.
+            
+        copy : bool, default False
+            If False the cached matrix is handed out without copying. Its data arrays are 
+            read-only and the matrix must not be modified in place. If True a COPY is returned.
         """
         if self._biadj_matrix is None:
             self._buildBiadjMatrix()
-        return copy.deepcopy(self._biadj_matrix)
+        cols, spp, m = self._biadj_matrix
+        if fmt=='csc':
+            m = self._biadj_csc
+        elif fmt!='csr':
+            raise ValueError("fmt argument must be either 'csr' or 'csc'")
+        return (cols, spp, m.copy() if copy else m)
+    
+    @property
+    def version( self ):
+        """
+        A counter of modifications of the network. It is increased whenever nodes or edges are
+        added or removed.
+        """
+        return self._version
+    
+    def invalidateCache( self ):
+        """
+        Marks the network as modified, increasing its version and discarding the cached biadjacency
+        matrix, its indexes and any data derived from it (e.g. projections). This is done automatically
+        when nodes or edges are added or removed, but must be called explicitly after changing edges
+        'count' attributes in place.
+        """
+        self._version += 1
+        self._biadj_matrix = None
+        self._biadj_csc = None
+        self._biadj_ix = None
+        self._derived = dict()
+        
+    def _recordsDeltas( self, species, collectors, namesMap=None ):
+        """
+        Aggregates records into nodes and edges counts, as 3-tuples (collectors, species, m),
+        along with species counts and whether they have collectors.
+        """
+        nmap = namesMap.getMap() if namesMap else None
+        cols, spp, m, colsCounts, sppCounts = biadjacencyFromRecords(species, collectors, namesMap=nmap, dropEmptySpecies=False)
+        return cols, spp, m.tocoo(), colsCounts.tolist(), sppCounts.tolist(), (m.getnnz(axis=0)>0).tolist()
+    
+    def add_records( self, species, collectors, namesMap=None ):
+        """
+        Adds records to the network in place. Nodes and edges 'count' attributes are increased,
+        and new nodes (with their 'bipartite' flags) and edges are added, so that the network is
+        the same as if it was built with all records. The cost is proportional to the number of
+        records added. The cached biadjacency matrix is discarded, and rebuilt when queried.
+        
+        Parameters
+        ----------
+        species : iterable
+            The species of each record.
+            
+        collectors : iterable
+            An iterable of iterables with the collectors of each record.
+            
+        namesMap (optional) : caryocar.NamesMap
+            A caryocar NamesMap object for normalizing collectors names.
+        """
+        cols, spp, m, colsCounts, sppCounts, hasCollectors = self._recordsDeltas(species, collectors, namesMap)
+        
+        # species recorded without collectors are only counted if they are already nodes
+        for sp,c,has in zip(spp,sppCounts,hasCollectors):
+            if sp in self._node: self._node[sp]['count'] += c
+            elif has: networkx.Graph.add_node(self, sp, bipartite=1, count=c)
+        for col,c in zip(cols,colsCounts):
+            if col in self._node: self._node[col]['count'] += c
+            else: networkx.Graph.add_node(self, col, bipartite=0, count=c)
+            
+        for i,j,c in zip(m.row.tolist(),m.col.tolist(),m.data.tolist()):
+            u, v = cols[i], spp[j]
+            if v in self._adj[u]: self._adj[u][v]['count'] += c
+            else: networkx.Graph.add_edge(self, u, v, count=c)
+        self.invalidateCache()
+    
+    def remove_records( self, species, collectors, namesMap=None ):
+        """
+        Removes records from the network in place, e.g. to apply corrections. Nodes and edges 
+        'count' attributes are decreased, and nodes and edges left without records are removed.
+        The cost is proportional to the number of records removed. A ValueError is raised, and
+        the network is left unchanged, if records were not added to the network before.
+        
+        Parameters
+        ----------
+        species : iterable
+            The species of each record.
+            
+        collectors : iterable
+            An iterable of iterables with the collectors of each record.
+            
+        namesMap (optional) : caryocar.NamesMap
+            A caryocar NamesMap object for normalizing collectors names.
+        """
+        cols, spp, m, colsCounts, sppCounts, hasCollectors = self._recordsDeltas(species, collectors, namesMap)
+        nodesDeltas = [ (sp,c) for sp,c,has in zip(spp,sppCounts,hasCollectors) if has or sp in self._node ]
+        nodesDeltas += list(zip(cols,colsCounts))
+        edgesDeltas = [ (cols[i],spp[j],c) for i,j,c in zip(m.row.tolist(),m.col.tolist(),m.data.tolist()) ]
+        
+        # records are checked before the network is changed
+        for n,c in nodesDeltas:
+            if n not in self._node or (self._node[n].get('count') or 0)<c:
+                raise ValueError("Records to be removed are not in the network (node '{}').".format(n))
+        for u,v,c in edgesDeltas:
+            if v not in self._adj[u] or (self._adj[u][v].get('count') or 0)<c:
+                raise ValueError("Records to be removed are not in the network (edge ('{}','{}')).".format(u,v))
+        
+        for u,v,c in edgesDeltas:
+            self._adj[u][v]['count'] -= c
+            if self._adj[u][v]['count']==0: networkx.Graph.remove_edge(self, u, v)
+        for n,c in nodesDeltas:
+            self._node[n]['count'] -= c
+        
+        # nodes left without records, or species left without collectors, are removed
+        empty = [ n for n,c in nodesDeltas if self._node[n]['count']==0 or len(self._adj[n])==0 ]
+        networkx.Graph.remove_nodes_from(self, empty)
+        self.invalidateCache()
+        
+    add_node = _invalidatesCache(networkx.Graph.add_node)
+    add_nodes_from = _invalidatesCache(networkx.Graph.add_nodes_from)
+    remove_node = _invalidatesCache(networkx.Graph.remove_node)
+    add_edge = _invalidatesCache(networkx.Graph.add_edge)
+    add_edges_from = _invalidatesCache(networkx.Graph.add_edges_from)
+    add_weighted_edges_from = _invalidatesCache(networkx.Graph.add_weighted_edges_from)
+    remove_edge = _invalidatesCache(networkx.Graph.remove_edge)
+    remove_edges_from = _invalidatesCache(networkx.Graph.remove_edges_from)
+    update = _invalidatesCache(networkx.Graph.update)
+    clear = _invalidatesCache(networkx.Graph.clear)
     
     def remove_nodes_from( self, nodes ):
         """
@@ -205,7 +567,9 @@ class SCN(networkx.Graph):
         """
         super().remove_nodes_from(nodes)
         isolates = list(networkx.isolates(self))
-        return super().remove_nodes_from(isolates)
+        res = super().remove_nodes_from(isolates)
+        self.invalidateCache()
+        return res
         
     def listSpeciesNodes(self,data=False):
         """
@@ -270,221 +634,23 @@ class SCN(networkx.Graph):
                 values=collectors_names,
                 name='fullname')
     
-    def getSpeciesBag( self, collector ):
+    def _nodesCounts( self ):
         """
-        Parameters
-        ----------
-        collector : string
-          The id of the collector from which to derive the species bag vector.
-          
-        Returns
-        -------
-        A tuple (spIds, vector), where the first element is a list containing all species names and
-        the second is the vector containing their counts.
-        The species bag vector is stored as a 1xn SciPy sparse matrix.
-        """
-        colList, spList, m = self._getBiadjMatrix()
-        i = self._biadj_ix[0][collector]
-        vector = m[i]
-        return (spList, vector)
-    
-    def getInterestVector( self, species ):
-        """
-        Parameters
-        ----------
-        species : string
-          The id of the species from which to derive the interest vector.
-          
-        Returns
-        -------
-        A tuple (colIds, vector), where the first element is a list containing all collectors names and
-        the second is the vector containing their counts.
-        The interest vector is stored as a 1xn SciPy sparse matrix.
+        Returns a 2-tuple of integer arrays with the counts of collectors and species nodes, in the
+        order of rows and columns of the biadjacency matrix.
         """
-        colList, spList, m = self._getBiadjMatrix()
-        m = m.transpose()
-        i = self._biadj_ix[1][species]
-        vector = m[i]
-        return (colList,vector)
+        def build():
+            cols, spp, m = self._getBiadjMatrix()
+            counts = dict(self.nodes(data='count'))
+            return ( numpy.array([ counts[c] or 0 for c in cols ], dtype=numpy.int64), 
+                     numpy.array([ counts[s] or 0 for s in spp ], dtype=numpy.int64) )
+        return self._getDerived( 'counts', build )
     
-    def _projection_simple_weighting( self, nodesSet, thresh=None ):
-
-        cols,spp,m = self._getBiadjMatrix()
-        m.data=numpy.ones(shape=(len(m.data)),dtype=numpy.int)
-        g=networkx.Graph()
-
-        if nodesSet=='species': 
-            weightsM = scipy.sparse.triu(m.T.dot(m)).tocsr()
-            g.add_nodes_from(self.listSpeciesNodes(data=True))
-            n=spp
-
-        elif nodesSet=='collectors':
-            weightsM = scipy.sparse.triu(m.dot(m.T)).tocsr()
-            g.add_nodes_from(self.listCollectorsNodes(data=True))
-            n=cols
-
-        else:
-            raise ValueError( "nodesSet argument must be 'species' or 'collectors'" )
-
-        weightsM.setdiag(0)
-        if thresh is not None:
-            weightsM.data = numpy.where( weightsM.data >= thresh, weightsM.data, 0 )
-        weightsM.eliminate_zeros()
-
-        for i,row in enumerate(weightsM):
-            data=row.data
-            colIndices = row.indices
-            for j,w in zip(colIndices,data):
-                g.add_edge(n[i],n[j],weight=w)
-
-        return g
-        
-    def _projection_additive_weighting( self,nodesSet, thresh=None ): 
-        g = networkx.Graph()
-        
-        if nodesSet=='species':
-                g.add_nodes_from(self.listSpeciesNodes(data=True))
-                
-        elif nodesSet=='collectors':
-                g.add_nodes_from(self.listCollectorsNodes(data=True))
-        else:
-            raise ValueError( "nodesSet argument must be 'species' or 'collectors'" )
-        
-        nodes = g.nodes()
-        for u in nodes:
-            u_nbrs_o = set(self.adj[u]) 
-            u_nbrs_i = set( w for v in u_nbrs_o for w in self.adj[v] )-set([u])
-            for v in u_nbrs_i:
-                v_nbrs_o = set(self.adj[v])
-                common_nodes_o = u_nbrs_o & v_nbrs_o
-                weight = sum( (self[u][n]['count'] + self[v][n]['count'])/2 for n in common_nodes_o )
-                if weight >= thresh:
-                    g.add_edge(u,v,weight=weight)        
-        
-        return g
-    
-    def _projection_cosine_similarity( self, which, thresh=None ):
-        cols,spp,m = self._getBiadjMatrix()
-        g = networkx.Graph()
-        
-        if which=='interest':
-            m=m.T
-            g.add_nodes_from(self.listSpeciesNodes(data=True))
-            n=spp
-            
-        elif which=='speciesbag':
-            g.add_nodes_from(self.listCollectorsNodes(data=True))
-            n=cols
-            
-        else:
-            raise ValueError("which argument must be either 'interest' or 'speciesbag'")
-            
-        simM = scipy.sparse.csr_matrix(cosine_similarity(m))
-        simM.setdiag(0)
-        if thresh is not None:
-            simM.data = numpy.where( simM.data >= thresh, simM.data, 0 )
-        simM.eliminate_zeros()
-        
-        for i,row in enumerate(simM):
-            data=row.data
-            colIndices=row.indices
-            for j,sim in zip(colIndices,data):
-                g.add_edge(n[i],n[j],weight=sim)
-        
-        return g
-    
-    def project( self, nodesSet, rule='simple_weighting', thresh=None ):
-        """
-        Generates a SCN projection onto a nodes set, using one of the available rules.
-        
-        Parameters
-        ----------
-        nodesSet : str
-            The nodes set to project the graph onto. Input can be either 'species' or 'collectors'.
-        
-        rule : str, default 'simple_weighting'
-            The rule that should be used to assign weights to edges in the projected graph. Available rules are: 'simple_weighting', 'additive_weighting', 'cosine_similarity' 
-            
-        thresh : numerical (optional)
-            A weight threshold value for edge creation. If weight value is below threshold the edge is not created.
-        """
-        if nodesSet not in ['species','collectors']:
-            raise ValueError("nodesSet argument must be 'species' or 'collectors'")
-            
-        if rule=='simple_weighting':
-            g=self._projection_simple_weighting(nodesSet=nodesSet,thresh=thresh)
-        elif rule=='additive_weighting':
-            g=self._projection_additive_weighting(nodesSet=nodesSet,thresh=thresh)
-        elif rule=='cosine_similarity':
-            which='speciesbag' if nodesSet=='collectors' else 'interest'
-            g=self._projection_cosine_similarity(which=which,thresh=thresh)
-        else:
-            raise ValueError("Invalid projection rule")
-            
-        return g
-    
-    def taxonomicAggregation(self,grouping):
-        """
-        Generates a taxonomically aggregated version of this network.
-        
-        Parameters
-        ----------
-        grouping : dict of iterables (preferrably dict of sets)
-            The grouping to be used on aggregation. A valid grouping example is
-            >>> grp = { 'family_a': {'sp1','sp2','sp3'},
-                        'family_b': {'sp4'},
-                        'family_c': {'sp5','sp6'} }
-        """
-        grouping = dict( (k,set(v)) for k,v in grouping.items() )
-        cols,spp,m = self._getBiadjMatrix()
-        m=m.T
-        ix = self._biadj_ix[1]
-
-        # Clean grouping by removing sp nodes that do not exist in the original network
-        itemsToRemove=[]
-        spset = set(spp)
-        keysToRemove=set()
-        for grp,spp in grouping.items():
-            itemsToRemove=set()
-            for sp in spp:
-                if sp not in spset: itemsToRemove.add(sp)
-            grouping[grp] -= itemsToRemove
-            if len(grouping[grp])==0: keysToRemove.add(grp)  
-        for k in keysToRemove: grouping.pop(k)
-
-        # Initialize the new grouping data dictionary
-        data = dict()
-
-        # Obtain counts for each new group from species and include in the data dict
-        species_counts = dict(self.listSpeciesNodes(data='count'))
-        data['count'] = dict( (grp, sum(species_counts[sp] for sp in spp)) for grp,spp in grouping.items() )
-
-        # Create rows to compose the grouping biadjacency matrix
-        # Sums up species bags for species in each group
-        aggreg_biadj_rows = []
-        groups_order = []
-        groups_ixes = [ (grp,[ ix[i] for i in ixes ]) for grp,ixes in grouping.items() ]
-        for grp,ixes in groups_ixes:
-            rows=[]
-            for i in ixes:
-                rows.append(m.getrow(i))
-
-            grp_matrix = scipy.sparse.vstack(rows,format='csc')
-            grp_sum_arr = scipy.sparse.csr_matrix(grp_matrix.sum(axis=0))
-            aggreg_biadj_rows.append( (grp,grp_sum_arr) )
-            groups_order.append(grp)
-
-        # Create the biadjacency matrix
-        aggreg_biadj = ( groups_order, cols, scipy.sparse.vstack([ row for grp,row in aggreg_biadj_rows ], format='csr') )
-
-        # Create the graph from biadj matrix
-        g=self.fromCrsBiadjMatrix(*aggreg_biadj,cols_sp_axes=(1,0))
-
-        # set nodes attributes
-        networkx.set_node_attributes(g,dict(self.listCollectorsNodes(data='count')),'count')
-        networkx.set_node_attributes(g,data['count'],'count')
-
-        return g
+    def _fromAggregation( self, collectors, groups, m, collectorsCounts, groupsCounts ):
+        g = self.__class__(initialize_empty=True)
+        g.add_nodes_from( (grp,{'bipartite':1,'count':c}) for grp,c in zip(groups,groupsCounts.tolist()) )
+        g.add_nodes_from( (col,{'bipartite':0,'count':c}) for col,c in zip(collectors,collectorsCounts.tolist()) )
+        return addEdgesFromMatrix(g, m, collectors, groups, attr='count')
     
     def connectedComponentsSubgraphs(self):
         """
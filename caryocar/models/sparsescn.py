@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Matrix-native Species-collectors Network Module
+"""
+
+import networkx
+import numpy
+import scipy.sparse
+from .scn import SCN, _BiadjMatrixQueries
+from .matrices import setReadOnly, addEdgesFromMatrix, biadjacencyFromRecords
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2018"
+
+class SparseSCN(_BiadjMatrixQueries):
+    """
+    Class for matrix-native Species-collectors networks. The network is stored as an integer-indexed
+    sparse collector x species biadjacency matrix, along with nodes labels and counts arrays, which
+    takes much less memory than a networkx graph. Queries and projections are computed directly on
+    the matrix. An equivalent SCN (networkx graph) is only built on demand, through the `graph`
+    property, for running graph algorithms.
+
+    Parameters
+    ----------
+    species : List or iterable
+        A list containing names of species to be associated, in order, to elements in the collectors list.
+
+    collectors : List or iterable
+        A list containing lists of collectors names, to be associated, in order, to elements in the species list.
+
+    namesMap (optional) : caryocar.NamesMap
+        A caryocar NamesMap object for normalizing nodes names.
+
+    Methods
+    -------------
+    .listSpeciesNodes
+    .listCollectorsNodes
+    .getSpeciesBag
+    .getInterestVector
+    .fromBiadjMatrix
+    .fromSCN
+    .project
+    .taxonomicAggregation
+    .taxonomicAggregations
+    .graph
+
+    Examples
+    --------
+    >>> cols=[ ['col1','col2','col3'],
+               ['col1','col2'],
+               ['col2','col3'],
+               ['col4','col5'],
+               ['col4'],
+               ['col5','col4'] ]
+    >>> spp=['sp1','sp2','sp3','sp2','sp3','sp2']
+    >>> scn = SparseSCN( species=spp, collectors=cols )
+
+    >>> scn.listCollectorsNodes(data='count')
+    [('col1', 2), ('col2', 3), ('col3', 2), ('col4', 3), ('col5', 2)]
+
+    >>> scn.graph.edges(data=True)
+    [ ('col1', 'sp1', {'count': 1}),
+      ('col1', 'sp2', {'count': 1}),
+      ... ]
+    """
+    def __init__(self, species=None, collectors=None, namesMap=None):
+        if species is None or collectors is None:
+            species, collectors = [], []
+        nmap = namesMap.getMap() if namesMap else None
+        self._setData( *biadjacencyFromRecords(species,collectors,namesMap=nmap) )
+
+    def _setData( self, collectors, species, m, collectorsCounts, speciesCounts ):
+        # inputs are copied before being sorted and made read-only, so the caller's are left as they are
+        m = scipy.sparse.csr_matrix(m, copy=True)
+        m.sort_indices()
+
+        self._collectors = tuple(collectors)
+        self._species = tuple(species)
+        self._biadj_matrix = setReadOnly(m)
+        self._biadj_csc = None
+        self._biadj_ix = ( dict( (c,i) for i,c in enumerate(self._collectors) ), \
+                           dict( (s,i) for i,s in enumerate(self._species) ) )
+        self._counts = ( numpy.array(collectorsCounts, copy=True), numpy.array(speciesCounts, copy=True) )
+        for arr in self._counts: arr.flags.writeable = False
+        self._derived = dict()
+        self._graph = None
+
+    @classmethod
+    def fromBiadjMatrix( cls, collectors, species, m, collectorsCounts=None, speciesCounts=None ):
+        """
+        Creates a matrix-native SCN from a collector x species biadjacency matrix.
+
+        Parameters
+        ----------
+        collectors : iterable
+            Collectors labels, associated to rows of the matrix.
+
+        species : iterable
+            Species labels, associated to columns of the matrix.
+
+        m : scipy sparse matrix
+            The biadjacency matrix, with the number of records of each species by each collector.
+
+        collectorsCounts, speciesCounts (optional) : array-like of ints
+            Nodes counts. If not set, collectors counts are the rows sums and species counts are
+            the columns sums of the matrix.
+
+        Returns
+        -------
+        A SparseSCN.
+        """
+        if collectorsCounts is None: collectorsCounts = numpy.asarray(m.sum(axis=1)).ravel()
+        if speciesCounts is None: speciesCounts = numpy.asarray(m.sum(axis=0)).ravel()
+        g = cls.__new__(cls)
+        g._setData(collectors, species, m, collectorsCounts, speciesCounts)
+        return g
+
+    @classmethod
+    def fromSCN( cls, scn ):
+        """
+        Creates a matrix-native SCN from a SCN.
+        """
+        cols, spp, m = scn._getBiadjMatrix(copy=True)
+        counts = dict(scn.nodes(data='count'))
+        return cls.fromBiadjMatrix( cols, spp, m,
+                                    collectorsCounts=[ counts.get(c,0) for c in cols ],
+                                    speciesCounts=[ counts.get(s,0) for s in spp ] )
+
+    def _getBiadjMatrix( self, fmt='csr', copy=False ):
+        """
+        Returns the biadjacency matrix as a 3-tuple (collectors, species, m), where collectors and
+        species are tuples with the labels of rows and columns of the matrix, respectively.
+
+        Parameters
+        ----------
+        fmt : str, default 'csr'
+            Sparse format of the matrix. Either 'csr' or 'csc'. Both forms are cached.
+
+        copy : bool, default False
+            If False the matrix is handed out without copying. Its data arrays are read-only
+            and the matrix must not be modified in place. If True a COPY is returned.
+        """
+        m = self._biadj_matrix
+        if fmt=='csc':
+            if self._biadj_csc is None:
+                self._biadj_csc = setReadOnly(m.tocsc())
+            m = self._biadj_csc
+        elif fmt!='csr':
+            raise ValueError("fmt argument must be either 'csr' or 'csc'")
+        return (self._collectors, self._species, m.copy() if copy else m)
+
+    def _listNodes( self, nodesSet, data=False ):
+        labels = self._collectors if nodesSet=='collectors' else self._species
+        counts = self._counts[0] if nodesSet=='collectors' else self._counts[1]
+        bipartite = 0 if nodesSet=='collectors' else 1
+
+        if data==False:
+            return list(labels)
+        elif data==True:
+            return [ (n,{'bipartite':bipartite,'count':c}) for n,c in zip(labels,counts.tolist()) ]
+        elif data=='count':
+            return list(zip(labels,counts.tolist()))
+        elif data=='bipartite':
+            return [ (n,bipartite) for n in labels ]
+        else:
+            return [ (n,None) for n in labels ]
+
+    def listSpeciesNodes(self,data=False):
+        """
+        Lists nodes from the species set.
+
+        Parameters
+        ----------
+        data : string or bool, default=False
+            If False only nodes ids are returned.
+            If True nodes ids are returned with their respective attribute dicts as (n, attrDict).
+            If a string is passed (with an attribute name) then its value is returned in a 2-tuple (n, attrValue).
+
+        Returns
+        -------
+        Either a list of tuples (n,attrDict) or (n,attrValue) where n is the node's id; or a list of nodes id's n.
+        """
+        return self._listNodes('species',data=data)
+
+    def listCollectorsNodes(self,data=False):
+        """
+        Lists nodes from the collectors set.
+
+        Parameters
+        ----------
+        data : string or bool, default=False
+            If False only nodes ids are returned.
+            If True nodes ids are returned with their respective attribute dicts as (n, attrDict).
+            If a string is passed (with an attribute name) then its value is returned in a 2-tuple (n, attrValue).
+
+        Returns
+        -------
+        Either a list of tuples (n,attrDict) or (n,attrValue) where n is the node's id; or a list of nodes id's n.
+        """
+        return self._listNodes('collectors',data=data)
+
+    @property
+    def graph( self ):
+        """
+        A SCN (networkx graph) equivalent to this network. It is built on the first access and
+        cached. Changes to the graph are not reflected in this network.
+        """
+        if self._graph is None:
+            g = SCN(initialize_empty=True)
+            g.add_nodes_from(self.listCollectorsNodes(data=True))
+            g.add_nodes_from(self.listSpeciesNodes(data=True))
+            cols, spp, m = self._getBiadjMatrix()
+            self._graph = addEdgesFromMatrix(g, m, cols, spp, attr='count')
+        return self._graph
+
+    def _nodesCounts( self ):
+        return self._counts
+
+    def _fromAggregation( self, collectors, groups, m, collectorsCounts, groupsCounts ):
+        return self.fromBiadjMatrix( collectors, groups, m, collectorsCounts=collectorsCounts, speciesCounts=groupsCounts )
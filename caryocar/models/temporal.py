@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Temporal series of network models
+
+Records are assigned to time bins (e.g. years, from their eventDate) and sorted by bin only once.
+Snapshots of a network are taken over windows of consecutive bins, either fixed (one bin per
+snapshot) or sliding (several bins per snapshot, moving a few bins at a time). Each snapshot is
+derived from the previous one by adding the records of bins entering the window and removing those
+of bins leaving it, and the series is stored as a sequence of sparse matrices deltas.
+"""
+
+import numpy
+import scipy.sparse
+from .scn import SCN
+from .cwn import CWN
+from .sparsescn import SparseSCN
+from .matrices import encodeRecords, incidenceMatrix, coworkingMatrices, coworkingEdgesArrays, coworkingEdges
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2018"
+
+
+def binRecords( dates, bins ):
+    """
+    Assigns records to time bins.
+
+    Parameters
+    ----------
+    dates : array-like
+        The date of each record, e.g. a pandas Series of datetimes or an array of years.
+
+    bins : array-like
+        Sorted edges of bins, of the same type as dates. Bin i holds records dated in the
+        interval [bins[i], bins[i+1]).
+
+    Returns
+    -------
+    A 2-tuple (order, bounds), where order is an integer array with positions of records sorted by
+    bin, and records of bin i are order[bounds[i]:bounds[i+1]]. Records out of bins, or without a
+    date (NaT or NaN), are left out.
+    """
+    dates = numpy.asarray(dates)
+    bins = numpy.asarray(bins, dtype=dates.dtype)
+    recBins = numpy.searchsorted(bins, dates, side='right')-1
+    inBins = numpy.flatnonzero( (recBins>=0) & (recBins<len(bins)-1) )
+    order = inBins[ numpy.argsort(recBins[inBins], kind='stable') ]
+    bounds = numpy.searchsorted( recBins[order], numpy.arange(len(bins)) )
+    return order, bounds
+
+
+class _NetworkSeries:
+    """
+    A series of network snapshots over windows of consecutive time bins, stored as sparse matrices
+    deltas. Subclasses compute a tuple of sparse matrices (of the same shapes) for the records of
+    each bin, and build networks from the matrices of a snapshot.
+
+    Parameters
+    ----------
+    bins : array-like
+        Sorted edges of time bins.
+
+    window : int, default 1
+        Number of consecutive bins in each snapshot.
+
+    step : int, default 1
+        Number of bins between the starts of consecutive snapshots.
+    """
+    def __init__( self, bins, window=1, step=1 ):
+        if window<1 or step<1:
+            raise ValueError("window and step must be positive integers")
+        self.bins = numpy.asarray(bins)
+        starts = list(range(0, len(self.bins)-window, step))
+        self.windows = [ (self.bins[i],self.bins[i+window]) for i in starts ]
+        self._binsWindows = [ (i,i+window) for i in starts ]
+        self._deltas = []
+        self._state = None
+
+    def __len__( self ):
+        return len(self.windows)
+
+    def _computeDeltas( self, binMatrices ):
+        """
+        Computes deltas between consecutive snapshots from a function which returns the matrices of
+        a bin. Matrices of each bin are computed only once, and only while they are in a window.
+        """
+        cache = dict()
+        prev = range(0)
+        for lo,hi in self._binsWindows:
+            # bins entering the window are added, and bins leaving it are subtracted
+            curr = range(lo,hi)
+            changes = [ (b,1) for b in curr if b not in prev ] + [ (b,-1) for b in prev if b not in curr ]
+            for b,sign in changes:
+                if b not in cache: cache[b] = binMatrices(b)
+            delta = [ sum( sign*cache[b][i] for b,sign in changes ) for i in range(len(cache[lo])) ]
+            delta = tuple( scipy.sparse.csr_matrix(d) for d in delta )
+            for d in delta: d.eliminate_zeros()
+            self._deltas.append(delta)
+            for b in [ b for b in cache if b<lo ]: del cache[b]
+            prev = curr
+
+    def getDelta( self, k ):
+        """
+        Returns the tuple of sparse matrices which are added to snapshot k-1 to give snapshot k.
+        """
+        return self._deltas[k]
+
+    def _getState( self, k ):
+        """
+        Returns the tuple of sparse matrices of snapshot k. The last snapshot computed is kept, so
+        that going forward through the series only applies deltas.
+        """
+        if k<0: k += len(self)
+        if not 0<=k<len(self):
+            raise IndexError("snapshot index out of range")
+        if self._state is None or self._state[0]>k:
+            self._state = (-1, None)
+        i, mats = self._state
+        for j in range(i+1, k+1):
+            delta = self._deltas[j]
+            mats = delta if mats is None else tuple( m+d for m,d in zip(mats,delta) )
+            mats = tuple( scipy.sparse.csr_matrix(m) for m in mats )
+            for m in mats: m.eliminate_zeros()
+        self._state = (k, mats)
+        return mats
+
+    def snapshots( self, **kwargs ):
+        """
+        Iterates over snapshots, each derived from the previous one by applying a delta.
+
+        Returns
+        -------
+        A generator of 2-tuples (window, network), where window is a 2-tuple with the start and end
+        of the snapshot's time window. Arguments are passed to the snapshot builder.
+        """
+        for k,w in enumerate(self.windows):
+            yield w, self._snapshot(k, **kwargs)
+
+
+class SCNSeries(_NetworkSeries):
+    """
+    A series of species-collectors networks over time windows. The biadjacency matrix of each
+    snapshot is derived from the previous one by adding and removing the records of bins entering
+    and leaving its window, and only sparse deltas are stored.
+
+    Parameters
+    ----------
+    dates : array-like
+        The date of each record, e.g. the 'eventDate' column.
+
+    species : iterable
+        The species of each record.
+
+    collectors : iterable
+        An iterable of iterables with the collectors of each record.
+
+    bins : array-like
+        Sorted edges of time bins, of the same type as dates.
+
+    window : int, default 1
+        Number of consecutive bins in each snapshot. With a window of 1 bins are fixed.
+
+    step : int, default 1
+        Number of bins between the starts of consecutive snapshots.
+
+    namesMap (optional) : caryocar.NamesMap
+        A caryocar NamesMap object for normalizing collectors names.
+
+    Class methods
+    -------------
+    .getBiadjMatrix
+    .getSCN
+    .getDelta
+    .snapshots
+
+    Examples
+    --------
+    >>> bins = pandas.date_range('1900','2020',freq='YS')
+    >>> series = SCNSeries(occs['eventDate'], occs['species'], occs['recordedBy_atomized'], bins, window=10, namesMap=nm)
+    >>> for (start,end),scn in series.snapshots(sparse=True):
+    ...     print(start, len(scn.listCollectorsNodes()))
+    """
+    def __init__( self, dates, species, collectors, bins, window=1, step=1, namesMap=None ):
+        super().__init__(bins, window, step)
+        nmap = namesMap.getMap() if namesMap else None
+        self.collectors, self.species, colCodes, offsets, spCodes = encodeRecords(species, collectors, namesMap=nmap)
+        order, bounds = binRecords(dates, self.bins)
+        shape = (len(self.collectors), len(self.species))
+
+        # collectors of records are sorted by bin along with records
+        lengths = numpy.diff(offsets)[order]
+        pairs = numpy.repeat(offsets[:-1][order], lengths) + numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths)-lengths, lengths)
+        pairsBounds = numpy.concatenate([ [0], numpy.cumsum(lengths) ])[bounds]
+        colCodes, pairsSpecies, spCodes = colCodes[pairs], numpy.repeat(spCodes[order], lengths), spCodes[order]
+
+        def binMatrices(b):
+            p0, p1 = pairsBounds[b], pairsBounds[b+1]
+            m = scipy.sparse.csr_matrix( (numpy.ones(p1-p0,dtype=numpy.int64),(colCodes[p0:p1],pairsSpecies[p0:p1])), shape=shape )
+            m.sum_duplicates()
+            recs = spCodes[bounds[b]:bounds[b+1]]
+            counts = scipy.sparse.csr_matrix( (numpy.ones(len(recs),dtype=numpy.int64),(numpy.zeros(len(recs),dtype=numpy.int64),recs)), shape=(1,shape[1]) )
+            counts.sum_duplicates()
+            return m, counts
+        self._computeDeltas(binMatrices)
+
+    def getBiadjMatrix( self, k ):
+        """
+        Returns the biadjacency matrix of snapshot k, as a 5-tuple (collectors, species, m,
+        collectorsCounts, speciesCounts) with only nodes recorded in its window.
+        """
+        m, spCounts = self._getState(k)
+        rows = numpy.flatnonzero( m.getnnz(axis=1)>0 )
+        cols = numpy.flatnonzero( m.getnnz(axis=0)>0 )
+        m = m[rows][:,cols]
+        m.sort_indices()
+        return ( [ self.collectors[i] for i in rows.tolist() ], [ self.species[j] for j in cols.tolist() ], m,
+                 numpy.asarray(m.sum(axis=1)).ravel(), spCounts.toarray().ravel()[cols] )
+
+    def getSCN( self, k, sparse=False ):
+        """
+        Creates the SCN of snapshot k.
+
+        Parameters
+        ----------
+        k : int
+            Position of the snapshot in the series.
+
+        sparse : bool, default False
+            If set to True a matrix-native SparseSCN is returned instead.
+        """
+        return (SparseSCN if sparse else SCN).fromBiadjMatrix( *self.getBiadjMatrix(k) )
+
+    _snapshot = getSCN
+
+
+class CWNSeries(_NetworkSeries):
+    """
+    A series of coworking networks over time windows. The collector x collector counts and
+    hyperbolic weights matrices of each snapshot are derived from the previous one by adding and
+    removing the records of bins entering and leaving its window, and only sparse deltas are stored.
+
+    Parameters
+    ----------
+    dates : array-like
+        The date of each record, e.g. the 'eventDate' column.
+
+    cliques : iterable
+        An iterable of iterables containing the collectors of each record.
+
+    bins : array-like
+        Sorted edges of time bins, of the same type as dates.
+
+    window : int, default 1
+        Number of consecutive bins in each snapshot. With a window of 1 bins are fixed.
+
+    step : int, default 1
+        Number of bins between the starts of consecutive snapshots.
+
+    namesMap (optional) : caryocar.NamesMap
+        A caryocar NamesMap object for normalizing collectors names.
+
+    Class methods
+    -------------
+    .getCWN
+    .getDelta
+    .snapshots
+
+    Note
+    ----
+    Taxons recorded by edges are not kept in the series.
+    """
+    def __init__( self, dates, cliques, bins, window=1, step=1, namesMap=None ):
+        super().__init__(bins, window, step)
+        self.collectors, m = incidenceMatrix(cliques, namesMap=namesMap.getMap() if namesMap else None)
+        order, bounds = binRecords(dates, self.bins)
+        m = m[order]
+
+        def binMatrices(b):
+            mb = m[bounds[b]:bounds[b+1]]
+            counts, hyperb = coworkingMatrices(mb)
+            nodes = scipy.sparse.csr_matrix( mb.getnnz(axis=0).reshape(1,-1) )
+            return counts, hyperb, nodes
+        self._computeDeltas(binMatrices)
+
+    def getCWN( self, k ):
+        """
+        Creates the CWN of snapshot k, with only nodes recorded in its window.
+        """
+        counts, hyperb, nodes = self._getState(k)
+        labels = self.collectors
+        edges = coworkingEdges( labels, *coworkingEdgesArrays(counts, hyperb) )
+        nodes = nodes.tocoo()
+        return CWN.fromAggregates( dict( zip( map(labels.__getitem__,nodes.col.tolist()), nodes.data.tolist() ) ), edges )
+
+    _snapshot = getCWN
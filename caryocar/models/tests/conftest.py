@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+
+def assert_same_attributes(d1, d2, typesOnly=()):
+    '''Attributes dicts have the same keys, and values of the same types'''
+    assert set(d1)==set(d2)
+    for attr,val in d1.items():
+        assert type(d2[attr]) is type(val), attr
+        if attr in typesOnly:
+            continue
+        elif isinstance(val,float):
+            assert d2[attr]==pytest.approx(val)
+        else:
+            assert d2[attr]==val
+
+def assert_same_network(g1, g2):
+    '''Networks have the same nodes and edges, with the same attributes, and the same edges taxons'''
+    assert set(g1.nodes())==set(g2.nodes())
+    for n,d in g1.nodes(data=True):
+        assert_same_attributes(d, g2.nodes[n])
+    assert set(map(frozenset,g1.edges()))==set(map(frozenset,g2.edges()))
+    # taxons lists may be in different orders, so edges taxons are compared as counts
+    withTaxons = hasattr(g1,'getEdgeTaxons')
+    for u,v,d in g1.edges(data=True):
+        assert_same_attributes(d, g2.edges[(u,v)], typesOnly=('taxons',) if withTaxons else ())
+        if withTaxons:
+            assert g1.getEdgeTaxons(u,v)==g2.getEdgeTaxons(u,v)
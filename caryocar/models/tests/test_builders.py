@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import io
+import pickle
+import pytest
+from caryocar.models import SCN, CWN, SCNAccumulator, CWNAccumulator, ModelsBuilder
+from caryocar.models import mergeAccumulators, accumulateInParallel
+from caryocar.cleaning import NamesAtomizer, NamesMap, namesFromString
+from .conftest import assert_same_network
+
+@pytest.fixture
+def records():
+    '''Records with collectors cliques, species and taxons'''
+    collectors = [ ['a','b','c'],
+                   ['d','e'],
+                   ['a','c'],
+                   ['a','c'],
+                   ['c','d','e'],
+                   ['a','b','c','d'],
+                   ['a'],
+                   ['f','f'] ]
+    species = ['sp1','sp2','sp1','sp3','sp1','sp1','sp4','sp5']
+    taxons = ['t1','t2','t1','t3','t1','t1','t4','t5']
+    return collectors, species, taxons
+
+@pytest.mark.parametrize("batchSize",[1,3,8])
+def test_scn_accumulator_batches(records,batchSize):
+    '''A SCN accumulated batch by batch is the same as a SCN built at once'''
+    collectors, species, taxons = records
+    acc = SCNAccumulator()
+    for i in range(0,len(species),batchSize):
+        acc.addRecords(species[i:i+batchSize], collectors[i:i+batchSize])
+    assert_same_network(acc.toSCN(), SCN(species=species, collectors=collectors))
+    assert acc.toSparseSCN().listSpeciesNodes(data='count')==[ ('sp1',4), ('sp2',1), ('sp3',1), ('sp4',1), ('sp5',1) ]
+
+def test_scn_accumulator_species_without_collectors():
+    '''Species are counted over all batches, and only left out if they have no collectors at all'''
+    acc = SCNAccumulator()
+    acc.addRecords(['sp1','sp2'], [ [], ['a'] ])
+    acc.addRecords(['sp1','sp3'], [ ['b'], [] ])
+    scn = acc.toSCN()
+    assert dict(scn.nodes(data='count'))=={'sp1':2,'sp2':1,'a':1,'b':1}
+
+@pytest.mark.parametrize("batchSize",[1,3,8])
+@pytest.mark.parametrize("taxonsStorage",['counter','matrix'])
+def test_cwn_accumulator_batches(records,batchSize,taxonsStorage):
+    '''A CWN accumulated batch by batch is the same as a CWN built at once'''
+    collectors, species, taxons = records
+    acc = CWNAccumulator(taxonsStorage=taxonsStorage)
+    for i in range(0,len(collectors),batchSize):
+        acc.addRecords(collectors[i:i+batchSize], taxons=taxons[i:i+batchSize])
+    cwn = acc.toCWN()
+    expected = CWN(cliques=collectors, taxons=taxons, taxonsStorage=taxonsStorage)
+    assert_same_network(cwn, expected)
+    for u,v in expected.edges():
+        assert cwn.getEdgeTaxons(u,v)==expected.getEdgeTaxons(u,v)
+
+def test_cwn_accumulator_taxons_in_all_batches(records):
+    '''Batches with and without taxons cannot be mixed'''
+    collectors, species, taxons = records
+    acc = CWNAccumulator().addRecords(collectors[:2], taxons=taxons[:2])
+    with pytest.raises(ValueError):
+        acc.addRecords(collectors[2:])
+
+def test_models_builder_reads_occurrences_in_chunks():
+    '''Models built from an occurrence file read in chunks are the same as models built at once'''
+    pandas = pytest.importorskip('pandas')
+    df = pandas.DataFrame({ 'recordedBy':['Silva, J.; Souza, A.','Silva J','Lima, B.; Silva, J.',None,'Souza, A.','Lima, B.'],
+                            'species':['sp1','sp2','sp1','sp3',None,'sp2'],
+                            'family':['f1','f2','f1','f3','f3','f2'] })
+    f = io.StringIO( df.to_csv(sep='\t', index=False) )
+    na = NamesAtomizer(atomizeOp=namesFromString, replaces=[ (['Silva J'],'Silva, J.') ])
+    nm = NamesMap(names=[], normalizationFunc=lambda s: s.lower())
+    builder = ModelsBuilder(na, namesMap=nm, taxonsCol='family').readOccurrences(f, chunksize=2)
+    assert builder.nrecords==5
+    
+    # builders can be sent between processes, leaving the atomizer and names map behind
+    builder = pickle.loads(pickle.dumps(builder))
+
+    # records without species are still used by the CWN
+    scnRecords, cwnRecords = df.dropna(), df.dropna(subset=['recordedBy','family'])
+    col = na.atomize(scnRecords['recordedBy'])
+    assert_same_network( builder.getSCN(), SCN(species=scnRecords['species'], collectors=col, namesMap=nm) )
+    expected = CWN(cliques=na.atomize(cwnRecords['recordedBy']), taxons=cwnRecords['family'], namesMap=nm, taxonsStorage='counter')
+    assert_same_network( builder.getCWN(), expected )
+    
+    # the CWN does not depend on whether the SCN is built alongside
+    f.seek(0)
+    cwnOnly = ModelsBuilder(na, namesMap=nm, taxonsCol='family', models=('cwn',)).readOccurrences(f, chunksize=2)
+    assert_same_network( cwnOnly.getCWN(), expected )
+
+def accumulate_shard(shard):
+    collectors, species, taxons = shard
+    return CWNAccumulator().addRecords(collectors, taxons=taxons)
+
+@pytest.fixture
+def shards(records):
+    collectors, species, taxons = records
+    return [ (collectors[i:i+3],species[i:i+3],taxons[i:i+3]) for i in range(0,len(collectors),3) ]
+
+def test_accumulators_merge(records,shards):
+    '''Accumulators built on shards of records are merged into the models built at once, in any grouping'''
+    collectors, species, taxons = records
+    accs = [ SCNAccumulator().addRecords(spp,cols) for cols,spp,tx in shards ]
+    assert_same_network( mergeAccumulators(accs).toSCN(), SCN(species=species, collectors=collectors) )
+    
+    expected = CWN(cliques=collectors, taxons=taxons, taxonsStorage='counter')
+    accs = [ accumulate_shard(shard) for shard in shards ]
+    assert_same_network( mergeAccumulators(accs).toCWN(), expected )
+    accs = [ accumulate_shard(shard) for shard in shards ]
+    assert_same_network( accs[0].merge( accs[1].merge(accs[2]) ).toCWN(), expected )
+
+def test_accumulate_in_parallel(records,shards):
+    '''Accumulators are built on shards in a process pool and merged'''
+    collectors, species, taxons = records
+    cwn = accumulateInParallel(accumulate_shard, shards, processes=2).toCWN()
+    assert_same_network( cwn, CWN(cliques=collectors, taxons=taxons, taxonsStorage='counter') )
@@ -2,8 +2,10 @@
 
 import pytest
 import networkx
+from collections import Counter
 from caryocar.models import CWN
 from caryocar.cleaning import NamesMap
+from .conftest import assert_same_network
 
 @pytest.fixture
 def cwn():
@@ -113,13 +115,110 @@ def test_cwn_remapped_names_edge_counts(cwn_nm,u,v,expectedCount):
     '''Edges count attribute works for remapped names'''
     assert cwn_nm.edges[(u,v)].get('count')==expectedCount
     
+
+# sparse engine
+@pytest.fixture
+def cliques_taxons():
+    collectors = [ ['a','b','c'], 
+                   ['d','e'], 
+                   ['a','c'],
+                   ['a','c'],
+                   ['c','d','e'],
+                   ['a','b','c','d'],
+                   ['a'],
+                   ['f','f'] ]
+    taxons = ['t1','t2','t1','t3','t1','t1','t4','t5']
+    return collectors,taxons
+
+@pytest.mark.parametrize("with_taxons",[True,False])
+def test_cwn_sparse_engine_builds_same_network(cliques_taxons,with_taxons):
+    '''The sparse engine builds the same nodes and edges attributes as the python engine'''
+    collectors,taxons = cliques_taxons
+    taxons = taxons if with_taxons else None
+    cwn_py = CWN(cliques=collectors,taxons=taxons)
+    cwn_sp = CWN(cliques=collectors,taxons=taxons,engine='sparse')
+    assert dict(cwn_py.nodes(data=True))==dict(cwn_sp.nodes(data=True))
+    assert len(cwn_py.edges())==len(cwn_sp.edges())
+    for u,v,d in cwn_py.edges(data=True):
+        assert cwn_sp.edges[(u,v)]['count']==d['count']
+        assert cwn_sp.edges[(u,v)]['taxons']==d['taxons']
+        assert cwn_sp.edges[(u,v)]['weight_hyperbolic']==pytest.approx(d['weight_hyperbolic'])
+        
+def test_cwn_sparse_engine_namesmap(cwn_nm):
+    '''The sparse engine works with names maps'''
+    names=[ "col"+str(i) for i in range(1,7) ]
+    remapping={ 'col2':'col3', 'col4':'col5', 'col3':'COL3', 'col1':'COL_1' }
+    collectors = [ ['col1','col2','col3'], ['col1','col2'], ['col2','col3'], ['col2'], ['col1'], ['col4','col5'], ['col4'] ]
+    nm=NamesMap(names=names,normalizationFunc=lambda x: x, remappingIndex=remapping)
+    cwn_sp = CWN(cliques=collectors,namesMap=nm,engine='sparse')
+    assert dict(cwn_sp.nodes(data=True))==dict(cwn_nm.nodes(data=True))
+    assert cwn_sp.edges[('COL_1','COL3')]['count']==2
+    
+@pytest.mark.parametrize("engine",['python','sparse'])
+@pytest.mark.parametrize("taxonsStorage",['list','counter','matrix'])
+def test_cwn_edges_taxons_storage(cliques_taxons,engine,taxonsStorage):
+    '''Taxons recorded by edges can be queried regardless of how they are stored'''
+    collectors,taxons = cliques_taxons
+    cwn = CWN(cliques=collectors,taxons=taxons,engine=engine,taxonsStorage=taxonsStorage)
+    assert cwn.getEdgeTaxons('a','c')==Counter({'t1':3,'t3':1})
+    assert cwn.getEdgeTaxons('e','d')==Counter({'t2':1,'t1':1})
+    with pytest.raises(KeyError):
+        cwn.getEdgeTaxons('a','e')
+        
+def test_cwn_edges_taxons_without_taxons(cliques_taxons):
+    '''Edges taxons are None if the network is built without taxons'''
+    collectors,taxons = cliques_taxons
+    cwn = CWN(cliques=collectors,taxonsStorage='matrix')
+    assert cwn.getEdgeTaxons('a','c') is None
+
+@pytest.mark.parametrize("engine",['python','sparse'])
+@pytest.mark.parametrize("taxonsStorage",['list','counter','matrix'])
+def test_cwn_add_remove_records(cliques_taxons,engine,taxonsStorage):
+    '''Records added or removed in place give the same network as built from scratch'''
+    collectors,taxons = cliques_taxons
+    cwn = CWN(cliques=collectors[:3],taxons=taxons[:3],engine=engine,taxonsStorage=taxonsStorage)
+    cwn.add_records(collectors[3:],taxons=taxons[3:])
+    assert_same_network(cwn, CWN(cliques=collectors,taxons=taxons,taxonsStorage=taxonsStorage))
+    
+    cwn.remove_records(collectors[:2],taxons=taxons[:2])
+    assert_same_network(cwn, CWN(cliques=collectors[2:],taxons=taxons[2:],taxonsStorage=taxonsStorage))
+    assert cwn.nodes['b']['count']==1
+
+def test_cwn_remove_missing_records_raises(cliques_taxons):
+    '''Removing records which are not in the network raises a ValueError, leaving it unchanged'''
+    collectors,taxons = cliques_taxons
+    cwn = CWN(cliques=collectors,taxons=taxons,taxonsStorage='counter')
+    with pytest.raises(ValueError):
+        cwn.remove_records([ ['a','b'], ['a','e'] ])
+    with pytest.raises(ValueError):
+        cwn.remove_records([ ['d','e'] ], taxons=['t3'])
+    assert_same_network(cwn, CWN(cliques=collectors,taxons=taxons,taxonsStorage='counter'))
+
+@pytest.mark.parametrize("taxonsStorage",['list','counter','matrix'])
+def test_cwn_records_taxons_mismatch_raises(taxonsStorage):
+    '''Records with and without taxons cannot be mixed in a network'''
+    cwn = CWN(cliques=[['a','b']],taxons=['t1'],engine='sparse',taxonsStorage=taxonsStorage)
+    with pytest.raises(ValueError):
+        cwn.add_records([ ['a','b'], ['a','c'] ])
+    with pytest.raises(ValueError):
+        cwn.remove_records([ ['a','b'] ])
+    assert cwn.edges[('a','b')]['count']==1
+    
+    cwn = CWN(cliques=[['a','b']])
+    with pytest.raises(ValueError):
+        cwn.add_records([ ['a','c'] ], taxons=['t1'])
+    cwn = CWN(cliques=[['a']])
+    cwn.add_records([ ['a','c'] ], taxons=['t1'])
+    assert cwn.getEdgeTaxons('a','c')=={'t1':1}
+
+def test_cwn_invalid_engine_raises():
+    '''An unknown engine raises a ValueError'''
+    with pytest.raises(ValueError):
+        CWN(cliques=[['a','b']],engine='foo')
     
 # TODO:
 # Test: SCN does not allow 0-degree nodes
-# Test: SCN biadj matrix does not change on querying operations
-# Test: SCN biadj matrix querying operations retrieve copies of matrix
 # Test: CWN hyperbolic weighting in edge attribs.
-# Test: CWN taxons in edge attribs.
     
 # Execute tests above on script run
 if __name__ == '__main__':
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from caryocar.models import CWN, HyperCWN
+from .conftest import assert_same_network
+
+@pytest.fixture
+def records():
+    '''Records with collectors cliques and taxons, with repeated teams'''
+    collectors = [ ['a','b','c'],
+                   ['d','e'],
+                   ['a','c'],
+                   ['c','a'],
+                   ['c','d','e'],
+                   ['a','b','c','d'],
+                   ['a'],
+                   ['f','f'],
+                   [],
+                   ['b','c','a'] ]
+    taxons = ['t1','t2','t1','t3','t1','t1','t4','t5','t6','t2']
+    return collectors, taxons
+
+def test_hypercwn_teams(records):
+    '''Each distinct team is stored once, with its multiplicity and taxons'''
+    collectors, taxons = records
+    hcwn = HyperCWN(cliques=collectors, taxons=taxons)
+    teams = dict( hcwn.listTeams(data=True) )
+    assert len(teams)==7
+    assert teams[('a','b','c')]['count']==2
+    assert teams[('a','b','c')]['taxons']=={'t1':1,'t2':1}
+    assert teams[('f',)]['count']==1
+    assert sorted(hcwn.listCollectors(data='count'))==sorted(CWN(cliques=collectors).nodes(data='count'))
+
+def test_hypercwn_lazy_queries(records):
+    '''Edges attributes and collaborators are the same as those of a CWN'''
+    collectors, taxons = records
+    hcwn = HyperCWN(cliques=collectors, taxons=taxons)
+    cwn = CWN(cliques=collectors, taxons=taxons, taxonsStorage='counter')
+    for u,v,d in cwn.edges(data=True):
+        assert hcwn.getEdge(u,v)['count']==d['count']
+        assert hcwn.getEdge(v,u)['weight_hyperbolic']==pytest.approx(d['weight_hyperbolic'])
+        assert hcwn.getEdgeTaxons(u,v)==cwn.getEdgeTaxons(u,v)
+    for n in cwn.nodes():
+        assert sorted(hcwn.listCollaborators(n))==sorted(cwn.neighbors(n))
+        for m,d in hcwn.listCollaborations(n):
+            assert d['count']==cwn.edges[(n,m)]['count']
+    with pytest.raises(KeyError):
+        hcwn.getEdge('a','e')
+    with pytest.raises(KeyError):
+        hcwn.getEdge('f','f')
+
+@pytest.mark.parametrize("taxonsStorage",['counter','matrix'])
+def test_hypercwn_materialized_graph(records,taxonsStorage):
+    '''Pairwise graphs are materialized for the whole network or for selected collectors'''
+    collectors, taxons = records
+    hcwn = HyperCWN(cliques=collectors, taxons=taxons)
+    expected = CWN(cliques=collectors, taxons=taxons, taxonsStorage='counter')
+    assert_same_network(hcwn.graph, expected)
+    assert all( type(c) is int for u,v,c in hcwn.graph.edges(data='count') )
+
+    sub = hcwn.subgraph(['a','b','d'], taxonsStorage=taxonsStorage)
+    expected = CWN(cliques=collectors, taxons=taxons, taxonsStorage=taxonsStorage)
+    expected.remove_nodes_from(['c','e','f'])
+    assert_same_network(sub, expected)
+
+def test_hypercwn_without_taxons(records):
+    '''Networks built without taxons have no edges taxons'''
+    collectors, taxons = records
+    hcwn = HyperCWN(cliques=collectors)
+    assert hcwn.getEdgeTaxons('a','b') is None
+    assert_same_network(hcwn.graph, CWN(cliques=collectors))
+    assert len(HyperCWN().listTeams())==0
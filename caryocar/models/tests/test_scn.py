@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy
+from caryocar.models import SCN, SparseSCN
+
+@pytest.fixture
+def scn():
+    '''A Species-Collectors Network'''
+    cols=[ ['col1','col2','col3'],
+           ['col1','col2'],
+           ['col2','col3'],
+           ['col4','col5'],
+           ['col4'],
+           ['col5','col4'] ]
+    spp=['sp1','sp2','sp3','sp2','sp3','sp2']
+    return SCN(species=spp, collectors=cols)
+
+def test_scn_nodes_and_edges_counts(scn):
+    '''Nodes and edges count attributes keep record of the number of records'''
+    assert dict(scn.nodes(data='count'))=={'sp1':1,'sp2':3,'sp3':2,'col1':2,'col2':3,'col3':2,'col4':3,'col5':2}
+    assert scn.edges[('sp2','col4')]['count']==2
+    assert scn.nodes['sp1']['bipartite']==1 and scn.nodes['col1']['bipartite']==0
+
+def test_scn_from_pandas_series(scn):
+    '''A SCN can be built from pandas Series, with collectors atomized as lists or tuples'''
+    pandas = pytest.importorskip('pandas')
+    spp = pandas.Series(['sp1','sp2','sp3','sp2','sp3','sp2'])
+    cols = pandas.Series([ ('col1','col2','col3'), ('col1','col2'), ('col2','col3'), ('col4','col5'), ('col4',), ('col5','col4') ])
+    g = SCN(species=spp, collectors=cols)
+    assert dict(g.nodes(data=True))==dict(scn.nodes(data=True))
+    assert all( scn.edges[(u,v)]['count']==c for u,v,c in g.edges(data='count') )
+
+def test_scn_from_names_column(scn):
+    '''A SCN can be built from collectors atomized into a flat names array with offsets'''
+    from caryocar.cleaning import namesFromColumn
+    cols = namesFromColumn(['col1;col2;col3','col1;col2','col2;col3','col4;col5','col4','col5;col4'])
+    spp = ['sp1','sp2','sp3','sp2','sp3','sp2']
+    g = SCN(species=spp, collectors=cols)
+    assert dict(g.nodes(data='count'))==dict(scn.nodes(data='count'))
+    assert dict(g.edges)==dict(scn.edges)
+
+@pytest.mark.parametrize("spp,cols",[
+        (['sp1','sp2'],[['col1']]),
+        (['sp1'],['col1']),
+        ([1],[['col1']]) ])
+def test_scn_invalid_input_raises(spp,cols):
+    '''Invalid records raise ValueError'''
+    with pytest.raises(ValueError):
+        SCN(species=spp, collectors=cols)
+
+@pytest.mark.parametrize("col,expectedBag",[
+        ('col1',{'sp1':1,'sp2':1}),
+        ('col4',{'sp2':2,'sp3':1}) ])
+def test_scn_species_bag(scn,col,expectedBag):
+    '''The species bag of a collector holds counts of its records of each species'''
+    spp,vector = scn.getSpeciesBag(col)
+    bag = dict( (spp[j],c) for j,c in zip(vector.indices,vector.data) )
+    assert bag==expectedBag
+
+@pytest.mark.parametrize("sp,expectedInterest",[
+        ('sp1',{'col1':1,'col2':1,'col3':1}),
+        ('sp2',{'col1':1,'col2':1,'col4':2,'col5':2}) ])
+def test_scn_interest_vector(scn,sp,expectedInterest):
+    '''The interest vector of a species holds counts of records of that species by each collector'''
+    cols,vector = scn.getInterestVector(sp)
+    interest = dict( (cols[i],c) for i,c in zip(vector.indices,vector.data) )
+    assert interest==expectedInterest
+
+def test_scn_biadj_matrix_unchanged_by_queries(scn):
+    '''SCN biadj matrix does not change on querying operations'''
+    m_before = scn._getBiadjMatrix(copy=True)[2].toarray()
+    scn.getSpeciesBag('col1')
+    scn.getInterestVector('sp2')
+    scn.project('collectors')
+    scn.project('species',rule='cosine_similarity')
+    assert numpy.array_equal( scn._getBiadjMatrix()[2].toarray(), m_before )
+
+def test_scn_biadj_matrix_queries_are_read_only(scn):
+    '''SCN biadj matrix is shared without copying, and cannot be modified in place'''
+    assert scn._getBiadjMatrix()[2] is scn._getBiadjMatrix()[2]
+    spp,vector = scn.getSpeciesBag('col1')
+    with pytest.raises(ValueError):
+        vector.data[0] = 10
+
+def test_scn_biadj_matrix_invalidated_on_nodes_removal(scn):
+    '''SCN cached biadj matrix is rebuilt after nodes are removed'''
+    cols,spp,m = scn._getBiadjMatrix()
+    version = scn.version
+    scn.remove_nodes_from(['col1'])
+    cols,spp,m = scn._getBiadjMatrix()
+    assert scn.version>version
+    assert 'col1' not in cols
+    assert m.shape==(4,3)
+
+def test_scn_biadj_matrix_invalidated_on_edge_addition(scn):
+    '''SCN cached biadj matrix and projections are rebuilt after edges are added'''
+    g = scn.project('collectors',thresh=2)
+    assert not g.has_edge('col1','col4')
+    scn.add_edge('col1','sp3',count=2)
+    spp,vector = scn.getSpeciesBag('col1')
+    assert vector.toarray().tolist()==[[1,1,2]]
+    assert scn.project('collectors',thresh=2).has_edge('col1','col4')
+
+@pytest.mark.parametrize("blockSize",[1,2,1024])
+def test_scn_projection_cosine_similarity_blocks(scn,blockSize):
+    '''Cosine similarity projection gives the same weights regardless of the block size'''
+    g = scn.project('collectors',rule='cosine_similarity',blockSize=blockSize)
+    assert g.edges[('col1','col2')]['weight']==pytest.approx(2/(2**.5*3**.5))
+    assert g.edges[('col4','col5')]['weight']==pytest.approx(4/(5**.5*4**.5))
+    assert len(g.edges())==9
+
+def test_scn_projection_cosine_similarity_thresh_topk(scn):
+    '''Cosine similarity projection honours threshold and top-k arguments'''
+    g = scn.project('collectors',rule='cosine_similarity',thresh=0.8)
+    assert all( w>=0.8 for u,v,w in g.edges(data='weight') )
+    g = scn.project('collectors',rule='cosine_similarity',topK=1)
+    assert all( g.degree(n)>=1 for n in g.nodes() )
+    assert len(g.edges())<9
+    with pytest.raises(ValueError):
+        scn.project('collectors',rule='simple_weighting',topK=1)
+
+@pytest.mark.parametrize("u,v,expectedWeight",[
+        ('col1','col2',2.0),
+        ('col1','col4',1.5),
+        ('col4','col5',2.0) ])
+def test_scn_projection_additive_weighting(scn,u,v,expectedWeight):
+    '''Additive weighting sums up mean counts of records of common neighbors, with or without threshold'''
+    assert scn.project('collectors',rule='additive_weighting').edges[(u,v)]['weight']==expectedWeight
+    g = scn.project('collectors',rule='additive_weighting',thresh=2)
+    assert g.has_edge(u,v)==(expectedWeight>=2)
+
+@pytest.mark.parametrize("rule",['simple_weighting','additive_weighting','cosine_similarity'])
+def test_scn_projection_as_matrix(scn,rule):
+    '''Projections can be returned as symmetric sparse weights matrices, with the same weights as graphs'''
+    g = scn.project('species',rule=rule)
+    nodes,m = scn.project('species',rule=rule,asMatrix=True)
+    assert (m!=m.T).nnz==0
+    assert m.diagonal().sum()==0
+    ix = dict( (n,i) for i,n in enumerate(nodes) )
+    assert m.nnz==2*len(g.edges())
+    assert all( m[ix[u],ix[v]]==pytest.approx(w) for u,v,w in g.edges(data='weight') )
+
+def test_scn_from_crs_biadj_matrix(scn):
+    '''A SCN can be created from a biadjacency matrix'''
+    cols,spp,m = scn._getBiadjMatrix()
+    g = SCN.fromCrsBiadjMatrix(spp,cols,m.T.tocsr())
+    assert set(map(frozenset,g.edges()))==set(map(frozenset,scn.edges()))
+    assert all( scn.edges[(u,v)]['count']==c for u,v,c in g.edges(data='count') )
+
+def test_scn_taxonomic_aggregation(scn):
+    '''Taxonomic aggregation sums up species counts and edges counts of species in each group'''
+    g = scn.taxonomicAggregation({ 'fam1':{'sp1','sp2'}, 'fam2':{'sp3','sp4'}, 'fam3':{'sp5'} })
+    assert dict(g.listSpeciesNodes(data='count'))=={'fam1':4,'fam2':2}
+    assert dict(g.listCollectorsNodes(data='count'))==dict(scn.listCollectorsNodes(data='count'))
+    assert g.edges[('col1','fam1')]['count']==2
+    assert g.edges[('col4','fam1')]['count']==2
+
+def test_scn_taxonomic_aggregations_levels(scn):
+    '''Several grouping levels are aggregated at once, from groupings of either form'''
+    aggregs = scn.taxonomicAggregations({ 'genus': {'sp1':'gen1','sp2':'gen1','sp3':'gen2'},
+                                          'family': {'fam1':{'sp1','sp2','sp3'}} })
+    assert dict(aggregs['genus'].listSpeciesNodes(data='count'))=={'gen1':4,'gen2':2}
+    assert dict(aggregs['family'].listSpeciesNodes(data='count'))=={'fam1':6}
+    assert aggregs['family'].edges[('col4','fam1')]['count']==3
+    g = scn.taxonomicAggregation({'gen1':{'sp1','sp2'},'gen2':{'sp3'}})
+    assert all( g.edges[(u,v)]['count']==c for u,v,c in aggregs['genus'].edges(data='count') )
+
+# matrix-native SCN
+@pytest.fixture
+def sparse_scn():
+    '''A matrix-native Species-Collectors Network'''
+    cols=[ ['col1','col2','col3'],
+           ['col1','col2'],
+           ['col2','col3'],
+           ['col4','col5'],
+           ['col4'],
+           ['col5','col4'] ]
+    spp=['sp1','sp2','sp3','sp2','sp3','sp2']
+    return SparseSCN(species=spp, collectors=cols)
+
+def test_sparse_scn_graph_view(scn,sparse_scn):
+    '''The graph view of a matrix-native SCN is the same as the SCN built from the same records'''
+    g = sparse_scn.graph
+    assert isinstance(g,SCN)
+    assert dict(g.nodes(data=True))==dict(scn.nodes(data=True))
+    assert set(map(frozenset,g.edges()))==set(map(frozenset,scn.edges()))
+    assert all( scn.edges[(u,v)]['count']==c for u,v,c in g.edges(data='count') )
+    assert sparse_scn.graph is g
+
+@pytest.mark.parametrize("rule",['simple_weighting','additive_weighting','cosine_similarity'])
+def test_sparse_scn_projections(scn,sparse_scn,rule):
+    '''Projections of a matrix-native SCN have the same weights as those of a SCN'''
+    g, g_sparse = scn.project('collectors',rule=rule), sparse_scn.project('collectors',rule=rule)
+    assert dict(g.nodes(data=True))==dict(g_sparse.nodes(data=True))
+    assert all( g_sparse.edges[(u,v)]['weight']==pytest.approx(w) for u,v,w in g.edges(data='weight') )
+
+def test_sparse_scn_queries(sparse_scn):
+    '''Species bags and nodes counts are queried from a matrix-native SCN'''
+    spp,vector = sparse_scn.getSpeciesBag('col4')
+    assert dict( (spp[j],c) for j,c in zip(vector.indices,vector.data) )=={'sp2':2,'sp3':1}
+    assert dict(sparse_scn.listSpeciesNodes(data='count'))=={'sp1':1,'sp2':3,'sp3':2}
+
+def test_sparse_scn_leaves_inputs_unchanged():
+    '''Arrays and unsorted matrices given to a matrix-native SCN are neither frozen nor reordered'''
+    import scipy.sparse
+    m = scipy.sparse.csr_matrix( (numpy.array([1,2,3]),numpy.array([1,0,1]),numpy.array([0,2,3])), shape=(2,2) )
+    cc, sc = numpy.array([3,3]), numpy.array([2,4])
+    scn = SparseSCN.fromBiadjMatrix(['col1','col2'], ['sp1','sp2'], m, cc, sc)
+    assert not m.has_sorted_indices and m.indices.tolist()==[1,0,1]
+    assert m.data.flags.writeable and cc.flags.writeable and sc.flags.writeable
+    cc[0] = 0
+    assert scn.listCollectorsNodes(data='count')==[ ('col1',3), ('col2',3) ]
+
+def test_sparse_scn_taxonomic_aggregation(scn,sparse_scn):
+    '''Taxonomic aggregation of a matrix-native SCN gives the same network as that of a SCN'''
+    grouping = { 'fam1':{'sp1','sp2'}, 'fam2':{'sp3','sp4'}, 'fam3':{'sp5'} }
+    g, g_sparse = scn.taxonomicAggregation(grouping), sparse_scn.taxonomicAggregation(grouping).graph
+    assert dict(g.nodes(data=True))==dict(g_sparse.nodes(data=True))
+    assert all( g_sparse.edges[(u,v)]['count']==c for u,v,c in g.edges(data='count') )
+
+def test_scn_add_remove_records(scn):
+    '''Records added or removed in place give the same network as built from scratch'''
+    cols = [ ['col1','col2','col3'], ['col1','col2'], ['col2','col3'], ['col4','col5'], ['col4'], ['col5','col4'], [] ]
+    spp = ['sp1','sp2','sp3','sp2','sp3','sp2','sp4']
+    g = SCN(species=spp[:2], collectors=cols[:2])
+    g.getSpeciesBag('col1')
+    version = g.version
+    g.add_records(spp[2:], cols[2:])
+    assert g.version>version
+    assert dict(g.nodes(data=True))==dict(scn.nodes(data=True))
+    assert dict( (frozenset(e),c) for *e,c in g.edges(data='count') )==dict( (frozenset(e),c) for *e,c in scn.edges(data='count') )
+    assert g.getSpeciesBag('col4')[1].sum()==3
+    
+    g.remove_records(spp[:3], cols[:3])
+    expected = SCN(species=spp[3:], collectors=cols[3:])
+    assert dict(g.nodes(data=True))==dict(expected.nodes(data=True))
+    assert dict( (frozenset(e),c) for *e,c in g.edges(data='count') )==dict( (frozenset(e),c) for *e,c in expected.edges(data='count') )
+    with pytest.raises(ValueError):
+        g.remove_records(['sp1'], [['col1']])
+
+# Execute tests above on script run
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy
+from caryocar.models import SCN, CWN, SCNSeries, CWNSeries
+from caryocar.cleaning import NamesMap
+from .conftest import assert_same_network
+
+@pytest.fixture
+def records():
+    '''Records with years, collectors cliques and species'''
+    years = [ 2001, 2001, 2002, 2003, 2003, 2004, 2005, 2010, 1990 ]
+    collectors = [ ['a','b','c'],
+                   ['d','e'],
+                   ['a','c'],
+                   ['a','c'],
+                   ['c','d','e'],
+                   ['a','b','c','d'],
+                   ['A'],
+                   ['f'],
+                   ['g'] ]
+    species = ['sp1','sp2','sp1','sp3','sp1','sp1','sp4','sp5','sp6']
+    return years, collectors, species
+
+@pytest.mark.parametrize("window,step",[(1,1),(3,1),(2,2),(1,3)])
+def test_scn_series_snapshots(records,window,step):
+    '''Each snapshot is the same as a SCN built from records of its window'''
+    years, collectors, species = records
+    nm = NamesMap(names=[ n for c in collectors for n in c ], normalizationFunc=lambda s: s.lower())
+    bins = numpy.arange(2000,2008)
+    series = SCNSeries(years, species, collectors, bins, window=window, step=step, namesMap=nm)
+    assert series.windows==[ (bins[i],bins[i+window]) for i in range(0,len(bins)-window,step) ]
+    for k,((start,end),scn) in enumerate(series.snapshots()):
+        recs = [ i for i,y in enumerate(years) if start<=y<end ]
+        expected = SCN(species=[ species[i] for i in recs ], collectors=[ collectors[i] for i in recs ], namesMap=nm)
+        assert_same_network(scn, expected)
+        assert sorted(series.getSCN(k,sparse=True).listCollectorsNodes())==sorted(expected.listCollectorsNodes())
+
+@pytest.mark.parametrize("window,step",[(1,1),(3,1),(2,2)])
+def test_cwn_series_snapshots(records,window,step):
+    '''Each snapshot is the same as a CWN built from records of its window'''
+    years, collectors, species = records
+    bins = numpy.arange(2000,2008)
+    series = CWNSeries(years, collectors, bins, window=window, step=step)
+    for (start,end),cwn in series.snapshots():
+        expected = CWN(cliques=[ c for c,y in zip(collectors,years) if start<=y<end ])
+        assert_same_network(cwn, expected)
+
+    # snapshots are also taken out of order
+    assert_same_network( series.getCWN(0), CWN(cliques=[ c for c,y in zip(collectors,years) if bins[0]<=y<bins[window] ]) )
+
+def test_series_datetime_bins(records):
+    '''Records are binned by dates, and records without dates are left out'''
+    pandas = pytest.importorskip('pandas')
+    years, collectors, species = records
+    dates = pandas.to_datetime( [ '{}-06-01'.format(y) for y in years[:-1] ] + [None] )
+    bins = pandas.date_range('2000','2006',freq='YS')
+    series = SCNSeries(dates, species, collectors, bins, window=6)
+    assert len(series)==1
+    assert_same_network( series.getSCN(0), SCN(species=species[:7], collectors=collectors[:7]) )
+    delta = series.getDelta(0)
+    assert delta[0].shape==(len(series.collectors),len(series.species))